@@ -1,16 +1,17 @@
 import numpy as np
-import shutil, sys, os, pickle
+import shutil, sys, os
 sys.path.append("..")
-from utils import save_volume, data_IO, arg_parser, model
+from utils import model_registry, latent_traversal, latent_store
 import tensorflow as tf
 
 os.environ["CUDA_VISIBLE_DEVICES"] = "0"
-ConFig=tf.ConfigProto()
-ConFig.gpu_options.allow_growth=True
-session=tf.Session(config=ConFig)
 
 
 def main():
+    # created here and not at import, the spawned worker processes import this script too
+    ConFig=tf.ConfigProto()
+    ConFig.gpu_options.allow_growth=True
+    session=tf.Session(config=ConFig)
 
     latent_dims = 128
 
@@ -19,36 +20,20 @@ def main():
         os.makedirs(interpolation_save_path)
     shutil.copy2(__file__, interpolation_save_path)
 
-    latent_vector_file1 = open('/home/zmy/Downloads/bothTrain_lessFC_uniLoss1/voxel_latent_dict/voxel_latent_dict_chair_all.pkl', 'rb')
+    latent_store1 = latent_store.LatentStore('/home/zmy/Downloads/bothTrain_lessFC_uniLoss1/voxel_latent_dict/voxel_latent_store_chair_all')
     weights_path = '/home/zmy/Downloads/bothTrain_lessFC_uniLoss1/weightsEnd_voxDecoder.h5'
 
-    object1 = '1a6f615e8b1b5ae4dbbc9440457e303e'
-    latent_vector_dict1 = pickle.load(latent_vector_file1)
+    # one or more seed objects, the traversals of several seeds are saved in one sub folder per object
+    objects = ['1a6f615e8b1b5ae4dbbc9440457e303e']
 
-    # Print every dimension of latent vector
-    p1 = latent_vector_dict1[object1+'_z_mean']
+    # Every dimension of the latent vector of each seed swept over [-5, 5]
+    seeds = latent_store1.get_batch(objects, 'z_mean')
 
-    for i_th_dim in range(latent_dims):
-
-        i_interpolation_save_path = os.path.join(interpolation_save_path,'%d_th_dim'%i_th_dim)
-
-        one_dim_changing_latents = np.tile(p1, (11,1))
-        one_dim_changing_latents[:, i_th_dim] = np.linspace(-5.0,5.0,11)
-
-        # Define the decoder model
-        decoder = model.get_voxel_decoder(latent_dims)
-        decoder.load_weights(weights_path,by_name=True)
-        reconstructions = decoder.predict(one_dim_changing_latents)
-
-        reconstructions[reconstructions > 0] = 1
-        reconstructions[reconstructions < 0] = 0
-
-        if not os.path.exists(i_interpolation_save_path):
-            os.makedirs(i_interpolation_save_path)
-
-        for i in range(reconstructions.shape[0]):
-            name = str(i)
-            save_volume.save_binvox_output(reconstructions[i, 0, :], name, i_interpolation_save_path, '_gen', save_bin= True, save_img= True)
+    # Define the decoder model
+    decoder = model_registry.get_voxel_decoder(latent_dims, weights_path)
+    latent_traversal.traverse(model_registry.get_thresholded_model(decoder), seeds, interpolation_save_path,
+                              seed_names=objects if len(objects) > 1 else None, steps=11, value_range=(-5.0, 5.0),
+                              batch_size=256, save_bin=True, save_img=True)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
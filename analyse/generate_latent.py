@@ -1,32 +1,162 @@
 import numpy as np
-import shutil, sys, os, pickle
+import shutil, sys, os, functools, multiprocessing
 
 sys.path.append("..")
 
 from MMI import *
-from utils import save_volume, data_IO, arg_parser, model
+from utils import save_volume, data_IO, arg_parser, metrics, model_registry, latent_store, batching
 
-from utils import model
-from tensorflow.keras.models import Model
-from tensorflow.keras.layers import Input
 from sklearn.utils import shuffle
 import time
 
 os.environ["CUDA_VISIBLE_DEVICES"] = "0"
-ConFig = tf.ConfigProto()
-ConFig.gpu_options.allow_growth = True
-session = tf.Session(config=ConFig)
 
 
-def latent2dict(hash, z_mean, z_logvar, z):
-    output = {}
-    for i in range(len(hash)):
-        output[hash[i] + '_z_mean'] = z_mean[i]
-        output[hash[i] + '_z_logvar'] = z_logvar[i]
-        output[hash[i] + '_z'] = z[i]
-    return output
+def encode_to_store(encoder, load, items, ids, categories, path, batch_size, num_workers=4, use_processes=False,
+                    split='', new_store=True, fingerprints=None, weights_hash=None):
+    """
+    Encode the objects batch by batch into a new latent store. The batches are loaded by a pool of workers while
+    the encoder predicts, every batch is appended to the store as soon as it is predicted, so the run is bound by
+    the slower of loading and predicting and only a few batches are in memory.
+    Args:
+        load: function(items[start:end]) -> encoder inputs of the objects ids[start:end], see batching.prefetch_batches
+        categories: category of every object, e.g. the class labels, or None
+        new_store: replace the store in path, otherwise the objects are appended to it
+        fingerprints, weights_hash: recorded in the store for latent_store.prune, see latent_store.append_latents
+    """
+    if new_store and os.path.exists(path):
+        shutil.rmtree(path)
+    # the ids of the store are read once, the appends check the batches against this set
+    known_ids = latent_store.store_ids(path)
+    num_objects = len(ids)
+    num_batches = (num_objects + batch_size - 1) // batch_size
+    wait_time, predict_time = 0., 0.
+    begin = tic = time.time()
+    for i, (start, inputs) in enumerate(batching.prefetch_batches(load, items, batch_size, num_workers,
+                                                                  use_processes)):
+        loaded = time.time()
+        z_mean, z_logvar, z = encoder.predict(inputs, batch_size=batch_size)
+        latent_store.append_latents(path, ids[start:start + batch_size], z_mean, z_logvar, z,
+                                    categories=None if categories is None else
+                                    [str(c) for c in categories[start:start + batch_size]],
+                                    fingerprints=None if fingerprints is None else
+                                    fingerprints[start:start + batch_size], weights_hash=weights_hash,
+                                    known_ids=known_ids)
+        wait_time += loaded - tic
+        tic = time.time()
+        predict_time += tic - loaded
+        # most of the time spent waiting for inputs means the loading is the bottleneck, add workers
+        print("Predicting %s batch: %d/%d, %.1f objects/s, %.1fs waiting for inputs, %.1fs predicting"
+              % (split, i + 1, num_batches, (start + inputs.shape[0]) / (tic - begin), wait_time, predict_time))
+
+
+def shapenet_latent_store_path(args):
+    if args.input_form == 'voxel':
+        return os.path.join(args.save_dir, 'voxel_latent_dict', 'voxel_latent_store_table_all')
+    return os.path.join(args.save_dir, 'image_latent_dict', 'latent_store')
+
+
+def shapenet_data_path(args):
+    return args.voxel_data_dir if args.input_form == 'voxel' else args.image_data_dir
+
+
+def encoder_weights_path(args):
+    return os.path.join(args.weights_dir, model_registry.VOXEL_ENCODER_WEIGHTS if args.input_form == 'voxel' else
+                        model_registry.IMAGE_ENCODER_WEIGHTS)
+
+
+def shapenet_encoder(args):
+    """
+    Returns: the encoder of args.input_form and the function loading a batch of its inputs from object directories
+    """
+    if args.input_form == 'voxel':
+        return model_registry.get_encoder('voxel', args.latent_vector_size, args.weights_dir), \
+               data_IO.voxelPathList2matrix
+    return model_registry.get_encoder('image', args.latent_vector_size, args.weights_dir,
+                                      g.VIEWS_IMAGE_SHAPE_SHAPENET), \
+           functools.partial(data_IO.imagePathList2matrix, train=False)
+
+
+def encode_stale_objects(args, ids, path, split=''):
+    """
+    Encode the objects of ids that are new or changed since the store in path was written and append them to it,
+    every object is encoded again if the encoder weights changed
+    """
+    data_path = shapenet_data_path(args)
+    paths = [os.path.join(data_path, id) for id in ids]
+    fingerprints = [latent_store.input_fingerprint(object_path) for object_path in paths]
+    weights_hash = latent_store.file_hash(encoder_weights_path(args))
+    stale = set(latent_store.prune(path, ids, fingerprints, weights_hash))
+    rows = [i for i, id in enumerate(ids) if id in stale]
+    print("Encoding %d of %d objects%s, the others are up to date" % (len(rows), len(ids), ' of ' + split if split else ''))
+    if not rows:
+        return
+
+    encoder, load = shapenet_encoder(args)
+    encode_to_store(encoder, load, [paths[i] for i in rows], [ids[i] for i in rows], None, path, args.batch_size,
+                    args.num_workers, split=split, new_store=False, fingerprints=[fingerprints[i] for i in rows],
+                    weights_hash=weights_hash)
+
+
+def shard_path(args, shard):
+    return shapenet_latent_store_path(args) + '_shards/%d_of_%d' % (shard, args.num_shards)
+
+
+def encode_shard(args, shard):
+    """
+    Worker process of the sharded export: encodes every num_shards-th object of the sorted ShapeNet directory,
+    starting at shard and leaving out the objects up to date in the latent store, into the shard's latent store.
+    The objects already in the shard are skipped, so a failed shard resumes where it stopped.
+    """
+    ConFig = tf.ConfigProto()
+    ConFig.gpu_options.allow_growth = True
+    session = tf.Session(config=ConFig)
+
+    ids = sorted(os.listdir(shapenet_data_path(args)))[shard::args.num_shards]
+    path = shapenet_latent_store_path(args)
+    if latent_store.exists(path):
+        up_to_date = latent_store.LatentStore(path).index
+        ids = [id for id in ids if id not in up_to_date]
+    encode_stale_objects(args, ids, shard_path(args, shard), split='shard %d/%d' % (shard + 1, args.num_shards))
+
+
+def generate_sharded(args):
+    """
+    Encode the new or changed objects of a ShapeNet directory in num_shards processes, then merge the shards into
+    the latent store. Running the same command again after a failure only encodes the objects missing from the
+    shards.
+    """
+    path = shapenet_latent_store_path(args)
+    ids = sorted(os.listdir(shapenet_data_path(args)))
+    # drop the changed objects from the store, the shards encode the objects missing from it
+    latent_store.prune(path, ids, [latent_store.input_fingerprint(os.path.join(shapenet_data_path(args), id))
+                                   for id in ids], latent_store.file_hash(encoder_weights_path(args)))
+
+    # every worker starts its own TensorFlow runtime
+    context = multiprocessing.get_context('spawn')
+    workers = [context.Process(target=encode_shard, args=(args, shard)) for shard in range(args.num_shards)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    failed = [shard for shard, worker in enumerate(workers) if worker.exitcode != 0]
+    if failed:
+        raise RuntimeError('Shards %s failed, run the same command again to resume them' % failed)
+
+    shards = [shard_path(args, shard) for shard in range(args.num_shards)]
+    shards = [shard for shard in shards if latent_store.exists(shard)]
+    if shards:
+        latent_store.merge_stores(([path] if latent_store.exists(path) else []) + shards, path)
+        print("Merged %d shards into %s" % (len(shards), path))
+    shutil.rmtree(path + '_shards', ignore_errors=True)
+
 
 def main(args):
+    # created here and not at import, the spawned worker processes import this script too
+    ConFig = tf.ConfigProto()
+    ConFig.gpu_options.allow_growth = True
+    session = tf.Session(config=ConFig)
+
     weights_dir = args.weights_dir
     save_the_img = args.generate_img
     voxel_data_path = args.voxel_data_dir
@@ -36,72 +166,39 @@ def main(args):
 
     z_dim = args.latent_vector_size
 
+    if args.num_shards > 1:
+        if dataset != 'shapenet':
+            raise ValueError('Sharded latent generation supports the shapenet dataset')
+        return generate_sharded(args)
+
     if input_form == 'voxel':
         reconstructions_save_path = args.save_dir + '/analyse_voxel_input'
         latent_save_path = args.save_dir + '/voxel_latent_dict'
         if not os.path.exists(latent_save_path):
             os.makedirs(latent_save_path)
 
-        voxel_input = Input(shape=g.VOXEL_INPUT_SHAPE)
-        voxel_encoder = model.get_voxel_encoder(z_dim)
-        decoder = model.get_voxel_decoder(z_dim)
-        output = decoder(voxel_encoder(voxel_input))
-        test_model = Model(voxel_input, output)
-
-        voxel_encoder.load_weights(os.path.join(weights_dir, 'weightsEnd_voxEncoder.h5'), by_name=True)
-        decoder.load_weights(os.path.join(weights_dir, 'weightsEnd_voxDecoder.h5'), by_name=True)
+        voxel_encoder = model_registry.get_encoder('voxel', z_dim, weights_dir)
+        test_model = model_registry.get_reconstruction_model('voxel', z_dim, weights_dir)
 
         if dataset == 'shapenet':
-            hash = os.listdir(voxel_data_path)
-            voxel_file_list = [os.path.join(voxel_data_path, id) for id in hash]
-            voxels = data_IO.voxelPathList2matrix(voxel_file_list)
-
-            z_mean, z_logvar, z = voxel_encoder.predict(voxels)
-            latent_dict = latent2dict(hash, z_mean, z_logvar, z)
-            latent_dict_save_path = os.path.join(latent_save_path, 'voxel_latent_dict_table_all.pkl')
-            save_latent_dict = open(latent_dict_save_path, 'wb')
-            pickle.dump(latent_dict, save_latent_dict)
-            save_latent_dict.close()
-            reconstructions = test_model.predict(voxels)
+            hash = sorted(os.listdir(voxel_data_path))
+            encode_stale_objects(args, hash, shapenet_latent_store_path(args))
+
+            if bool(args.generation):
+                voxel_file_list = [os.path.join(voxel_data_path, id) for id in hash]
+                voxels = data_IO.voxelPathList2matrix(voxel_file_list)
+                reconstructions = model_registry.get_thresholded_model(test_model, args.threshold).predict(voxels)
 
         elif dataset == 'modelnet':
-            X = {'train_z_mean': [], 'train_z': [], 'test_z_mean':[], 'test_z':[],'train_z_cat':[] ,'test_z_cat':[]}
-            y = {'train_label': [], 'test_label': []}
             voxel_data = np.load(args.voxel_npz)
-            train_voxels, train_labels = shuffle(voxel_data['X_train'], voxel_data['y_train'])
-            test_voxels, test_labels = shuffle(voxel_data['X_test'], voxel_data['y_test'])
-            train_batch = int(train_voxels.shape[0] / args.batch_size)
-            test_batch = int(test_voxels.shape[0] / args.batch_size)
-            for i in range(train_batch):
-                train_batch_voxels = train_voxels[args.batch_size * i:args.batch_size * (i + 1),:]
-                train_batch_labels = train_labels[args.batch_size * i:args.batch_size * (i + 1)]
-                train_z_mean, train_z_logvar, train_z = voxel_encoder.predict(train_batch_voxels)
-                train_z_concatenate = np.concatenate((train_z_mean, train_z_logvar), 1)
-                for j in range(train_z_mean.shape[0]):
-                    X['train_z_mean'].append(train_z_mean[j])
-                    X['train_z'].append(train_z[j])
-                    X['train_z_cat'].append(train_z_concatenate[j])
-                    y['train_label'].append(train_batch_labels[j])
-            for i in range(test_batch):
-                test_batch_voxels = test_voxels[args.batch_size * i:args.batch_size * (i + 1), :]
-                test_batch_labels = test_labels[args.batch_size * i:args.batch_size * (i + 1)]
-                test_z_mean, test_z_logvar, test_z = voxel_encoder.predict(test_batch_voxels)
-                test_z_concatenate = np.concatenate((test_z_mean, test_z_logvar), 1)
-                for j in range(test_z_mean.shape[0]):
-                    X['test_z_mean'].append(test_z_mean[j])
-                    X['test_z'].append(test_z[j])
-                    X['test_z_cat'].append(test_z_concatenate[j])
-                    y['test_label'].append(test_batch_labels[j])
-
-            np.savez_compressed(os.path.join(args.save_dir,'modelnet10_voxel_latent_cat.npz'),
-                                train_z=X['train_z'],
-                                train_z_mean=X['train_z_mean'],
-                                train_z_cat=X['train_z_cat'],
-                                train_labels=y['train_label'],
-                                test_z=X['test_z'],
-                                test_z_mean=X['test_z_mean'],
-                                test_z_cat=X['test_z_cat'],
-                                test_labels=y['test_label'])
+            for split in ['train', 'test']:
+                voxels, labels = voxel_data['X_' + split], voxel_data['y_' + split]
+                # the objects of the .npz have no id, they are named by split and row
+                order = shuffle(np.arange(labels.shape[0]))
+                ids = ['%s_%d' % (split, i) for i in order]
+                encode_to_store(voxel_encoder, lambda rows: voxels[rows], order, ids, labels[order],
+                                os.path.join(args.save_dir, 'modelnet10_voxel_latent', split), args.batch_size,
+                                args.num_workers, split=split)
 
     elif input_form == 'image':
         reconstructions_save_path = args.save_dir + '/analyse_image_input'
@@ -109,88 +206,42 @@ def main(args):
         if not os.path.exists(latent_save_path):
             os.makedirs(latent_save_path)
 
-        image_input = Input(shape=g.VIEWS_IMAGE_SHAPE_SHAPENET)
-        image_encoder = model.get_img_encoder(z_dim, g.VIEWS_IMAGE_SHAPE_MODELNET)['image_encoder']
-        image_encoder.load_weights(os.path.join(weights_dir, 'weightsEnd_imgEncoder.h5'), by_name=True)
-
-        decoder = model.get_voxel_decoder(z_dim)
-        decoder.load_weights(os.path.join(weights_dir, 'weightsEnd_voxDecoder.h5'), by_name=True)
-        output = decoder(image_encoder(image_input)[0])
-        test_model = Model(image_input, output)
+        view_image_shape = g.VIEWS_IMAGE_SHAPE_SHAPENET if dataset == 'shapenet' else g.VIEWS_IMAGE_SHAPE_MODELNET
+        image_encoder = model_registry.get_encoder('image', z_dim, weights_dir, view_image_shape)
+        test_model = model_registry.get_reconstruction_model('image', z_dim, weights_dir, view_image_shape)
 
         if dataset == 'shapenet':
 
-            hash = os.listdir(image_data_path)
-            image_file_list = [os.path.join(image_data_path, id) for id in hash]
-            images = data_IO.imagePathList2matrix(image_file_list, train=False)
-
-            # Get latent vector information
-            z_mean, z_logvar, z = image_encoder.predict(images)
+            hash = sorted(os.listdir(image_data_path))
+            # record latent vectors of the new or changed objects in the latent store
+            encode_stale_objects(args, hash, shapenet_latent_store_path(args))
 
-            # record latent vectors in dictionary and save it in .pkl form
-            latent_dict = latent2dict(hash, z_mean, z_logvar, z)
-            latent_dict_save_path = os.path.join(latent_save_path, 'latent_dict.pkl')
-            save_latent_dict = open(latent_dict_save_path, 'wb')
-            pickle.dump(latent_dict, save_latent_dict)
-            save_latent_dict.close()
-
-            reconstructions = test_model.predict(images)
+            if bool(args.generation):
+                image_file_list = [os.path.join(image_data_path, id) for id in hash]
+                images = data_IO.imagePathList2matrix(image_file_list, train=False)
+                reconstructions = model_registry.get_thresholded_model(test_model, args.threshold).predict(images)
         elif dataset == 'modelnet':
-            X = {'train_z_mean': [], 'train_z': [], 'test_z_mean': [], 'test_z': []}
-            y = {'train_label': [], 'test_label': []}
             object_id_data = np.load(args.image_npz)
             modelnet_image_path = '/home/zmy/mmi_dataset/ModelNet40_images/modelnet40_images_new_12x'
-            train_images_id, train_labels = shuffle(object_id_data['X_train'], object_id_data['y_train'])
-            test_images_id, test_labels = shuffle(object_id_data['X_test'], object_id_data['y_test'])
-            train_batch = int(train_images_id.shape[0] / args.batch_size)
-            test_batch = int(test_images_id.shape[0] / args.batch_size)
-            count=1
-
-            for i in range(train_batch):
-                train_batch_object_id = train_images_id[args.batch_size * i:args.batch_size * (i + 1)]
-                train_batch_images = data_IO.objectIdList2matrix(train_batch_object_id,modelnet_image_path,'train')
-                train_batch_labels = train_labels[args.batch_size * i:args.batch_size * (i + 1)]
-                print("Predicting train batch:", str(count)+'/'+str(train_batch))
-                count += 1
-                train_z_mean, train_z_logvar, train_z = image_encoder.predict(train_batch_images)
-                for j in range(train_z_mean.shape[0]):
-                    X['train_z_mean'].append(train_z_mean[j])
-                    X['train_z'].append(train_z[j])
-                    y['train_label'].append(train_batch_labels[j])
-            count =1
-            for i in range(test_batch):
-                test_batch_object_id = test_images_id[args.batch_size * i:args.batch_size * (i + 1)]
-                test_batch_images = data_IO.objectIdList2matrix(test_batch_object_id, modelnet_image_path, 'test')
-                test_batch_labels = test_labels[args.batch_size * i:args.batch_size * (i + 1)]
-                print("Predicting test batch:", str(count) + '/' + str(test_batch))
-                count += 1
-                test_z_mean, test_z_logvar, test_z = image_encoder.predict(test_batch_images)
-                for j in range(test_z_mean.shape[0]):
-                    X['test_z_mean'].append(test_z_mean[j])
-                    X['test_z'].append(test_z[j])
-                    y['test_label'].append(test_batch_labels[j])
-
-            np.savez_compressed(os.path.join(args.save_dir, 'modelnet10_image_BG0_latent.npz'),
-                                train_z=X['train_z'],
-                                train_z_mean=X['train_z_mean'],
-                                train_labels=y['train_label'],
-                                test_z=X['test_z'],
-                                test_z_mean=X['test_z_mean'],
-                                test_labels=y['test_label'])
+            for split in ['train', 'test']:
+                images_id, labels = shuffle(object_id_data['X_' + split], object_id_data['y_' + split])
+                # the 12 views of every object are decoded from .png by the workers
+                load = functools.partial(data_IO.objectIdList2matrix, dataset=modelnet_image_path, train_or_test=split)
+                encode_to_store(image_encoder, load, images_id, images_id, labels,
+                                os.path.join(args.save_dir, 'modelnet10_image_BG0_latent', split), args.batch_size,
+                                args.num_workers, bool(args.use_processes), split)
 
     if bool(args.generation):
 
-        reconstructions[reconstructions > 0] = 1
-        reconstructions[reconstructions < 0] = 0
-
         if not os.path.exists(reconstructions_save_path):
             os.makedirs(reconstructions_save_path)
 
-        save_volume.save_metrics(reconstructions, voxels, voxel_data_path, image_data_path, input_form, reconstructions_save_path)
+        save_volume.save_metrics(reconstructions, metrics.pack_voxels(voxels), voxel_data_path, image_data_path,
+                                 input_form, reconstructions_save_path, object_ids=hash, packed=True)
 
-        for i in range(reconstructions.shape[0]):
-            save_volume.save_binvox_output_2(reconstructions[i, 0, :], hash[i], reconstructions_save_path, '_gen',
-                                             save_bin=True, save_img=save_the_img)
+        with save_volume.VolumeWriter(args.num_writers) as writer:
+            writer.save_batch(reconstructions, hash, reconstructions_save_path, '_gen', save_bin=True,
+                              save_img=save_the_img, save_mesh=args.save_mesh)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,36 @@
+import numpy as np
+import sys, os, time
+sys.path.append("..")
+
+from utils import latent_store, latent_index
+
+
+def main():
+
+    k = 10
+    # latent stores written by generate_latent.py for the same ShapeNet objects
+    voxel_store = latent_store.LatentStore('/home/zmy/Downloads/allCategory_uniLoss1/voxel_latent_dict/voxel_latent_store_table_all')
+    image_store = latent_store.LatentStore('/home/zmy/Downloads/allCategory_uniLoss1/image_latent_dict/latent_store')
+
+    # the index is saved next to the voxel latents and reused until the store changes
+    start = time.time()
+    index = latent_index.get_index(voxel_store, field='z_mean')
+    print("Index:", index.kind, "over", len(index), "shapes, ready in %.2fs" % (time.time() - start))
+
+    # image -> shape retrieval, a hit is the shape of the image among the k nearest voxel latents
+    queries = [object_id for object_id in image_store.ids if object_id in voxel_store]
+    start = time.time()
+    if index.kind == 'flat':
+        retrieved, _ = index.search(image_store.get_batch(queries, 'z_mean'), k)
+    else:
+        retrieved, _ = index.search(image_store.get_batch(queries, 'z_mean'), k, num_probes=16, rerank=10 * k)
+    interval = time.time() - start
+
+    hits = retrieved == np.array(queries)[:, np.newaxis]
+    print("Queries:", len(queries), "%.3f ms / query" % (interval * 1000. / max(len(queries), 1)))
+    for top in [1, 5, k]:
+        print("Top-%d retrieval accuracy:" % top, np.mean(np.any(hits[:, :top], axis=1)))
+
+
+if __name__ == '__main__':
+    main()
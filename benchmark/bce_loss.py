@@ -0,0 +1,55 @@
+import numpy as np
+import sys, os, time, argparse
+sys.path.append("..")
+
+from tensorflow.keras import backend as K
+from tensorflow.keras.activations import sigmoid
+from utils import custom_loss
+from utils import globals as g
+import tensorflow as tf
+
+"""
+Time per training step spent in the reconstruction loss (forward + gradient w.r.t. the decoder logits):
+clipped sigmoid + weighted_binary_crossentropy against weighted_binary_crossentropy_from_logits.
+"""
+
+ConFig = tf.ConfigProto()
+ConFig.gpu_options.allow_growth = True
+session = tf.Session(config=ConFig)
+
+
+def time_op(op, feed_dict, steps, warmup=10):
+    for _ in range(warmup):
+        session.run(op, feed_dict=feed_dict)
+    start = time.time()
+    for _ in range(steps):
+        session.run(op, feed_dict=feed_dict)
+    return (time.time() - start) / steps
+
+
+def main(args):
+    target = tf.placeholder(tf.float32, shape=(None,) + g.VOXEL_INPUT_SHAPE)
+    logits = tf.Variable(np.zeros((args.batch_size,) + g.VOXEL_INPUT_SHAPE, dtype=np.float32))
+
+    clipped_loss = custom_loss.weighted_binary_crossentropy(target, K.clip(sigmoid(logits), 1e-7, 1.0 - 1e-7))
+    logits_loss = custom_loss.weighted_binary_crossentropy_from_logits(target, logits)
+    losses = {'clipped sigmoid': clipped_loss, 'from logits': logits_loss}
+
+    session.run(tf.global_variables_initializer())
+    session.run(logits.assign(np.random.randn(args.batch_size, *g.VOXEL_INPUT_SHAPE).astype(np.float32) * 3.))
+    feed_dict = {target: (np.random.rand(args.batch_size, *g.VOXEL_INPUT_SHAPE) > 0.8).astype(np.float32)}
+
+    print('Batch size:', args.batch_size, ' Steps:', args.steps)
+    for name, loss in losses.items():
+        grad = tf.gradients(loss, logits)[0]
+        forward = time_op(loss, feed_dict, args.steps)
+        step = time_op([loss, grad], feed_dict, args.steps)
+        print('%-16s loss: %.4f  forward: %.3f ms  forward+gradient: %.3f ms'
+              % (name, session.run(loss, feed_dict=feed_dict), forward * 1e3, step * 1e3))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch_size', type=int, default=8)
+    parser.add_argument('--steps', type=int, default=200)
+    main(parser.parse_args(sys.argv[1:]))
@@ -0,0 +1,65 @@
+import numpy as np
+import sys, time, argparse
+sys.path.append("..")
+
+from utils import latent_index
+
+"""
+Recall@k against query latency of the latent retrieval indices on clustered random latents. The queries are
+noisy copies of indexed vectors, like the image latent of a shape next to its voxel latent. Recall@k is the
+fraction of the exact k nearest neighbors returned by an index.
+"""
+
+
+def clustered_latents(num_objects, z_dim, num_clusters, seed=0):
+    rng = np.random.RandomState(seed)
+    centers = rng.randn(num_clusters, z_dim).astype(np.float32) * 2.
+    return (centers[rng.randint(num_clusters, size=num_objects)] +
+            rng.randn(num_objects, z_dim).astype(np.float32))
+
+
+def recall(ids, exact_ids):
+    return np.mean([len(set(found).intersection(truth)) / float(len(truth)) for found, truth in zip(ids, exact_ids)])
+
+
+def timed_search(index, queries, k, **search_args):
+    start = time.time()
+    ids, _ = index.search(queries, k, **search_args)
+    return ids, (time.time() - start) * 1000. / queries.shape[0]
+
+
+def main(args):
+    latents = clustered_latents(args.num_objects, args.z_dim, args.num_clusters)
+    ids = np.array(['%d' % i for i in range(args.num_objects)])
+    rng = np.random.RandomState(1)
+    queries = latents[rng.choice(args.num_objects, args.num_queries)] + \
+        args.noise * rng.randn(args.num_queries, args.z_dim).astype(np.float32)
+
+    flat = latent_index.FlatIndex(latents, ids)
+    exact_ids, latency = timed_search(flat, queries, args.k)
+    print('Objects:', args.num_objects, ' queries:', args.num_queries, ' k:', args.k)
+    print('%-36s %10s %12s' % ('index', 'recall@k', 'ms / query'))
+    print('%-36s %10.3f %12.3f' % ('flat (BLAS)', 1., latency))
+
+    start = time.time()
+    ivfpq = latent_index.IVFPQIndex.train(latents, ids, num_lists=args.num_lists, num_subspaces=args.num_subspaces)
+    print('IVF-PQ trained in %.1fs, %d bytes / object' % (time.time() - start, ivfpq.codes.shape[1]))
+    for num_probes in args.num_probes:
+        for rerank in [0, 10 * args.k]:
+            found, latency = timed_search(ivfpq, queries, args.k, num_probes=num_probes, rerank=rerank)
+            print('%-36s %10.3f %12.3f' % ('ivfpq probes=%d rerank=%d' % (num_probes, rerank),
+                                           recall(found, exact_ids), latency))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num_objects', type=int, default=200000)
+    parser.add_argument('--num_queries', type=int, default=1000)
+    parser.add_argument('--z_dim', type=int, default=128)
+    parser.add_argument('--num_clusters', type=int, default=100)
+    parser.add_argument('--noise', type=float, default=0.5)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--num_lists', type=int, default=None)
+    parser.add_argument('--num_subspaces', type=int, default=16)
+    parser.add_argument('--num_probes', type=int, nargs='+', default=[1, 4, 16])
+    main(parser.parse_args(sys.argv[1:]))
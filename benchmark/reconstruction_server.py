@@ -0,0 +1,97 @@
+import numpy as np
+import sys, io, json, time, socket, argparse, threading
+import http.client
+sys.path.append("..")
+
+from utils import globals as g
+
+"""
+Load test of serve_MMI.py: `concurrency` clients send `num_requests` requests of random inputs in total,
+each client waits for its reply before the next request. Reports the p50 / p99 latency, the throughput and
+the mean batch size formed by the server.
+"""
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path):
+        http.client.HTTPConnection.__init__(self, 'localhost')
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.path)
+
+
+def get_connection(args):
+    if args.socket is not None:
+        return UnixHTTPConnection(args.socket)
+    return http.client.HTTPConnection(args.host, args.port)
+
+
+def request(connection, method, url, body=None):
+    connection.request(method, url, body=body)
+    response = connection.getresponse()
+    data = response.read()
+    if response.status != 200:
+        raise RuntimeError('%s %s: %d %s' % (method, url, response.status, data.decode().strip()))
+    return data
+
+
+def random_inputs(input_form, num_objects, z_dim):
+    if input_form == 'latent':
+        inputs = np.random.randn(num_objects, z_dim).astype(np.float32)
+    elif input_form == 'voxel':
+        inputs = (np.random.rand(num_objects, *g.VOXEL_INPUT_SHAPE) > 0.8).astype(np.float32)
+    else:
+        inputs = np.random.randint(0, 256, (num_objects,) + g.VIEWS_IMAGE_SHAPE_SHAPENET).astype(np.uint8)
+    buffer = io.BytesIO()
+    np.save(buffer, inputs, allow_pickle=False)
+    return buffer.getvalue()
+
+
+def client(args, num_requests, latencies):
+    connection = get_connection(args)
+    body = random_inputs(args.input_form, args.objects_per_request, args.latent_vector_size)
+    for _ in range(num_requests):
+        start = time.time()
+        request(connection, 'POST', '/' + args.input_form, body)
+        latencies.append(time.time() - start)
+    connection.close()
+
+
+def main(args):
+    health = json.loads(request(get_connection(args), 'GET', '/health').decode())
+    print('Server inputs:', health['inputs'], ' concurrency:', args.concurrency,
+          ' objects / request:', args.objects_per_request)
+
+    latencies = []
+    clients = [threading.Thread(target=client, args=(args, args.num_requests // args.concurrency, latencies))
+               for _ in range(args.concurrency)]
+    start = time.time()
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    duration = time.time() - start
+
+    after = json.loads(request(get_connection(args), 'GET', '/health').decode())
+    num_batches = after['batches'] - health['batches']
+    num_objects = after['objects'] - health['objects']
+    latencies = np.array(latencies) * 1e3
+    print('Requests: %d  p50: %.2f ms  p99: %.2f ms  mean: %.2f ms'
+          % (latencies.size, np.percentile(latencies, 50), np.percentile(latencies, 99), latencies.mean()))
+    print('Throughput: %.1f requests/s  %.1f objects/s  mean batch size: %.1f'
+          % (latencies.size / duration, num_objects / duration, num_objects / max(num_batches, 1)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', type=str, default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8500)
+    parser.add_argument('--socket', type=str, default=None)
+    parser.add_argument('--input_form', type=str, choices=['latent', 'voxel', 'image'], default='latent')
+    parser.add_argument('--latent_vector_size', type=int, default=128)
+    parser.add_argument('--objects_per_request', type=int, default=1)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--num_requests', type=int, default=1024)
+    main(parser.parse_args(sys.argv[1:]))
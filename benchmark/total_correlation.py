@@ -0,0 +1,80 @@
+import numpy as np
+import sys, os, time, argparse
+sys.path.append("..")
+
+from utils import custom_loss
+import tensorflow as tf
+
+"""
+Check that total_correlation_chunked gives the loss and the gradients of the dense total_correlation, for every
+sampling, batch sizes that are not a multiple of the chunk size and chunk sizes larger than the batch, and time both
+estimators. Fails with an AssertionError beyond the float32 tolerance.
+"""
+
+ConFig = tf.ConfigProto()
+ConFig.gpu_options.allow_growth = True
+session = tf.Session(config=ConFig)
+
+# float32 tolerance, the chunked log-sum-exps are accumulated in a different order
+RTOL = 1e-5
+ATOL = 1e-5
+
+
+def time_op(op, feed_dict, steps, warmup=3):
+    for _ in range(warmup):
+        session.run(op, feed_dict=feed_dict)
+    start = time.time()
+    for _ in range(steps):
+        session.run(op, feed_dict=feed_dict)
+    return (time.time() - start) / steps
+
+
+def random_posteriors(batch_size, z_dim, rng):
+    z_mean = rng.randn(batch_size, z_dim).astype(np.float32)
+    z_logvar = (0.5 * rng.randn(batch_size, z_dim) - 1.).astype(np.float32)
+    z = (z_mean + np.exp(0.5 * z_logvar) * rng.randn(batch_size, z_dim)).astype(np.float32)
+    return z, z_mean, z_logvar
+
+
+def main(args):
+    inputs = [tf.placeholder(tf.float32, shape=(None, args.z_dim)) for _ in range(3)]
+    rng = np.random.RandomState(0)
+
+    print('%-8s %6s %6s %12s %12s %12s %10s %10s' % ('sampling', 'batch', 'chunk', 'tc', 'tc error', 'grad error',
+                                                       'dense ms', 'chunk ms'))
+    for sampling in ['none', 'mws', 'mss']:
+        dense = custom_loss.total_correlation(*inputs, dataset_size=args.dataset_size, sampling=sampling)
+        dense_grads = tf.gradients(dense, inputs)
+        for chunk_size in args.chunk_sizes:
+            chunked = custom_loss.total_correlation_chunked(*inputs, chunk_size=chunk_size,
+                                                            dataset_size=args.dataset_size, sampling=sampling)
+            chunked_grads = tf.gradients(chunked, inputs)
+            for batch_size in args.batch_sizes:
+                feed_dict = dict(zip(inputs, random_posteriors(batch_size, args.z_dim, rng)))
+                expected, expected_grads = session.run([dense, dense_grads], feed_dict)
+                value, grads = session.run([chunked, chunked_grads], feed_dict)
+
+                np.testing.assert_allclose(value, expected, rtol=RTOL, atol=ATOL, err_msg='%s batch %d chunk %d' % (
+                    sampling, batch_size, chunk_size))
+                for name, grad, expected_grad in zip(['z', 'z_mean', 'z_logvar'], grads, expected_grads):
+                    np.testing.assert_allclose(grad, expected_grad, rtol=RTOL, atol=ATOL,
+                                               err_msg='d/d%s, %s batch %d chunk %d' % (
+                                                   name, sampling, batch_size, chunk_size))
+
+                grad_error = max(np.abs(grad - expected_grad).max()
+                                 for grad, expected_grad in zip(grads, expected_grads))
+                print('%-8s %6d %6d %12.4f %12.2e %12.2e %10.3f %10.3f' % (
+                    sampling, batch_size, chunk_size, expected, abs(value - expected), grad_error,
+                    time_op([dense, dense_grads], feed_dict, args.steps) * 1e3,
+                    time_op([chunked, chunked_grads], feed_dict, args.steps) * 1e3))
+    print('total_correlation_chunked matches total_correlation')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch_sizes', nargs='+', type=int, default=[2, 7, 16, 33, 64])
+    parser.add_argument('--chunk_sizes', nargs='+', type=int, default=[1, 5, 16, 128])
+    parser.add_argument('--z_dim', type=int, default=128)
+    parser.add_argument('--dataset_size', type=int, default=10000)
+    parser.add_argument('--steps', type=int, default=10)
+    main(parser.parse_args(sys.argv[1:]))
@@ -0,0 +1,53 @@
+import numpy as np
+import sys, time, argparse
+sys.path.append("..")
+
+from utils import metrics
+from utils import globals as g
+
+"""
+Throughput (objects / second) of the per-object confusion counts used in the evaluation:
+bool arrays, bit-packing + popcount from dense arrays, and popcount on already packed arrays.
+"""
+
+
+def bool_confusion_counts(predictions, gt, threshold=1):
+    num_objects = predictions.shape[0]
+    predictions_occupy = predictions.reshape(num_objects, -1) >= threshold
+    gt_occupy = gt.reshape(num_objects, -1) >= 1
+    tp = np.count_nonzero(predictions_occupy & gt_occupy, axis=1)
+    fp = np.count_nonzero(predictions_occupy, axis=1) - tp
+    fn = np.count_nonzero(gt_occupy, axis=1) - tp
+    tn = predictions_occupy.shape[1] - tp - fp - fn
+    return tp, fp, fn, tn
+
+
+def throughput(function, args, num_objects, repeat):
+    start = time.time()
+    for _ in range(repeat):
+        result = function(*args)
+    return num_objects * repeat / (time.time() - start), result
+
+
+def main(args):
+    predictions = (np.random.rand(args.num_objects, *g.VOXEL_INPUT_SHAPE) > 0.8).astype(np.float32)
+    gt = (np.random.rand(args.num_objects, *g.VOXEL_INPUT_SHAPE) > 0.8).astype(np.float32)
+    packed_predictions, packed_gt = metrics.pack_voxels(predictions), metrics.pack_voxels(gt)
+
+    print('Objects:', args.num_objects, ' dense bytes / object:', predictions[0].nbytes,
+          ' packed bytes / object:', packed_predictions[0].nbytes)
+    speed, reference = throughput(bool_confusion_counts, (predictions, gt), args.num_objects, args.repeat)
+    print('%-24s %10.0f objects/s' % ('bool arrays', speed))
+    for name, function, function_args in [('pack + popcount', metrics.confusion_counts, (predictions, gt)),
+                                          ('popcount (packed)', metrics.packed_confusion_counts,
+                                           (packed_predictions, packed_gt))]:
+        speed, result = throughput(function, function_args, args.num_objects, args.repeat)
+        assert all(np.array_equal(a, b) for a, b in zip(reference, result))
+        print('%-24s %10.0f objects/s' % (name, speed))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num_objects', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=5)
+    main(parser.parse_args(sys.argv[1:]))
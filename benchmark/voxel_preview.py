@@ -0,0 +1,67 @@
+import numpy as np
+import sys, os, time, argparse, tempfile
+sys.path.append("..")
+
+from utils import voxel_render
+
+"""
+Objects per second of the voxel preview images: matplotlib's ax.voxels against utils/voxel_render.py, rendered and
+written as .png, on random smooth shapes (thresholded low frequency noise, like reconstructed objects).
+"""
+
+
+def random_shapes(num_objects, seed=0):
+    rng = np.random.RandomState(seed)
+    coarse = rng.rand(num_objects, 4, 4, 4)
+    # trilinear-ish upsampling of 4^3 noise to 32^3 blobs
+    volumes = coarse.repeat(8, axis=1).repeat(8, axis=2).repeat(8, axis=3)
+    for axis in [1, 2, 3]:
+        volumes = (volumes + np.roll(volumes, 4, axis=axis)) / 2.
+    return volumes > 0.65
+
+
+def matplotlib_png(voxels, file_path):
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    fig = plt.figure()
+    ax = fig.add_subplot(111, projection='3d')
+    ax.voxels(voxels, facecolors=(176 / 255, 196 / 255, 222 / 255))
+    plt.axis('off')
+    plt.savefig(file_path)
+    plt.close()
+
+
+def objects_per_second(function, volumes, output_dir, **kwargs):
+    start = time.time()
+    for i, volume in enumerate(volumes):
+        function(volume, os.path.join(output_dir, '%d.png' % i), **kwargs)
+    return len(volumes) / (time.time() - start)
+
+
+def main(args):
+    volumes = random_shapes(args.num_objects)
+    output_dir = tempfile.mkdtemp()
+    print('Objects:', args.num_objects,
+          ' mean occupied voxels:', int(volumes.reshape(args.num_objects, -1).sum(1).mean()))
+    if args.matplotlib:
+        print('%-36s %10.2f objects/s' % ('matplotlib ax.voxels', objects_per_second(
+            matplotlib_png, volumes[:args.matplotlib], output_dir)))
+    for image_size in [(256, 256), (480, 640)]:
+        for edges in [False, True]:
+            speed = objects_per_second(voxel_render.save_voxel_png, volumes, output_dir, image_size=image_size,
+                                       edges=edges)
+            print('%-36s %10.2f objects/s' % ('voxel_render %dx%d%s' % (image_size[1], image_size[0],
+                                                                         ' edges' if edges else ''), speed))
+    start = time.time()
+    voxel_render.save_png(voxel_render.render_grid(volumes[:64], num_columns=8), os.path.join(output_dir, 'grid.png'))
+    print('%-36s %10.2f objects/s' % ('voxel_render 8x8 grid', 64 / (time.time() - start)))
+    print('Images in', output_dir)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num_objects', type=int, default=200)
+    parser.add_argument('--matplotlib', type=int, default=3,
+                        help='number of objects rendered by matplotlib, 0 to skip it')
+    main(parser.parse_args(sys.argv[1:]))
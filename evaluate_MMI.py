@@ -0,0 +1,161 @@
+import os
+import numpy as np
+import tensorflow as tf
+import sys, time, functools
+
+from utils import save_volume, data_IO, arg_parser, metrics, model_registry, batching
+from utils import globals as g
+
+os.environ["CUDA_VISIBLE_DEVICES"] = "0"
+
+"""
+Evaluate the reconstructions of the whole test split of ShapeNet (processed by process_shapenet.py) or ModelNet, for
+every input form in one pass: each batch is loaded once and predicted by the voxel, image and both models. The
+results are saved in save_dir/evaluation_<dataset>:
+
+    <input form>/metrics.txt, metrics_per_object.csv    like test_MMI.py, with one line per category
+    summary.csv                                         precision, IoU, recall of every input form and category
+    throughput.csv                                      objects per second of every input form and of the loading
+"""
+
+SHAPENET_CATEGORIES = ['04530566', '02933112', '03211117', '02691156', '04256520', '04379243', '03691459',
+                       '04401088', '02828884', '02958343', '03001627', '03636649', '04090263']
+MODELNET40_CLASSES = ['airplane', 'bowl', 'table', 'chair', 'vase', 'glass_box', 'bathtub', 'toilet', 'range_hood',
+                      'flower_pot', 'laptop', 'plant', 'cup', 'person', 'tent', 'sofa', 'monitor', 'keyboard',
+                      'desk', 'mantel', 'curtain', 'bed', 'lamp', 'bench', 'dresser', 'car', 'sink',
+                      'night_stand', 'stool', 'door', 'guitar', 'stairs', 'radio', 'tv_stand', 'cone', 'xbox',
+                      'wardrobe', 'bookshelf', 'bottle', 'piano']
+
+
+def test_objects(args):
+    """
+    Returns: the (voxel path, image path) pair, the id and the category of every test object
+    """
+    if args.dataset == 'shapenet':
+        voxel_paths, image_paths, ids = data_IO.multicat_path_list(
+            args.processed_dataset, args.category_list or SHAPENET_CATEGORIES, use_mode='test')
+        categories = [id.split('_', 1)[0] for id in ids]
+    else:
+        ids = data_IO.generate_modelnet_idList(args.modelnet_voxel_dataset, args.category_list or MODELNET40_CLASSES,
+                                               'test')
+        categories = [id.rsplit('_', 1)[0] for id in ids]
+        voxel_paths = [os.path.join(args.modelnet_voxel_dataset, category, 'test', id + '.binvox')
+                       for id, category in zip(ids, categories)]
+        # no views without --modelnet_image_dataset, for the voxel input form
+        image_paths = [os.path.join(args.modelnet_image_dataset, category, 'test', id)
+                       if args.modelnet_image_dataset else None for id, category in zip(ids, categories)]
+    return list(zip(voxel_paths, image_paths)), ids, categories
+
+
+def load_batch(objects, dataset, load_images):
+    """
+    Args:
+        objects: the (voxel path, image path) of every object of the batch, the directories of the object in the
+                 processed ShapeNet dataset, or its .binvox file and the prefix of its 12 views in ModelNet
+        load_images: load the views too, for the image and both input forms
+    Returns: the voxels, the images (None without load_images) and the bit-packed voxels of the batch
+    """
+    num_objects = len(objects)
+    if dataset == 'shapenet':
+        voxels = data_IO.voxelPathList2matrix([voxel_path for voxel_path, _ in objects])
+        images = None
+        if load_images:
+            images = data_IO.imagePathList2matrix([image_path for _, image_path in objects], train=False)
+    else:
+        voxels = np.zeros((num_objects,) + g.VOXEL_INPUT_SHAPE, dtype=np.float32)
+        images = np.zeros((num_objects,) + g.VIEWS_IMAGE_SHAPE_MODELNET, dtype=np.float32) if load_images else None
+        for i, (voxel_file, image_prefix) in enumerate(objects):
+            voxels[i] = data_IO.read_voxel_data(voxel_file)
+            if load_images:
+                for view in range(12):
+                    image_file = image_prefix + '.obj.shaded_v' + str(view + 1).zfill(3) + '.png'
+                    images[i, view] = data_IO.preprocess_modelnet_img(image_file)
+    return voxels, images, metrics.pack_voxels(voxels)
+
+
+def write_summary(evaluators, output_dir):
+    """
+    Write and print the precision, IoU and recall of every input form, per category and overall
+    """
+    input_forms = list(evaluators)
+    categories = sorted(set(category for evaluator in evaluators.values() for category in evaluator.categories()))
+    with open(os.path.join(output_dir, 'summary.csv'), 'w') as f:
+        f.write('input_form,category,objects,precision,IoU,recall,accuracy,mean_object_IoU\n')
+        for input_form, evaluator in evaluators.items():
+            for category in categories + [None]:
+                precision, IoU, recall, accuracy = evaluator.pooled(category)
+                f.write('%s,%s,%d,%.6f,%.6f,%.6f,%.6f,%.6f\n' % (
+                    input_form, 'all' if category is None else category,
+                    evaluator.num_objects if category is None else evaluator.category_counts[category][4],
+                    precision, IoU, recall, accuracy, evaluator.mean_IoU(category)))
+
+    for name, column in [('Precision', 0), ('IoU', 1), ('Recall', 2)]:
+        print('%-16s' % name + ''.join('%10s' % input_form for input_form in input_forms))
+        for category in categories + [None]:
+            print('%-16s' % ('all' if category is None else category) +
+                  ''.join('%10.4f' % evaluators[input_form].pooled(category)[column] for input_form in input_forms))
+
+
+def main(args):
+    # created here and not at import, the spawned worker processes import this script too
+    ConFig = tf.ConfigProto()
+    ConFig.gpu_options.allow_growth = True
+    session = tf.Session(config=ConFig)
+
+    input_forms = args.input_forms
+    view_image_shape = g.VIEWS_IMAGE_SHAPE_SHAPENET if args.dataset == 'shapenet' else g.VIEWS_IMAGE_SHAPE_MODELNET
+    evaluation_path = os.path.join(args.save_dir, 'evaluation_' + args.dataset)
+    objects, ids, categories = test_objects(args)
+    num_batches = (len(objects) + args.batch_size - 1) // args.batch_size
+
+    reconstruction_models, evaluators, predict_time = {}, {}, {}
+    for input_form in input_forms:
+        reconstruction_models[input_form] = model_registry.get_reconstruction_model(
+            input_form, args.latent_vector_size, args.weights_dir, view_image_shape, threshold=args.threshold)
+        if not os.path.exists(os.path.join(evaluation_path, input_form)):
+            os.makedirs(os.path.join(evaluation_path, input_form))
+        evaluators[input_form] = metrics.VoxelEvaluator(
+            os.path.join(evaluation_path, input_form, 'metrics_per_object.csv'))
+        predict_time[input_form] = 0.
+
+    # every batch is loaded once for all the input forms, while the previous ones are predicted
+    load = functools.partial(load_batch, dataset=args.dataset,
+                             load_images=any(input_form != 'voxel' for input_form in input_forms))
+    wait_time = 0.
+    begin = tic = time.time()
+    for i, (start, (voxels, images, gt)) in enumerate(batching.prefetch_batches(load, objects, args.batch_size,
+                                                                                args.num_workers,
+                                                                                bool(args.use_processes))):
+        wait_time += time.time() - tic
+        end = start + voxels.shape[0]
+        for input_form in input_forms:
+            inputs = {'voxel': voxels, 'image': images, 'both': [images, voxels]}[input_form]
+            tic = time.time()
+            reconstructions = reconstruction_models[input_form].predict(inputs, batch_size=args.batch_size)
+            predict_time[input_form] += time.time() - tic
+            evaluators[input_form].update(reconstructions, gt, ids[start:end], categories[start:end], packed=True)
+        tic = time.time()
+        print("Evaluating batch: %d/%d, %.1f objects/s" % (i + 1, num_batches, end / (tic - begin)))
+    total_time = time.time() - begin
+
+    data_path = args.processed_dataset if args.dataset == 'shapenet' else args.modelnet_voxel_dataset
+    image_path = args.processed_dataset if args.dataset == 'shapenet' else args.modelnet_image_dataset
+    for input_form, evaluator in evaluators.items():
+        evaluator.close()
+        save_volume.write_metrics_summary(evaluator, data_path, image_path, input_form,
+                                          os.path.join(evaluation_path, input_form))
+    write_summary(evaluators, evaluation_path)
+
+    # most of the time spent loading means more --num_workers would help
+    num_objects = len(objects)
+    with open(os.path.join(evaluation_path, 'throughput.csv'), 'w') as f:
+        f.write('stage,seconds,objects_per_second\n')
+        for stage, seconds in [('loading (waiting)', wait_time)] + [(input_form, predict_time[input_form])
+                                                                    for input_form in input_forms] + \
+                              [('total', total_time)]:
+            f.write('%s,%.3f,%.2f\n' % (stage, seconds, num_objects / max(seconds, 1e-9)))
+            print('%-20s %10.1fs %10.1f objects/s' % (stage, seconds, num_objects / max(seconds, 1e-9)))
+
+
+if __name__ == '__main__':
+    main(arg_parser.parse_test_arguments(sys.argv[1:]))
@@ -57,15 +57,19 @@ def create_dataset(category_list, original_dataset_path, split_scale, dataset_sa
         copy_object_data(voxel_test_sub_names, voxel_dataset_path, image_dataset_path,
                          vol_test_sub_dataset_save_path, img_test_sub_dataset_save_path)
 
-        # Visulize the test_sub dataset
+        # Visulize the test_sub dataset, the previews are rendered by the writer processes
+        new_names = []
         for id in voxel_test_sub_names:
             voxel_file = os.path.join(vol_test_sub_dataset_save_path,id,'model.binvox')
             shutil.copy2(voxel_file, vol_test_sub_dataset_visualized_save_path)
             voxel_file = os.path.join(vol_test_sub_dataset_visualized_save_path,'model.binvox')
             new_name = os.path.join(vol_test_sub_dataset_visualized_save_path,id+'.binvox')
             os.rename(voxel_file, new_name)
+            new_names.append(new_name)
 
-            save_volume.binvox2image_2(new_name, id, vol_test_sub_dataset_visualized_save_path)
+        with save_volume.VolumeWriter() as writer:
+            writer.save_files(new_names, voxel_test_sub_names, vol_test_sub_dataset_visualized_save_path,
+                              save_function=save_volume.binvox2image_2)
 
 
 def copy_object_data(id_list, vol_path, img_path, vol_save_path, img_save_path):
@@ -0,0 +1,171 @@
+import os, io, sys, json
+import numpy as np
+import tensorflow as tf
+
+from socketserver import ThreadingMixIn, UnixStreamServer
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from tensorflow.keras import backend as K
+
+from utils import data_IO, arg_parser, metrics, binvox_rw, model_registry
+from utils import globals as g
+from utils.batching import DynamicBatcher
+
+"""
+Local reconstruction server: the encoders and the decoder are built and loaded once, concurrent requests
+are coalesced into batches by a DynamicBatcher and the occupancy is thresholded / bit-packed on the device.
+
+    POST /voxel   body: a .binvox file or a .npy array Batch x 1 x 32 x 32 x 32
+    POST /image   body: a .npy array Batch x Views x 137 x 137 x 3 (float in [0, 1] or uint8)
+    POST /latent  body: a .npy array Batch x z_dim
+    GET  /health  served input forms and the batching statistics
+
+The response is a .npy array Batch x 4096 of packed occupancy (see metrics.unpack_voxels), or with
+?format=binvox the .binvox file of a single object.
+"""
+
+ConFig = tf.ConfigProto()
+ConFig.gpu_options.allow_growth = True
+session = tf.Session(config=ConFig)
+
+
+def load_models(weights_dir, z_dim, view_image_shape, threshold):
+    """
+    Build the models whose weights are in weights_dir once, each one outputs the packed occupancy
+    Returns: dict input form -> (thresholded model, input shape)
+    """
+    input_shapes = {'latent': (z_dim,), 'voxel': g.VOXEL_INPUT_SHAPE, 'image': view_image_shape}
+    encoder_weights = {'voxel': model_registry.VOXEL_ENCODER_WEIGHTS, 'image': model_registry.IMAGE_ENCODER_WEIGHTS}
+
+    models = {}
+    for input_form, input_shape in input_shapes.items():
+        if input_form in encoder_weights and not os.path.exists(os.path.join(weights_dir, encoder_weights[input_form])):
+            continue
+        models[input_form] = (model_registry.get_reconstruction_model(input_form, z_dim, weights_dir, view_image_shape,
+                                                                      threshold=threshold), input_shape)
+    return models
+
+
+def get_predict_functions(models, batch_size):
+    # the batcher predicts in its own thread, where the default graph and session are not set
+    graph, keras_session = tf.get_default_graph(), K.get_session()
+
+    def predict_function(thresholded_model):
+        def predict(inputs):
+            with graph.as_default(), keras_session.as_default():
+                return thresholded_model.predict(inputs, batch_size=batch_size)
+        return predict
+
+    predict_functions = {}
+    for input_form, (thresholded_model, input_shape) in models.items():
+        predict_functions[input_form] = predict_function(thresholded_model)
+        # build the predict function in this thread and pay the first call before serving
+        predict_functions[input_form](np.zeros((1,) + tuple(input_shape), dtype=np.float32))
+    return predict_functions
+
+
+def decode_inputs(body, input_form, input_shape):
+    if input_form == 'voxel' and body.startswith(b'#binvox'):
+        inputs = binvox_rw.read_as_3d_array(io.BytesIO(body)).data[np.newaxis, np.newaxis]
+    else:
+        inputs = np.load(io.BytesIO(body), allow_pickle=False)
+    if inputs.ndim != len(input_shape) + 1 or inputs.shape[1:] != tuple(input_shape):
+        raise ValueError('Expected %s inputs of shape Batch x %s, got %s' % (input_form, input_shape, inputs.shape))
+    if input_form == 'image' and inputs.dtype == np.uint8:
+        inputs = inputs / 255.
+    return inputs.astype(np.float32)
+
+
+def encode_array(array):
+    buffer = io.BytesIO()
+    np.save(buffer, array, allow_pickle=False)
+    return buffer.getvalue()
+
+
+class ReconstructionHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    batcher = None
+    input_shapes = {}
+
+    def do_GET(self):
+        if urlparse(self.path).path != '/health':
+            return self._reply(404, b'Not found\n')
+        status = {'inputs': sorted(self.input_shapes),
+                  'batches': self.batcher.num_batches,
+                  'objects': self.batcher.num_objects}
+        self._reply(200, json.dumps(status).encode(), 'application/json')
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        input_form = url.path.strip('/')
+        output_format = parse_qs(url.query).get('format', ['packed'])[0]
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+        if input_form not in self.input_shapes:
+            return self._reply(404, ('No model for %s inputs\n' % input_form).encode())
+        try:
+            inputs = decode_inputs(body, input_form, self.input_shapes[input_form])
+        except ValueError as error:
+            return self._reply(400, (str(error) + '\n').encode())
+        if output_format == 'binvox' and inputs.shape[0] != 1:
+            return self._reply(400, b'format=binvox takes a single object\n')
+
+        try:
+            packed = self.batcher.predict(input_form, inputs)
+        except Exception as error:
+            return self._reply(500, (str(error) + '\n').encode())
+        if output_format == 'binvox':
+            self._reply(200, data_IO.binvox_bytes(metrics.unpack_voxels(packed)[0, 0]))
+        else:
+            self._reply(200, encode_array(packed))
+
+    def _reply(self, code, body, content_type='application/octet-stream'):
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # one line per request would cost more than the batching saves
+        pass
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class ThreadingUnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+
+def main(args):
+    view_image_shape = g.VIEWS_IMAGE_SHAPE_SHAPENET if args.dataset == 'shapenet' else g.VIEWS_IMAGE_SHAPE_MODELNET
+    models = load_models(args.weights_dir, args.latent_vector_size, view_image_shape, args.threshold)
+
+    ReconstructionHandler.input_shapes = dict((input_form, input_shape)
+                                              for input_form, (_, input_shape) in models.items())
+    ReconstructionHandler.batcher = DynamicBatcher(get_predict_functions(models, args.max_batch_size),
+                                                   max_batch_size=args.max_batch_size,
+                                                   max_latency=args.max_latency_ms / 1000.)
+
+    if args.socket is not None:
+        if os.path.exists(args.socket):
+            os.remove(args.socket)
+        server = ThreadingUnixHTTPServer(args.socket, ReconstructionHandler)
+        print('Serving', sorted(models), 'inputs on', args.socket)
+    else:
+        server = ThreadingHTTPServer((args.host, args.port), ReconstructionHandler)
+        print('Serving', sorted(models), 'inputs on http://%s:%d' % (args.host, args.port))
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        ReconstructionHandler.batcher.close()
+
+
+if __name__ == '__main__':
+    main(arg_parser.parse_serve_arguments(sys.argv[1:]))
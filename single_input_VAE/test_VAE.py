@@ -6,15 +6,16 @@ import shutil
 import sys
 
 from VAE import *
-from utils import save_volume, data_IO, arg_parser, model
+from utils import save_volume, data_IO, arg_parser, metrics, model_registry
 from tensorflow.keras.models import Model
 from tensorflow.keras.layers import Input
 
-ConFig=tf.ConfigProto()
-ConFig.gpu_options.allow_growth=True
-session=tf.Session(config=ConFig)
 
 def main(args):
+    # created here and not at import, the spawned worker processes import this script too
+    ConFig=tf.ConfigProto()
+    ConFig.gpu_options.allow_growth=True
+    session=tf.Session(config=ConFig)
 
     z_dim = args.latent_vector_size
 
@@ -28,23 +29,14 @@ def main(args):
     # vae.load_weights(os.path.join(weights_dir, 'weightsEnd_all.h5'))
 
     # Load method 2
-    voxel_input = Input(shape=g.VOXEL_INPUT_SHAPE)
-    voxel_encoder = model.get_voxel_encoder(z_dim)
-    voxel_encoder.load_weights(os.path.join(weights_dir, 'weightsEnd_voxEncoder.h5'), by_name=True)
-
-    decoder = model.get_voxel_decoder(z_dim)
-    decoder.load_weights(os.path.join(weights_dir, 'weightsEnd_voxDecoder.h5'), by_name=True)
-
-    output = decoder(voxel_encoder(voxel_input)[0])
-    vae = Model(voxel_input, output, name='Test_Voxel_VAE')
+    vae = model_registry.get_reconstruction_model('voxel', z_dim, weights_dir)
 
     hash = os.listdir(voxel_data_path)
     voxel_file_list = [os.path.join(voxel_data_path, id) for id in hash]
     voxels = data_IO.voxelPathList2matrix(voxel_file_list)
 
-    reconstructions = vae.predict(voxels)
-    reconstructions[reconstructions > 0] = 1
-    reconstructions[reconstructions < 0] = 0
+    # thresholded and bit-packed on the device, see metrics.pack_voxels
+    reconstructions = model_registry.get_thresholded_model(vae, args.threshold).predict(voxels)
 
     if not os.path.exists(test_result_path):
         os.makedirs(test_result_path)
@@ -60,9 +52,11 @@ def main(args):
             shutil.copy2(file, test_result_path)
 
     # save the generated objects files
-    save_volume.save_metrics(reconstructions, voxels, voxel_data_path, '', 'voxel', test_result_path)
-    for i in range(reconstructions.shape[0]):
-        save_volume.save_binvox_output(reconstructions[i, 0, :], hash[i], test_result_path, '_gen', save_bin= bool(args.save_bin), save_img= bool(args.generate_img))
+    save_volume.save_metrics(reconstructions, metrics.pack_voxels(voxels), voxel_data_path, '', 'voxel', test_result_path,
+                             object_ids=hash, packed=True)
+    with save_volume.VolumeWriter(args.num_writers) as writer:
+        writer.save_batch(reconstructions, hash, test_result_path, '_gen', save_bin=bool(args.save_bin),
+                          save_img=bool(args.generate_img), save_mesh=args.save_mesh)
 
 if __name__ == '__main__':
     main(arg_parser.parse_test_arguments(sys.argv[1:]))
\ No newline at end of file
@@ -9,7 +9,7 @@ from tensorflow.keras import backend as K
 from tensorflow.keras.callbacks import Callback
 
 from VAE import *
-from utils import data_IO, arg_parser, save_train, custom_loss, metrics
+from utils import data_IO, arg_parser, save_train, custom_loss, metrics, optimizers, profiling
 import sys, os
 
 learning_rate_1 = 0.0001
@@ -72,20 +72,25 @@ def main(args):
     kl_loss = custom_loss.kl_loss(z_mean, z_logvar)
 
     # Loss function in Genrative ... paper: a specialized form of Binary Cross-Entropy (BCE)
-    BCE_loss = K.cast(K.mean(custom_loss.weighted_binary_crossentropy(inputs, K.clip(sigmoid(outputs), 1e-7, 1.0 - 1e-7))), 'float32')
+    BCE_loss = custom_loss.weighted_binary_crossentropy_from_logits(inputs, outputs)
 
     # Loss in betatc VAE
-    tc_loss = (args.beta - 1.) * custom_loss.total_correlation(z, z_mean, z_logvar)
+    tc_loss = (args.beta - 1.) * custom_loss.total_correlation_chunked(z, z_mean, z_logvar,
+                                                                       chunk_size=args.tc_chunk_size,
+                                                                       dataset_size=len(os.listdir(voxel_dataset_path)),
+                                                                       sampling=args.tc_sampling)
 
-    IoU = metrics.get_IoU(inputs, outputs)
+    # IoU, precision, recall and accuracy share one confusion matrix
+    voxel_metrics = metrics.voxel_metrics(inputs, outputs)
 
     #opt = Adam(lr=learning_rate)
-    opt = SGD(lr=learning_rate, momentum=0.9, nesterov=True)
+    opt = optimizers.AccumulatedSGD(lr=learning_rate, momentum=0.9, nesterov=True, accum_steps=args.accum_steps)
 
     # Total loss
     vae.add_loss(BCE_loss)
     vae.add_metric(BCE_loss, name='recon_loss', aggregation='mean')
-    vae.add_metric(IoU, name='IoU', aggregation='mean' )
+    for metric_name in ['IoU', 'precision', 'recall', 'accuracy']:
+        vae.add_metric(voxel_metrics[metric_name], name=metric_name, aggregation='mean')
     if loss_type == 'bce':
         print('Using VAE model without kl loss')
     elif loss_type == 'vae':
@@ -112,9 +117,13 @@ def main(args):
     voxel_folder_list = [os.path.join(voxel_dataset_path,id) for id in hash]
     data_train = data_IO.voxelPathList2matrix(voxel_folder_list)
 
+    # samples / steps per second, loader queue depth and peak memory in training_log
+    throughput = profiling.ThroughputLogger(batch_size)
+
     train_callbacks = [
         #tf.keras.callbacks.ReduceLROnPlateau(monitor='loss', factor=0.2, patience=5, min_lr=1e-7, cooldown=1),
         tf.keras.callbacks.LearningRateScheduler(learning_rate_scheduler, verbose=0),
+        throughput,
         tf.keras.callbacks.TensorBoard(log_dir=train_data_path),
         tf.keras.callbacks.CSVLogger(filename=train_data_path + '/training_log'),
         epoch_kl_weight_callback(alpha)
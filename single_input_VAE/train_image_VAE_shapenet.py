@@ -7,7 +7,7 @@ from tensorflow.keras import backend as K
 from tensorflow.keras.callbacks import Callback
 
 from image_VAE import get_image_VAE
-from utils import data_IO, arg_parser, save_train, custom_loss, metrics
+from utils import data_IO, arg_parser, save_train, custom_loss, metrics, optimizers, profiling
 import sys, os, random
 import utils.globals as g
 
@@ -82,23 +82,25 @@ def main(args):
     kl_loss = custom_loss.kl_loss(z_mean, z_logvar)
 
     # Loss function in Genrative ... paper: a specialized form of Binary Cross-Entropy (BCE)
-    BCE_loss = K.cast(custom_loss.weighted_binary_crossentropy(vol_inputs, K.clip(sigmoid(reconstructions), 1e-7, 1.0 - 1e-7)),
-                      'float32')
+    BCE_loss = custom_loss.weighted_binary_crossentropy_from_logits(vol_inputs, reconstructions)
 
     # Loss in betatc VAE
-    tc_loss = (args.beta - 1.) * custom_loss.total_correlation(z, z_mean, z_logvar)
+    tc_loss = (args.beta - 1.) * custom_loss.total_correlation_chunked(z, z_mean, z_logvar,
+                                                                       chunk_size=args.tc_chunk_size,
+                                                                       dataset_size=len(voxel_files_list),
+                                                                       sampling=args.tc_sampling)
 
-    # Add metrics
-    # precision = metrics.get_precision(vol_inputs, reconstructions)
-    IoU = metrics.get_IoU(vol_inputs, reconstructions)
+    # Add metrics, IoU, precision, recall and accuracy share one confusion matrix
+    voxel_metrics = metrics.voxel_metrics(vol_inputs, reconstructions)
 
     # opt = Adam(lr=learning_rate)
-    opt = SGD(lr=learning_rate, momentum=0.9, nesterov=True)
+    opt = optimizers.AccumulatedSGD(lr=learning_rate, momentum=0.9, nesterov=True, accum_steps=args.accum_steps)
 
     ### Define loss function
     image_vae.add_loss(BCE_loss)
     image_vae.add_metric(BCE_loss, name='recon_loss', aggregation='mean')
-    image_vae.add_metric(IoU, name='IoU', aggregation='mean')
+    for metric_name in ['IoU', 'precision', 'recall', 'accuracy']:
+        image_vae.add_metric(voxel_metrics[metric_name], name=metric_name, aggregation='mean')
 
     if loss_type == 'bce':
         print('Using VAE model without kl loss')
@@ -154,16 +156,20 @@ def main(args):
 
                 yield ([image_one_batch, voxel_one_batch],)
 
+    # samples / steps per second, loader queue depth and peak memory in training_log
+    throughput = profiling.ThroughputLogger(batch_size)
+
     train_callbacks = [
         #tf.keras.callbacks.ReduceLROnPlateau(monitor='loss', factor=0.2, patience=5, min_lr=1e-7, cooldown=1),
         tf.keras.callbacks.LearningRateScheduler(learning_rate_scheduler, verbose=0),
+        throughput,
         tf.keras.callbacks.TensorBoard(log_dir=train_data_path),
         tf.keras.callbacks.CSVLogger(filename=train_data_path + '/training_log'),
         epoch_kl_weight_callback(alpha)
     ]
 
     image_vae.fit_generator(
-        generate_batch_data(voxel_files_list,multicat_hash_id, batch_size),
+        throughput.count_generator(generate_batch_data(voxel_files_list,multicat_hash_id, batch_size)),
         #steps_per_epoch=len(voxel_files_list) // batch_size,
         steps_per_epoch=5,
         epochs=epoch_num,
@@ -1,23 +1,36 @@
 import os
 import numpy as np
 import tensorflow as tf
-import shutil, sys
+import shutil, sys, functools
 
-from tensorflow.keras.layers import Input, Lambda, Add
-from tensorflow.keras.models import Model, load_model
 from tensorflow.keras.utils import plot_model
 
-from utils import save_volume, data_IO, arg_parser, model
+from utils import save_volume, data_IO, arg_parser, metrics, model_registry
 from utils import globals as g
 from MMI import *
 
 os.environ["CUDA_VISIBLE_DEVICES"] = "0"
-ConFig = tf.ConfigProto()
-ConFig.gpu_options.allow_growth = True
-session = tf.Session(config=ConFig)
+
+
+def load_batch(hash, input_form, voxel_data_path, image_data_path):
+    """
+    Returns: the model inputs of a batch of objects and their bit-packed ground truth voxels
+    """
+    voxels = data_IO.voxelPathList2matrix([os.path.join(voxel_data_path, id) for id in hash])
+    if input_form == 'voxel':
+        return voxels, metrics.pack_voxels(voxels)
+    images = data_IO.imagePathList2matrix([os.path.join(image_data_path, id) for id in hash], train=False)
+    if input_form == 'image':
+        return images, metrics.pack_voxels(voxels)
+    return [images, voxels], metrics.pack_voxels(voxels)
 
 
 def main(args):
+    # created here and not at import, the spawned worker processes import this script too
+    ConFig = tf.ConfigProto()
+    ConFig.gpu_options.allow_growth = True
+    session = tf.Session(config=ConFig)
+
     weights_dir = args.weights_dir
     save_the_img = args.generate_img
     save_bin = args.save_bin
@@ -26,6 +39,7 @@ def main(args):
     image_data_path = args.image_data_dir
     input_form = args.input_form
     z_dim = args.latent_vector_size
+    threshold = args.threshold
 
     model_pdf_path = os.path.join(args.save_dir, 'model_pdf_test')
     if not os.path.exists(model_pdf_path):
@@ -34,22 +48,12 @@ def main(args):
     if input_form == 'voxel':
         test_result_path = args.save_dir + '/test_sub_voxel_input'
 
-        voxel_input = Input(shape=g.VOXEL_INPUT_SHAPE)
-
-        voxel_encoder = model.get_voxel_encoder(z_dim)
-        voxel_encoder.load_weights(os.path.join(weights_dir, 'weightsEnd_voxEncoder.h5'), by_name=True)
-
-        decoder = model.get_voxel_decoder(z_dim)
-        decoder.load_weights(os.path.join(weights_dir, 'weightsEnd_voxDecoder.h5'), by_name=True)
-
-        output = decoder(voxel_encoder(voxel_input)[0])
-        voxel_vae = Model(voxel_input, output, name='Test_Voxel_VAE')
-
+        voxel_encoder = model_registry.get_encoder('voxel', z_dim, weights_dir)
+        decoder = model_registry.get_decoder(z_dim, weights_dir)
+        voxel_vae = model_registry.get_reconstruction_model('voxel', z_dim, weights_dir)
 
         hash = os.listdir(voxel_data_path)
-        voxel_file_list = [os.path.join(voxel_data_path, id) for id in hash]
-        voxels = data_IO.voxelPathList2matrix(voxel_file_list)
-        reconstructions = voxel_vae.predict(voxels)
+        reconstruction_model = model_registry.get_thresholded_model(voxel_vae, threshold)
 
         plot_model(voxel_encoder, to_file=os.path.join(model_pdf_path, 'Voxel_Encoder.pdf'), show_shapes=True)
         plot_model(decoder, to_file=os.path.join(model_pdf_path, 'Encoder.pdf'), show_shapes=True)
@@ -59,22 +63,12 @@ def main(args):
     elif input_form == 'image':
         test_result_path = args.save_dir + '/test_sub_image_input'
 
-        image_input = Input(shape=g.VIEWS_IMAGE_SHAPE_SHAPENET)
-        image_encoder = model.get_img_encoder(z_dim)['image_encoder']
-        image_encoder.load_weights(os.path.join(weights_dir, 'weightsEnd_imgEncoder.h5'), by_name=True)
-
-        decoder = model.get_voxel_decoder(z_dim)
-        decoder.load_weights(os.path.join(weights_dir, 'weightsEnd_voxDecoder.h5'), by_name=True)
-
-        output = decoder(image_encoder(image_input)[0])
-        image_vae = Model(image_input, output)
+        image_encoder = model_registry.get_encoder('image', z_dim, weights_dir)
+        decoder = model_registry.get_decoder(z_dim, weights_dir)
+        image_vae = model_registry.get_reconstruction_model('image', z_dim, weights_dir)
 
         hash = os.listdir(image_data_path)
-        image_file_list = [os.path.join(image_data_path, id) for id in hash]
-        voxel_file_list = [os.path.join(voxel_data_path, id) for id in hash]
-        voxels = data_IO.voxelPathList2matrix(voxel_file_list)
-        images = data_IO.imagePathList2matrix(image_file_list, train=False)
-        reconstructions = image_vae.predict(images)
+        reconstruction_model = model_registry.get_thresholded_model(image_vae, threshold)
 
         plot_model(image_encoder, to_file=os.path.join(model_pdf_path, 'Image_Encoder.pdf'), show_shapes=True)
         plot_model(decoder, to_file=os.path.join(model_pdf_path, 'Decoder.pdf'), show_shapes=True)
@@ -83,45 +77,19 @@ def main(args):
     elif input_form == 'both':
         test_result_path = args.save_dir + '/test_sub_both_input'
 
-        image_input = Input(shape=g.VIEWS_IMAGE_SHAPE_SHAPENET)
-        voxel_input = Input(shape=g.VOXEL_INPUT_SHAPE)
-        image_encoder = model.get_img_encoder(z_dim)['mvcnn_model']
-        voxel_encoder = model.get_voxel_encoder(z_dim)
-        image_encoder.load_weights(os.path.join(weights_dir, 'weightsEnd_imgEncoder.h5'), by_name=True)
-        voxel_encoder.load_weights(os.path.join(weights_dir, 'weightsEnd_voxEncoder.h5'), by_name=True)
-
-        img_encoder_output = image_encoder(image_input)
-        vol_encoder_output = voxel_encoder(voxel_input)
-        weight_op_img = Lambda(lambda x: x * g.IMG_WEIGHT, name='Imgae_Weighted_Layer')
-        weight_op_vol = Lambda(lambda x: x * g.VOL_WEIGHT, name='Voxel_Weighted_Layer')
-        img_z_mean, img_z_logvar, img_z = [weight_op_img(x) for x in img_encoder_output]
-        vol_z_mean, vol_z_logvar, vol_z = [weight_op_vol(x) for x in vol_encoder_output]
-        z_mean = Add(name='Weighted_Add_z_mean')([img_z_mean, vol_z_mean])
-        z_logvar = Add(name='Weighted_Add_z_logvar')([img_z_logvar, vol_z_logvar])
-        z = Add(name='Weighted_Add_z')([img_z, vol_z])
-
-        decoder = model.get_voxel_decoder(z_dim)
-        decoder.load_weights(os.path.join(weights_dir, 'weightsEnd_voxDecoder.h5'), by_name=True)
-        output = decoder(z_mean)
-
-        mmi = Model([image_input, voxel_input], output)
+        image_encoder = model_registry.get_encoder('image', z_dim, weights_dir)
+        voxel_encoder = model_registry.get_encoder('voxel', z_dim, weights_dir)
+        decoder = model_registry.get_decoder(z_dim, weights_dir)
+        mmi = model_registry.get_reconstruction_model('both', z_dim, weights_dir)
 
         hash = os.listdir(image_data_path)
-        image_file_list = [os.path.join(image_data_path, id) for id in hash]
-        voxel_file_list = [os.path.join(voxel_data_path, id) for id in hash]
-
-        images = data_IO.imagePathList2matrix(image_file_list, train=False)
-        voxels = data_IO.voxelPathList2matrix(voxel_file_list)
-        reconstructions = mmi.predict([images, voxels])
+        reconstruction_model = model_registry.get_reconstruction_model('both', z_dim, weights_dir, threshold=threshold)
 
         plot_model(image_encoder, to_file=os.path.join(model_pdf_path, 'Image_Encoder.pdf'), show_shapes=True)
-        plot_model(image_encoder, to_file=os.path.join(model_pdf_path, 'Voxel_Encoder.pdf'), show_shapes=True)
+        plot_model(voxel_encoder, to_file=os.path.join(model_pdf_path, 'Voxel_Encoder.pdf'), show_shapes=True)
         plot_model(decoder, to_file=os.path.join(model_pdf_path, 'Decoder.pdf'), show_shapes=True)
         plot_model(mmi, to_file=os.path.join(model_pdf_path, 'MMI.pdf'), show_shapes=True)
 
-    reconstructions[reconstructions > 0] = 1
-    reconstructions[reconstructions < 0] = 0
-
     if not os.path.exists(test_result_path):
         os.makedirs(test_result_path)
 
@@ -134,11 +102,16 @@ def main(args):
             file = os.path.join(ori_files_path, file)
             shutil.copy2(file, test_result_path)
 
-    # save the generated objects files
-    save_volume.save_metrics(reconstructions, voxels, voxel_data_path, image_data_path, input_form, test_result_path)
-    for i in range(reconstructions.shape[0]):
-        save_volume.save_binvox_output(reconstructions[i, 0, :], hash[i], test_result_path, '_gen', save_bin=save_bin,
-                                       save_img=save_the_img)
+    # reconstruct, evaluate and save the generated objects files batch by batch, the memory does not grow with
+    # the number of test objects
+    load = functools.partial(load_batch, input_form=input_form, voxel_data_path=voxel_data_path,
+                             image_data_path=image_data_path)
+    with save_volume.VolumeWriter(args.num_writers) as writer:
+        evaluator = save_volume.evaluate_in_batches(
+            reconstruction_model, load, hash, test_result_path, args.batch_size, args.num_workers,
+            bool(args.use_processes), writer=writer if save_bin or save_the_img or args.save_mesh else None,
+            save_bin=save_bin, save_img=save_the_img, save_mesh=args.save_mesh)
+    save_volume.write_metrics_summary(evaluator, voxel_data_path, image_data_path, input_form, test_result_path)
 
 
 if __name__ == '__main__':
@@ -1,23 +1,44 @@
 import os
 import numpy as np
 import tensorflow as tf
-import shutil, sys, random
+import sys, random, functools
 
-from tensorflow.keras.layers import Input, Lambda, Add
-from tensorflow.keras.models import Model, load_model
 from tensorflow.keras.utils import plot_model
 
-from utils import save_volume, data_IO, arg_parser, model
+from utils import save_volume, data_IO, arg_parser, metrics, model_registry
 from utils import globals as g
 from MMI import *
 
 os.environ["CUDA_VISIBLE_DEVICES"] = "0"
-ConFig = tf.ConfigProto()
-ConFig.gpu_options.allow_growth = True
-session = tf.Session(config=ConFig)
+
+
+def load_batch(multi_category_id, input_form, modelnet_voxel_dataset, modelnet_image_dataset):
+    """
+    Returns: the model inputs of a batch of objects and their bit-packed ground truth voxels
+    """
+    num_objects = len(multi_category_id)
+    voxels = np.zeros((num_objects,) + g.VOXEL_INPUT_SHAPE, dtype=np.float32)
+    if input_form == 'image':
+        images = np.zeros((num_objects,) + g.VIEWS_IMAGE_SHAPE_MODELNET, dtype=np.float32)
+    for i, cat_id in enumerate(multi_category_id):
+        category = cat_id.rsplit('_', 1)[0]
+        if input_form == 'image':
+            image_prefix = os.path.join(modelnet_image_dataset, category, 'test', cat_id)
+            for view in range(12):
+                image_file = image_prefix + '.obj.shaded_v' + str(view + 1).zfill(3) + '.png'
+                images[i, view] = data_IO.preprocess_modelnet_img(image_file)
+
+        voxel_file = os.path.join(modelnet_voxel_dataset, category, 'test', cat_id + '.binvox')
+        voxels[i] = data_IO.read_voxel_data(voxel_file)
+    return images if input_form == 'image' else voxels, metrics.pack_voxels(voxels)
 
 
 def main(args):
+    # created here and not at import, the spawned worker processes import this script too
+    ConFig = tf.ConfigProto()
+    ConFig.gpu_options.allow_growth = True
+    session = tf.Session(config=ConFig)
+
     weights_dir = args.weights_dir
     save_the_img = args.generate_img
     save_bin = args.save_bin
@@ -27,6 +48,7 @@ def main(args):
     input_form = args.input_form
     z_dim = args.latent_vector_size
     batch_size = args.batch_size
+    threshold = args.threshold
 
     ModelNet10_CLASSES = ['bathtub', 'bed', 'chair', 'desk', 'dresser',
                           'monitor', 'night_stand', 'sofa', 'table', 'toilet']
@@ -39,7 +61,6 @@ def main(args):
     multi_category_id = data_IO.generate_modelnet_idList(modelnet_voxel_dataset, ModelNet40_CLASSES, 'test')
 
     random.shuffle(multi_category_id)
-    num_test_object = len(multi_category_id)
 
     model_pdf_path = os.path.join(args.save_dir, 'model_modelnet_pdf_test')
     if not os.path.exists(model_pdf_path):
@@ -48,21 +69,11 @@ def main(args):
     if input_form == 'voxel':
         test_result_path = args.save_dir + '/test_modelnet_voxel_input'
 
-        voxel_input = Input(shape=g.VOXEL_INPUT_SHAPE)
-        voxel_encoder = model.get_voxel_encoder(z_dim)
-        voxel_encoder.load_weights(os.path.join(weights_dir, 'weightsEnd_voxEncoder.h5'), by_name=True)
-        decoder = model.get_voxel_decoder(z_dim)
-        decoder.load_weights(os.path.join(weights_dir, 'weightsEnd_voxDecoder.h5'), by_name=True)
-        output = decoder(voxel_encoder(voxel_input)[0])
-        voxel_vae = Model(voxel_input, output, name='Test_Voxel_VAE')
+        voxel_encoder = model_registry.get_encoder('voxel', z_dim, weights_dir)
+        decoder = model_registry.get_decoder(z_dim, weights_dir)
+        voxel_vae = model_registry.get_reconstruction_model('voxel', z_dim, weights_dir)
 
-        voxels = np.zeros((num_test_object,) + g.VOXEL_INPUT_SHAPE, dtype=np.float32)
-        for i , cat_id in enumerate(multi_category_id):
-            category, hash = cat_id.rsplit('_', 1)[0], cat_id.rsplit('_', 1)[1]
-            voxel_file = os.path.join(modelnet_voxel_dataset, category, 'test', cat_id + '.binvox')
-            voxels[i] = data_IO.read_voxel_data(voxel_file)
-
-        reconstructions = voxel_vae.predict(voxels)
+        reconstruction_model = model_registry.get_thresholded_model(voxel_vae, threshold)
 
         plot_model(voxel_encoder, to_file=os.path.join(model_pdf_path, 'Voxel_Encoder.pdf'), show_shapes=True)
         plot_model(decoder, to_file=os.path.join(model_pdf_path, 'Encoder.pdf'), show_shapes=True)
@@ -70,39 +81,16 @@ def main(args):
 
     elif input_form == 'image':
         test_result_path = args.save_dir + '/test_modelnet_image_input'
-        image_input = Input(shape=g.VIEWS_IMAGE_SHAPE_MODELNET)
-        image_encoder = model.get_img_encoder(z_dim, g.VIEWS_IMAGE_SHAPE_MODELNET)['image_encoder']
-        image_encoder.load_weights(os.path.join(weights_dir, 'weightsEnd_imgEncoder.h5'), by_name=True)
-        decoder = model.get_voxel_decoder(z_dim)
-        decoder.load_weights(os.path.join(weights_dir, 'weightsEnd_voxDecoder.h5'), by_name=True)
-        output = decoder(image_encoder(image_input)[0])
-        image_vae = Model(image_input, output)
-
-        images = np.zeros((num_test_object, 12) + g.IMAGE_SHAPE, dtype=np.float32)
-        voxels = np.zeros((num_test_object,) + g.VOXEL_INPUT_SHAPE, dtype=np.float32)
-        for i, cat_id in enumerate(multi_category_id):
-            category, hash = cat_id.rsplit('_', 1)[0], cat_id.rsplit('_', 1)[1]
-            image_prefix = os.path.join(modelnet_image_dataset, category, 'test', cat_id)
-            view_image = np.zeros(g.VIEWS_IMAGE_SHAPE_MODELNET, dtype=np.float32)
-            for view in range(12):
-                image_file = image_prefix + '.obj.shaded_v' + str(view + 1).zfill(3) + '.png'
-                image = data_IO.preprocess_modelnet_img(image_file)
-                view_image[view] = image
-            images[i] = view_image
+        image_encoder = model_registry.get_encoder('image', z_dim, weights_dir, g.VIEWS_IMAGE_SHAPE_MODELNET)
+        decoder = model_registry.get_decoder(z_dim, weights_dir)
+        image_vae = model_registry.get_reconstruction_model('image', z_dim, weights_dir, g.VIEWS_IMAGE_SHAPE_MODELNET)
 
-            voxel_file = os.path.join(modelnet_voxel_dataset, category, 'test', cat_id + '.binvox')
-            voxels[i] = data_IO.read_voxel_data(voxel_file)
-            print("Loading image from dataset:",str(i) + '/'+ str(num_test_object))
-
-        reconstructions = image_vae.predict(images)
+        reconstruction_model = model_registry.get_thresholded_model(image_vae, threshold)
 
         plot_model(image_encoder, to_file=os.path.join(model_pdf_path, 'Image_Encoder.pdf'), show_shapes=True)
         plot_model(decoder, to_file=os.path.join(model_pdf_path, 'Decoder.pdf'), show_shapes=True)
         plot_model(image_vae, to_file=os.path.join(model_pdf_path, 'Image_VAE.pdf'), show_shapes=True)
 
-    reconstructions[reconstructions > 0] = 1
-    reconstructions[reconstructions < 0] = 0
-
     if not os.path.exists(test_result_path):
         os.makedirs(test_result_path)
 
@@ -110,14 +98,19 @@ def main(args):
     if save_the_ori:
         pass
 
-    # save the generated objects files
-    save_volume.save_metrics(reconstructions, voxels, modelnet_voxel_dataset, modelnet_image_dataset, input_form, test_result_path)
-
-    #for i in range(reconstructions.shape[0]):
-    if save_bin or save_the_img:
-        for i in range(100):
-            save_volume.save_binvox_output_for_modelnet(reconstructions[i, 0, :], multi_category_id[i], test_result_path, '_gen', save_bin=save_bin,
-                                       save_img=save_the_img)
+    # reconstruct, evaluate and save the generated objects files batch by batch, the memory does not grow with
+    # the number of test objects, only the first 100 objects are saved
+    load = functools.partial(load_batch, input_form=input_form, modelnet_voxel_dataset=modelnet_voxel_dataset,
+                             modelnet_image_dataset=modelnet_image_dataset)
+    with save_volume.VolumeWriter(args.num_writers,
+                                  save_function=save_volume.save_binvox_output_for_modelnet) as writer:
+        evaluator = save_volume.evaluate_in_batches(
+            reconstruction_model, load, multi_category_id, test_result_path, batch_size, args.num_workers,
+            bool(args.use_processes), categories=[cat_id.rsplit('_', 1)[0] for cat_id in multi_category_id],
+            writer=writer if save_bin or save_the_img or args.save_mesh else None, num_saved=100,
+            save_bin=save_bin, save_img=save_the_img, save_mesh=args.save_mesh)
+    save_volume.write_metrics_summary(evaluator, modelnet_voxel_dataset, modelnet_image_dataset, input_form,
+                                      test_result_path)
 
 if __name__ == '__main__':
     main(arg_parser.parse_test_arguments(sys.argv[1:]))
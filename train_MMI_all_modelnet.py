@@ -5,7 +5,7 @@ from tensorflow.keras import backend as K
 from tensorflow.keras.callbacks import Callback
 
 from MMI import *
-from utils import data_IO, arg_parser, save_train, custom_loss, metrics
+from utils import data_IO, arg_parser, save_train, custom_loss, metrics, optimizers, profiling
 import sys, os, random
 import numpy as np
 
@@ -90,26 +90,28 @@ def main(args):
     kl_loss = custom_loss.kl_loss(z_mean, z_logvar)
 
     # Loss function in Genrative ... paper: a specialized form of Binary Cross-Entropy (BCE)
-    BCE_loss = K.cast(custom_loss.weighted_binary_crossentropy(vol_inputs, K.clip(sigmoid(outputs), 1e-7, 1.0 - 1e-7)),
-                      'float32')
+    BCE_loss = custom_loss.weighted_binary_crossentropy_from_logits(vol_inputs, outputs)
 
     # universal loss
     uni_loss = custom_loss.MSE(z_img, z_vol)
 
     # Loss in betatc VAE
-    tc_loss = (args.beta - 1.) * custom_loss.total_correlation(z, z_mean, z_logvar)
+    tc_loss = (args.beta - 1.) * custom_loss.total_correlation_chunked(z, z_mean, z_logvar,
+                                                                       chunk_size=args.tc_chunk_size,
+                                                                       dataset_size=len(multi_category_id),
+                                                                       sampling=args.tc_sampling)
 
-    # Add metrics
-    # precision = metrics.get_precision(vol_inputs, outputs)
-    IoU = metrics.get_IoU(vol_inputs, outputs)
+    # Add metrics, IoU, precision, recall and accuracy share one confusion matrix
+    voxel_metrics = metrics.voxel_metrics(vol_inputs, outputs)
 
     # opt = Adam(lr=learning_rate)
-    opt = SGD(lr=learning_rate, momentum=0.9, nesterov=True)
+    opt = optimizers.AccumulatedSGD(lr=learning_rate, momentum=0.9, nesterov=True, accum_steps=args.accum_steps)
 
     ### Define loss function
     MMI.add_loss(BCE_loss)
     MMI.add_metric(BCE_loss, name='recon_loss', aggregation='mean')
-    MMI.add_metric(IoU, name='IoU', aggregation='mean')
+    for metric_name in ['IoU', 'precision', 'recall', 'accuracy']:
+        MMI.add_metric(voxel_metrics[metric_name], name=metric_name, aggregation='mean')
 
     if loss_type == 'bce':
         print('Using VAE model without kl loss')
@@ -143,6 +145,15 @@ def main(args):
     plot_model(voxel_encoder, to_file=os.path.join(model_pdf_path, 'voxel-encoder.pdf'), show_shapes=True)
     save_train.save_config_pro(save_path=train_data_path)
 
+    # time breakdown of the training steps, next to training_log
+    profiler = profiling.StepProfiler(train_data_path,
+                                      {'image_embedding_model': (image_embedding_model, batch_size * g.NUM_VIEWS),
+                                       'view_feature_aggregator': (view_feature_aggregator, batch_size),
+                                       'voxel_encoder': (voxel_encoder, batch_size),
+                                       'MMI_decoder': (decoder, batch_size)},
+                                      load_stages=['images', 'voxels'], sample_every=args.profile_every,
+                                      trace_steps=args.trace_steps)
+
     def generate_MMI_batch_data(voxel_dataset, image_dataset, multicat_id, batch_size):
 
         number_of_elements = len(multicat_id)
@@ -161,28 +172,36 @@ def main(args):
                     category, hash = cat_id.rsplit('_',1)[0], cat_id.rsplit('_',1)[1]
 
                     voxel_one_batch_file = os.path.join(voxel_dataset,category,'train', cat_id+'.binvox')
-                    voxel_one_batch[i] = data_IO.read_voxel_data(voxel_one_batch_file)
+                    with profiler.loading('voxels'):
+                        voxel_one_batch[i] = data_IO.read_voxel_data(voxel_one_batch_file)
 
                     image_prefix = os.path.join(image_dataset,category,'train',cat_id)
                     view_image=np.zeros(g.VIEWS_IMAGE_SHAPE_MODELNET, dtype=np.float32)
-                    for view in range(12):
-                        image_file = image_prefix + '.obj.shaded_v'+str(view + 1).zfill(3)+'.png'
-                        image = data_IO.preprocess_modelnet_img(image_file)
-                        view_image[view] = image
+                    with profiler.loading('images'):
+                        for view in range(12):
+                            image_file = image_prefix + '.obj.shaded_v'+str(view + 1).zfill(3)+'.png'
+                            image = data_IO.preprocess_modelnet_img(image_file)
+                            view_image[view] = image
                     image_one_batch[i] = view_image
 
                 yield ([image_one_batch, voxel_one_batch],)
 
+    # samples / steps per second, loader queue depth and peak memory in training_log
+    throughput = profiling.ThroughputLogger(batch_size)
+
     train_callbacks = [
         # tf.keras.callbacks.ReduceLROnPlateau(monitor='loss', factor=0.2, patience=5, min_lr=1e-7, cooldown=1),
         tf.keras.callbacks.LearningRateScheduler(learning_rate_scheduler, verbose=0),
+        throughput,
         tf.keras.callbacks.TensorBoard(log_dir=train_data_path),
         tf.keras.callbacks.CSVLogger(filename=train_data_path + '/training_log'),
-        epoch_kl_weight_callback(alpha)
+        epoch_kl_weight_callback(alpha),
+        profiler
     ]
 
     MMI.fit_generator(
-        generate_MMI_batch_data(modelnet_voxel_dataset,modelnet_image_dataset,multi_category_id, batch_size),
+        throughput.count_generator(profiler.profile_generator(
+            generate_MMI_batch_data(modelnet_voxel_dataset,modelnet_image_dataset,multi_category_id, batch_size))),
         #steps_per_epoch=len(multi_category_id) // batch_size,
         steps_per_epoch=50,
         epochs=epoch_num,
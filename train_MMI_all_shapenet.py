@@ -5,7 +5,7 @@ from tensorflow.keras import backend as K
 from tensorflow.keras.callbacks import Callback
 
 from MMI import *
-from utils import data_IO, arg_parser, save_train, custom_loss, metrics
+from utils import data_IO, arg_parser, save_train, custom_loss, metrics, optimizers, profiling
 import sys, os, random
 
 os.environ["CUDA_VISIBLE_DEVICES"] = "0"
@@ -82,26 +82,28 @@ def main(args):
     kl_loss = custom_loss.kl_loss(z_mean, z_logvar)
 
     # Loss function in Genrative ... paper: a specialized form of Binary Cross-Entropy (BCE)
-    BCE_loss = K.cast(custom_loss.weighted_binary_crossentropy(vol_inputs, K.clip(sigmoid(outputs), 1e-7, 1.0 - 1e-7)),
-                      'float32')
+    BCE_loss = custom_loss.weighted_binary_crossentropy_from_logits(vol_inputs, outputs)
 
     # universal loss
     uni_loss = custom_loss.MSE(z_img, z_vol)
 
     # Loss in betatc VAE
-    tc_loss = (args.beta - 1.) * custom_loss.total_correlation(z, z_mean, z_logvar)
+    tc_loss = (args.beta - 1.) * custom_loss.total_correlation_chunked(z, z_mean, z_logvar,
+                                                                       chunk_size=args.tc_chunk_size,
+                                                                       dataset_size=len(voxel_files_list),
+                                                                       sampling=args.tc_sampling)
 
-    # Add metrics
-    # precision = metrics.get_precision(vol_inputs, outputs)
-    IoU = metrics.get_IoU(vol_inputs, outputs)
+    # Add metrics, IoU, precision, recall and accuracy share one confusion matrix
+    voxel_metrics = metrics.voxel_metrics(vol_inputs, outputs)
 
     # opt = Adam(lr=learning_rate)
-    opt = SGD(lr=learning_rate, momentum=0.9, nesterov=True)
+    opt = optimizers.AccumulatedSGD(lr=learning_rate, momentum=0.9, nesterov=True, accum_steps=args.accum_steps)
 
     ### Define loss function
     MMI.add_loss(BCE_loss)
     MMI.add_metric(BCE_loss, name='recon_loss', aggregation='mean')
-    MMI.add_metric(IoU, name='IoU', aggregation='mean')
+    for metric_name in ['IoU', 'precision', 'recall', 'accuracy']:
+        MMI.add_metric(voxel_metrics[metric_name], name=metric_name, aggregation='mean')
 
     if loss_type == 'bce':
         print('Using VAE model without kl loss')
@@ -134,6 +136,15 @@ def main(args):
     plot_model(voxel_encoder, to_file=os.path.join(model_pdf_path, 'voxel-encoder.pdf'), show_shapes=True)
     save_train.save_config_pro(save_path=train_data_path)
 
+    # time breakdown of the training steps, next to training_log
+    profiler = profiling.StepProfiler(train_data_path,
+                                      {'image_embedding_model': (image_embedding_model, batch_size * g.NUM_VIEWS),
+                                       'view_feature_aggregator': (view_feature_aggregator, batch_size),
+                                       'voxel_encoder': (voxel_encoder, batch_size),
+                                       'MMI_decoder': (decoder, batch_size)},
+                                      load_stages=['images', 'voxels'], sample_every=args.profile_every,
+                                      trace_steps=args.trace_steps)
+
     def generate_MMI_batch_data(voxel_path_list,multicat_hash, batch_size):
 
         number_of_elements = len(voxel_path_list)
@@ -154,23 +165,31 @@ def main(args):
                 excerpt = slice(start_idx * batch_size, (start_idx + 1) * batch_size)
 
                 image_one_batch_files = image_file_path[excerpt]
-                image_one_batch = data_IO.imagePathList2matrix(image_one_batch_files)
+                with profiler.loading('images'):
+                    image_one_batch = data_IO.imagePathList2matrix(image_one_batch_files)
 
                 voxel_one_batch_files = voxel_file_path[excerpt]
-                voxel_one_batch = data_IO.voxelPathList2matrix(voxel_one_batch_files)
+                with profiler.loading('voxels'):
+                    voxel_one_batch = data_IO.voxelPathList2matrix(voxel_one_batch_files)
 
                 yield ([image_one_batch, voxel_one_batch],)
 
+    # samples / steps per second, loader queue depth and peak memory in training_log
+    throughput = profiling.ThroughputLogger(batch_size)
+
     train_callbacks = [
         # tf.keras.callbacks.ReduceLROnPlateau(monitor='loss', factor=0.2, patience=5, min_lr=1e-7, cooldown=1),
         tf.keras.callbacks.LearningRateScheduler(learning_rate_scheduler, verbose=0),
+        throughput,
         tf.keras.callbacks.TensorBoard(log_dir=train_data_path),
         tf.keras.callbacks.CSVLogger(filename=train_data_path + '/training_log'),
-        epoch_kl_weight_callback(alpha)
+        epoch_kl_weight_callback(alpha),
+        profiler
     ]
 
     MMI.fit_generator(
-        generate_MMI_batch_data(voxel_files_list,multicat_hash_id, batch_size),
+        throughput.count_generator(profiler.profile_generator(
+            generate_MMI_batch_data(voxel_files_list,multicat_hash_id, batch_size))),
         steps_per_epoch=len(voxel_files_list) // batch_size,
         # steps_per_epoch=5,
         epochs=epoch_num,
@@ -42,6 +42,10 @@ def parse_train_arguments(argv):
                         help='Batch size for training.',
                         default=16)
 
+    parser.add_argument('--accum_steps', type=int,
+                        help='Number of mini-batches whose gradients are accumulated before each update.',
+                        default=1)
+
     parser.add_argument('--val_batch_size', type=int,
                         help='Batch size for validation.',
                         default=64)
@@ -69,6 +73,14 @@ def parse_train_arguments(argv):
                         help='The vae regularizer.',
                         default=1.5)
 
+    parser.add_argument('--tc_chunk_size', type=int,
+                        help='Number of posteriors evaluated at once in the total correlation estimate (btcvae).',
+                        default=16)
+
+    parser.add_argument('--tc_sampling', type=str, choices=['none', 'mws', 'mss'],
+                        help='Total correlation estimator: no weights, minibatch weighted or minibatch stratified sampling.',
+                        default='none')
+
     parser.add_argument('--capacity', type=float,
                         help='The latent space capacity.',
                         default=10.0)
@@ -97,6 +109,14 @@ def parse_train_arguments(argv):
                         help='The modelnet dataset contains image data for all classes',
                         default=None)
 
+    parser.add_argument('--profile_every', type=int,
+                        help='Steps between two samples of the host to device time and the submodel latencies, 0 to disable.',
+                        default=100)
+
+    parser.add_argument('--trace_steps', nargs=2, type=int,
+                        help='First and last training step to trace, for TensorBoard and chrome://tracing.',
+                        default=None)
+
 
     return parser.parse_args(argv)
 
@@ -142,6 +162,10 @@ def parse_test_arguments(argv):
                         help='Generate images from .binvox files',
                         default=0)
 
+    parser.add_argument('--save_mesh', type=str,
+                        help='Save the surface mesh of the reconstructed data, obj or ply, empty for none',
+                        default='')
+
     parser.add_argument('--latent_vector_size', type=int,
                         help='The size of the embedding layers.',
                         default=128)
@@ -152,6 +176,10 @@ def parse_test_arguments(argv):
     parser.add_argument('--batch_size', type=int,
                         help='the size of mini_batch', default=32)
 
+    parser.add_argument('--threshold', type=float,
+                        help='Logit threshold of occupied voxels in the reconstructions, 0 is a probability of 0.5',
+                        default=0.0)
+
     parser.add_argument('--generation', type=int,
                         help='Generate object in testing, 1: True, 0: False', default=0)
 
@@ -171,6 +199,69 @@ def parse_test_arguments(argv):
                         help='The modelnet dataset contains image data for all classes',
                         default=None)
 
+    parser.add_argument('--num_workers', type=int,
+                        help='The number of workers loading the input batches while the model predicts.',
+                        default=4)
+
+    parser.add_argument('--use_processes', type=int,
+                        help='Load the input batches in processes instead of threads, 1: True, 0: False',
+                        default=0)
+
+    parser.add_argument('--num_writers', type=int,
+                        help='The number of processes writing the output volumes and their images.',
+                        default=4)
+
+    parser.add_argument('--processed_dataset', type=str,
+                        help='The processed dataset contains image and voxel data for all classes',
+                        default=None)
+
+    parser.add_argument('--category_list', nargs='+',
+                        help='The categories evaluated by evaluate_MMI.py, all of the dataset if not given',
+                        default=None)
+
+    parser.add_argument('--input_forms', nargs='+', choices=['voxel', 'image', 'both'],
+                        help='The input forms evaluated by evaluate_MMI.py on the same batches',
+                        default=['voxel', 'image', 'both'])
+
+    parser.add_argument('--num_shards', type=int,
+                        help='Encode the shapenet latent store in this many processes, only the latents are generated',
+                        default=1)
+
+
+    return parser.parse_args(argv)
+
+def parse_serve_arguments(argv):
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--weights_dir', type=str,
+                        help='the dictionary that save all of weights of momels in .h5 file.',
+                        default=None)
+
+    parser.add_argument('--latent_vector_size', type=int,
+                        help='The size of the embedding layers.',
+                        default=128)
+
+    parser.add_argument('--dataset', type=str, choices=['shapenet', 'modelnet'],
+                        help='the dataset of the image sets (number of views)', default='shapenet')
+
+    parser.add_argument('--threshold', type=float,
+                        help='Logit threshold of occupied voxels in the reconstructions, 0 is a probability of 0.5',
+                        default=0.0)
+
+    parser.add_argument('--host', type=str,
+                        help='The address the server listens on.', default='127.0.0.1')
+
+    parser.add_argument('--port', type=int,
+                        help='The port the server listens on.', default=8500)
+
+    parser.add_argument('--socket', type=str,
+                        help='Listen on this Unix socket instead of host:port.', default=None)
+
+    parser.add_argument('--max_batch_size', type=int,
+                        help='The maximum number of objects predicted in one batch.', default=32)
+
+    parser.add_argument('--max_latency_ms', type=float,
+                        help='How long the first request of a batch waits for other requests, in ms.', default=5.0)
 
     return parser.parse_args(argv)
 
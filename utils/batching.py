@@ -0,0 +1,143 @@
+import numpy as np
+import threading, time, queue, collections, itertools, multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+
+class _Request(object):
+    def __init__(self, kind, inputs):
+        self.kind = kind
+        self.inputs = inputs
+        self.arrival = time.time()
+        self.outputs = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class DynamicBatcher(object):
+    """
+    Coalesces concurrent predict requests into batches. Requests are grouped by kind (e.g. 'voxel', 'image',
+    'latent'), a group is predicted once it holds max_batch_size objects or its oldest request waited
+    max_latency seconds. All predictions run in one worker thread, so the Keras models are only ever called
+    from that thread, and each caller gets back the rows of its own inputs.
+
+    Args:
+        predict_functions: dict kind -> function(Batch x ... array) -> Batch x ... array
+        max_batch_size: number of objects in a batch
+        max_latency: seconds the first request of a batch waits for more requests
+    """
+
+    def __init__(self, predict_functions, max_batch_size=32, max_latency=0.005):
+        self.predict_functions = predict_functions
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        self.num_batches = 0
+        self.num_objects = 0
+
+        self._queue = queue.Queue()
+        self._pending = dict((kind, []) for kind in predict_functions)
+        self._worker = threading.Thread(target=self._run, name='DynamicBatcher')
+        self._worker.daemon = True
+        self._worker.start()
+
+    def predict(self, kind, inputs):
+        """
+        Blocks until the batch holding `inputs` (Batch x ...) is predicted, returns the corresponding outputs
+        """
+        if kind not in self.predict_functions:
+            raise KeyError('No model for %s inputs' % kind)
+        request = _Request(kind, inputs)
+        self._queue.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.outputs
+
+    def close(self):
+        self._queue.put(None)
+        self._worker.join()
+
+    def _num_pending(self, kind):
+        return sum(request.inputs.shape[0] for request in self._pending[kind])
+
+    def _run(self):
+        while True:
+            waiting = [requests[0].arrival for requests in self._pending.values() if requests]
+            timeout = max(min(waiting) + self.max_latency - time.time(), 0.) if waiting else None
+            arrived = []
+            try:
+                arrived.append(self._queue.get(timeout=timeout))
+                # everything that arrived while the last batch was predicted joins the pending batches
+                while True:
+                    arrived.append(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+            for request in arrived:
+                if request is None:
+                    for kind in self._pending:
+                        while self._pending[kind]:
+                            self._predict_batch(kind)
+                    return
+                self._pending[request.kind].append(request)
+
+            for kind, requests in self._pending.items():
+                while requests and (self._num_pending(kind) >= self.max_batch_size or
+                                    time.time() - requests[0].arrival >= self.max_latency):
+                    self._predict_batch(kind)
+
+    def _predict_batch(self, kind):
+        # take requests in arrival order up to max_batch_size objects, a larger request is predicted alone
+        requests, size = [], 0
+        pending = self._pending[kind]
+        while pending and (not requests or size + pending[0].inputs.shape[0] <= self.max_batch_size):
+            requests.append(pending.pop(0))
+            size += requests[-1].inputs.shape[0]
+
+        try:
+            outputs = self.predict_functions[kind](np.concatenate([request.inputs for request in requests]))
+        except Exception as error:
+            for request in requests:
+                request.error = error
+                request.done.set()
+            return
+
+        self.num_batches += 1
+        self.num_objects += size
+        start = 0
+        for request in requests:
+            request.outputs = outputs[start:start + request.inputs.shape[0]]
+            start += request.inputs.shape[0]
+            request.done.set()
+
+
+def prefetch_batches(load, items, batch_size, num_workers=4, use_processes=False, max_pending=None):
+    """
+    Loads the batches of items in a pool of threads (or processes) and yields
+    (start, load(items[start:start + batch_size])) in order. At most max_pending batches (2 x num_workers by default)
+    are loaded ahead of the consumer, so the memory stays bounded however many items there are.
+
+    Args:
+        load: function(items of a batch) -> inputs of the batch, with use_processes it has to be picklable,
+              e.g. a module level function or a functools.partial of one
+    """
+    max_pending = max_pending or 2 * num_workers
+    starts = iter(range(0, len(items), batch_size))
+    pending = collections.deque()
+    if use_processes:
+        # the workers are spawned, forking the TensorFlow session and the prefetch threads can deadlock them
+        executor = ProcessPoolExecutor(num_workers, mp_context=multiprocessing.get_context('spawn'))
+    else:
+        executor = ThreadPoolExecutor(num_workers)
+    with executor:
+        try:
+            for start in itertools.islice(starts, max_pending):
+                pending.append((start, executor.submit(load, items[start:start + batch_size])))
+            while pending:
+                start, future = pending.popleft()
+                inputs = future.result()
+                for next_start in itertools.islice(starts, 1):
+                    pending.append((next_start, executor.submit(load, items[next_start:next_start + batch_size])))
+                yield start, inputs
+        finally:
+            # the consumer stopped early
+            for _, future in pending:
+                future.cancel()
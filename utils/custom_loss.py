@@ -10,6 +10,17 @@ def weighted_binary_crossentropy(target, output):
     return loss
 
 
+def weighted_binary_crossentropy_from_logits(target, logits):
+    """
+    Same loss as weighted_binary_crossentropy(target, sigmoid(logits)), computed from the decoder logits.
+    0.8 * t * softplus(-x) + 0.2 * (1 - t) * softplus(x) is a weighted cross entropy with pos_weight=4 scaled
+    by 0.2, which needs neither the clipped sigmoid nor the two logs over the volume.
+    """
+    loss = 0.2 * tf.nn.weighted_cross_entropy_with_logits(target, logits, 4.0)
+    loss = K.mean(K.sum(loss, axis=(-3, -2, -1)))
+    return loss
+
+
 def kl_loss(z_mean, z_logvar):
     loss = -0.5 * (1 + z_logvar - K.square(z_mean) - K.exp(z_logvar))
     loss = K.mean(K.sum(loss, axis=1))
@@ -32,7 +43,7 @@ def MSE(v1, v2):
     return loss
 
 
-def total_correlation(z, z_mean, z_logvar, prior='normal'):
+def total_correlation(z, z_mean, z_logvar, prior='normal', dataset_size=None, sampling='none'):
     """Estimate of total correlation on a batch.
     We need to compute the expectation over a batch of: E_j [log(q(z(x_j))) -
     log(prod_l q(z(x_j)_l))]. We ignore the constants as they do not matter
@@ -42,6 +53,8 @@ def total_correlation(z, z_mean, z_logvar, prior='normal'):
       z: [batch_size, num_latents]-tensor with sampled representation.
       z_mean: [batch_size, num_latents]-tensor with mean of the encoder.
       z_logvar: [batch_size, num_latents]-tensor with log variance of the encoder.
+      dataset_size: size of the training set, required by the 'mws' and 'mss' estimators.
+      sampling: 'none', 'mws' or 'mss', see log_importance_weights.
     Returns:
       Total correlation estimated on a batch.
     """
@@ -56,17 +69,150 @@ def total_correlation(z, z_mean, z_logvar, prior='normal'):
     #     log_qz_prob = laplace_log_density(
     #         tf.expand_dims(z, 1), tf.expand_dims(z_mean, 0),
     #         tf.expand_dims(z_log_squared_scale, 0))
+    log_weights = None
+    if sampling != 'none':
+        log_weights = log_importance_weights(tf.shape(z)[0], dataset_size, sampling)
+        log_qz_prob_weighted = log_qz_prob + tf.expand_dims(log_weights, 2)
+    else:
+        log_qz_prob_weighted = log_qz_prob
     # Compute log prod_l p(z(x_j)_l) = sum_l(log(sum_i(q(z(z_j)_l|x_i)))
     # + constant) for each sample in the batch, which is a vector of size
     # [batch_size,].
     log_qz_product = tf.reduce_sum(
-        tf.reduce_logsumexp(log_qz_prob, axis=1, keepdims=False),
+        tf.reduce_logsumexp(log_qz_prob_weighted, axis=1, keepdims=False),
         axis=1,
         keepdims=False)
     # Compute log(q(z(x_j))) as log(sum_i(q(z(x_j)|x_i))) + constant =
     # log(sum_i(prod_l q(z(x_j)_l|x_i))) + constant.
+    log_qz_joint = tf.reduce_sum(log_qz_prob, axis=2, keepdims=False)
+    if log_weights is not None:
+        log_qz_joint += log_weights
     log_qz = tf.reduce_logsumexp(
-        tf.reduce_sum(log_qz_prob, axis=2, keepdims=False),
+        log_qz_joint,
         axis=1,
         keepdims=False)
     return tf.reduce_mean(log_qz - log_qz_product)
+
+
+def log_importance_weights(batch_size, dataset_size, sampling='none', col_start=0, num_cols=None):
+    """
+    Log weights w[j, i] of the sample x_i when estimating q(z(x_j)) on a batch (Chen et al., beta-TCVAE).
+    Args:
+      batch_size: scalar tensor, B.
+      dataset_size: number of objects in the training set, N.
+      sampling: 'none' (no weights, constants dropped as in total_correlation),
+                'mws' (minibatch weighted sampling) or 'mss' (minibatch stratified sampling).
+      col_start, num_cols: only return the columns i in [col_start, col_start + num_cols).
+    Returns:
+      [batch_size, num_cols]-tensor with log weights.
+    """
+    if num_cols is None:
+        num_cols = batch_size
+    if sampling == 'none':
+        return tf.zeros(tf.stack([batch_size, num_cols]))
+
+    batch_size_f = tf.cast(batch_size, tf.float32)
+    if sampling == 'mws':
+        return tf.fill(tf.stack([batch_size, num_cols]), -tf.log(batch_size_f * dataset_size))
+
+    if sampling == 'mss':
+        # x_j itself has weight 1/N, one other element of the batch represents the stratum (N-M)/(NM),
+        # every remaining element 1/M, with M = B - 1
+        m = batch_size_f - 1.
+        strat_weight = (dataset_size - m) / (dataset_size * m)
+        j = tf.expand_dims(tf.range(batch_size), 1)
+        i = tf.expand_dims(tf.range(col_start, col_start + num_cols), 0)
+        weights = tf.ones(tf.stack([batch_size, num_cols])) / m
+        weights = tf.where(tf.equal(i, (j + 1) % batch_size), tf.ones_like(weights) * strat_weight, weights)
+        weights = tf.where(tf.equal(i, j), tf.ones_like(weights) / dataset_size, weights)
+        return tf.log(weights)
+
+    raise ValueError('Unknown sampling: %s' % sampling)
+
+
+def _log_add_exp(a, b):
+    m = tf.maximum(a, b)
+    return m + tf.log(tf.exp(a - m) + tf.exp(b - m))
+
+
+def total_correlation_chunked(z, z_mean, z_logvar, chunk_size=16, dataset_size=None, sampling='none'):
+    """Same estimate as total_correlation, without materializing the [batch, batch, num_latents] tensor.
+    The batch of posteriors q(z|x_i) is visited in chunks of `chunk_size` rows, log q(z(x_j)) and
+    log q(z(x_j)_l) are kept as running log-sum-exps, so the peak memory is O(batch * chunk_size * num_latents).
+    The gradient is computed by a second chunked pass instead of back-propagating through the loop,
+    which would keep every chunk alive.
+    Args:
+      z: [batch_size, num_latents]-tensor with sampled representation.
+      z_mean: [batch_size, num_latents]-tensor with mean of the encoder.
+      z_logvar: [batch_size, num_latents]-tensor with log variance of the encoder.
+      chunk_size: number of posteriors evaluated at once, 1 gives O(batch_size * num_latents) memory.
+      dataset_size: size of the training set, required by the 'mws' and 'mss' estimators.
+      sampling: 'none', 'mws' or 'mss', see log_importance_weights.
+    Returns:
+      Total correlation estimated on a batch.
+    """
+    if sampling != 'none' and dataset_size is None:
+        raise ValueError('dataset_size is required for %s sampling' % sampling)
+    dataset_size = float(dataset_size) if dataset_size is not None else None
+
+    def chunk_log_density(z, z_mean, z_logvar, start):
+        # log(q(z(x_j)|x_i)) for every j and the i in [start, start + chunk_size), indexed by [j, i, l],
+        # and the log weights w[j, i] of the chunk
+        mean_chunk = z_mean[start:start + chunk_size]
+        logvar_chunk = z_logvar[start:start + chunk_size]
+        log_qz_prob = gaussian_log_density(
+            tf.expand_dims(z, 1), tf.expand_dims(mean_chunk, 0), tf.expand_dims(logvar_chunk, 0))
+        log_weights = log_importance_weights(tf.shape(z)[0], dataset_size, sampling,
+                                             col_start=start, num_cols=tf.shape(mean_chunk)[0])
+        return log_qz_prob, log_weights
+
+    @tf.custom_gradient
+    def estimate(z, z_mean, z_logvar):
+        batch_size = tf.shape(z)[0]
+
+        def forward_step(start, log_qz, log_qz_marginal):
+            log_qz_prob, log_weights = chunk_log_density(z, z_mean, z_logvar, start)
+            log_qz = _log_add_exp(log_qz, tf.reduce_logsumexp(
+                log_weights + tf.reduce_sum(log_qz_prob, axis=2), axis=1))
+            log_qz_marginal = _log_add_exp(log_qz_marginal, tf.reduce_logsumexp(
+                tf.expand_dims(log_weights, 2) + log_qz_prob, axis=1))
+            return start + chunk_size, log_qz, log_qz_marginal
+
+        # log(q(z(x_j))), [batch_size,] and log(q(z(x_j)_l)), [batch_size, num_latents]
+        _, log_qz, log_qz_marginal = tf.while_loop(
+            lambda start, *_: start < batch_size, forward_step,
+            [tf.constant(0), tf.fill([batch_size], -np.inf), tf.fill(tf.shape(z), -np.inf)],
+            back_prop=False)
+        log_qz_product = tf.reduce_sum(log_qz_marginal, axis=1)
+        tc = tf.reduce_mean(log_qz - log_qz_product)
+
+        def grad(dy):
+            # d tc / d log(q(z(x_j)_l|x_i)) = (softmax_i of the joint - softmax_i of the marginal) / batch_size
+            scale = dy / tf.cast(batch_size, z.dtype)
+
+            def backward_step(start, grad_z, grad_mean, grad_logvar):
+                log_qz_prob, log_weights = chunk_log_density(z, z_mean, z_logvar, start)
+                joint = tf.exp(log_weights + tf.reduce_sum(log_qz_prob, axis=2) - tf.expand_dims(log_qz, 1))
+                marginal = tf.exp(tf.expand_dims(log_weights, 2) + log_qz_prob - tf.expand_dims(log_qz_marginal, 1))
+                grad_log_prob = scale * (tf.expand_dims(joint, 2) - marginal)
+
+                tmp = tf.expand_dims(z, 1) - tf.expand_dims(z_mean[start:start + chunk_size], 0)
+                tmp_inv_sigma = tmp * tf.exp(-tf.expand_dims(z_logvar[start:start + chunk_size], 0))
+                grad_z += tf.reduce_sum(-grad_log_prob * tmp_inv_sigma, axis=1)
+                grad_mean = grad_mean.write(start // chunk_size,
+                                            tf.reduce_sum(grad_log_prob * tmp_inv_sigma, axis=0))
+                grad_logvar = grad_logvar.write(start // chunk_size,
+                                                tf.reduce_sum(0.5 * grad_log_prob * (tmp * tmp_inv_sigma - 1.), axis=0))
+                return start + chunk_size, grad_z, grad_mean, grad_logvar
+
+            _, grad_z, grad_mean, grad_logvar = tf.while_loop(
+                lambda start, *_: start < batch_size, backward_step,
+                [tf.constant(0), tf.zeros_like(z),
+                 tf.TensorArray(z.dtype, size=0, dynamic_size=True, infer_shape=False),
+                 tf.TensorArray(z.dtype, size=0, dynamic_size=True, infer_shape=False)],
+                back_prop=False)
+            return grad_z, grad_mean.concat(), grad_logvar.concat()
+
+        return tc, grad
+
+    return estimate(z, z_mean, z_logvar)
@@ -12,10 +12,28 @@ def read_voxel_data(model_path):
 
 
 def write_binvox_file(pred, filename):
-    with open(filename, 'w') as f:
-        voxel = binvox_rw.Voxels(pred, [32, 32, 32], [0, 0, 0], 1, 'xzy')
-        binvox_rw.write(voxel, f)
-        f.close()
+    # binvox_rw.write writes the run lengths as text characters, which are not single bytes above 127
+    with open(filename, 'wb') as f:
+        f.write(binvox_bytes(pred))
+
+
+def binvox_bytes(pred):
+    """
+    Encode one 32 x 32 x 32 occupancy volume as the content of a .binvox file (same header and 'xzy' order
+    as write_binvox_file), the run-length encoding is computed with numpy instead of a loop over the voxels.
+    Returns: bytes
+    """
+    voxels_flat = (np.asarray(pred).reshape(-1) > 0).astype(np.uint8)
+    starts = np.concatenate(([0], np.flatnonzero(voxels_flat[1:] != voxels_flat[:-1]) + 1))
+    lengths = np.diff(np.append(starts, voxels_flat.size))
+    # a run holds at most 255 voxels, longer runs are split
+    num_runs = (lengths + 254) // 255
+    run_values = np.repeat(voxels_flat[starts], num_runs)
+    run_lengths = np.full(run_values.size, 255, dtype=np.uint8)
+    run_lengths[np.cumsum(num_runs) - 1] = lengths - 255 * (num_runs - 1)
+
+    header = b'#binvox 1\ndim 32 32 32\ntranslate 0 0 0\nscale 1\ndata\n'
+    return header + np.stack([run_values, run_lengths], axis=1).tobytes()
 
 
 def imagePath2matrix(imagePath, train=True):
@@ -0,0 +1,97 @@
+import numpy as np
+import os
+
+from utils import save_volume
+from utils.latent_traversal import decode_in_batches
+
+"""
+Batches of latent space expressions over object ids, e.g.
+
+    ('latent', id)                  the latent vector of an object
+    ('stack', x, y, ...)            one latent vector per operand
+    ('lerp', x, y, steps)           steps vectors linearly interpolated from x to y
+    ('slerp', x, y, steps)          steps vectors spherically interpolated from x to y
+    ('analogy', x, y, z)            x - y + z
+    ('centroid', [x, y, ...])       mean of the operands
+
+where an operand is an object id or an expression of a single vector, object ids are resolved by a lookup function
+such as latent_store.lookup. All expressions are resolved first, identical latent vectors are decoded once and the
+volumes are saved while the next batch is decoded.
+"""
+
+
+def _operand(operand, lookup):
+    if isinstance(operand, str):
+        return np.asarray(lookup(operand), dtype=np.float32)
+    vectors = evaluate(operand, lookup)
+    if vectors.shape[0] != 1:
+        raise ValueError('Operand %s is not a single latent vector' % (operand,))
+    return vectors[0]
+
+
+def slerp(p1, p2, steps):
+    t = np.linspace(0., 1., steps, dtype=np.float32)[:, np.newaxis]
+    cos_omega = np.dot(p1, p2) / max(np.linalg.norm(p1) * np.linalg.norm(p2), 1e-12)
+    omega = np.arccos(np.clip(cos_omega, -1., 1.))
+    if np.sin(omega) < 1e-6:
+        # (anti)parallel vectors, the great circle is not defined
+        return (1. - t) * p1 + t * p2
+    return (np.sin((1. - t) * omega) * p1 + np.sin(t * omega) * p2) / np.sin(omega)
+
+
+def evaluate(expression, lookup):
+    """
+    Returns: N x z_dim latent vectors of one expression, lookup is object id -> latent vector
+    """
+    op, operands = expression[0], expression[1:]
+    if op == 'latent':
+        return _operand(operands[0], lookup)[np.newaxis]
+    elif op == 'stack':
+        return np.stack([_operand(operand, lookup) for operand in operands])
+    elif op == 'lerp':
+        p1, p2 = _operand(operands[0], lookup), _operand(operands[1], lookup)
+        return np.linspace(p1, p2, operands[2]).astype(np.float32)
+    elif op == 'slerp':
+        return slerp(_operand(operands[0], lookup), _operand(operands[1], lookup), operands[2]).astype(np.float32)
+    elif op == 'analogy':
+        p1, p2, p3 = [_operand(operand, lookup) for operand in operands]
+        return (p1 - p2 + p3)[np.newaxis]
+    elif op == 'centroid':
+        return np.mean([_operand(operand, lookup) for operand in operands[0]], axis=0)[np.newaxis]
+    raise ValueError('Unknown latent expression: %s' % op)
+
+
+def decode_expressions(decoder, expressions, lookup, save_dir, names=None, batch_size=256, save_bin=True,
+                       save_img=True):
+    """
+    Evaluate the expressions and decode all their latent vectors in one batched pass, the i-th vector of an expression
+    is saved as save_dir/<name>/<i>_gen.binvox / .png
+    Args:
+        decoder: latent -> bit-packed occupancy, e.g. model_registry.get_thresholded_model(decoder)
+        names: sub folder of each expression, the index of the expression if None, '' saves in save_dir
+    Returns: the N x z_dim evaluated latent vectors of each expression
+    """
+    if names is None:
+        names = [str(j) for j in range(len(expressions))]
+    latents = [evaluate(expression, lookup) for expression in expressions]
+
+    # every output volume of a decoded unique latent vector
+    unique_latents, inverse = np.unique(np.concatenate(latents), axis=0, return_inverse=True)
+    destinations = [[] for _ in range(unique_latents.shape[0])]
+    row = 0
+    for name, vectors in zip(names, latents):
+        output_dir = os.path.join(save_dir, name)
+        if not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+        for i in range(vectors.shape[0]):
+            destinations[inverse.reshape(-1)[row]].append((str(i), output_dir))
+            row += 1
+
+    with save_volume.VolumeWriter() as writer:
+        for start, packed in decode_in_batches(decoder, unique_latents, batch_size):
+            # one row of the packed batch per destination, the batch goes to the writer still bit-packed
+            rows = [k for k in range(packed.shape[0]) for _ in destinations[start + k]]
+            hash_ids, output_dirs = zip(*sum(destinations[start:start + packed.shape[0]], []))
+            writer.save_batch(packed[rows], list(hash_ids), list(output_dirs), '_gen', save_bin=save_bin,
+                              save_img=save_img)
+    return latents
@@ -0,0 +1,249 @@
+import numpy as np
+import os
+
+from utils import latent_store
+
+"""
+Nearest neighbor search over the latent vectors of a latent store, e.g. image -> shape retrieval in the shared
+latent space: the index is built over the z_mean of the voxel encoder and queried with the z_mean of the image
+encoder.
+
+    FlatIndex     exact squared L2 distances with one matrix product per batch of queries
+    IVFPQIndex    inverted lists over a k-means coarse quantizer, the residuals are product-quantized to one byte
+                  per subspace and scanned with lookup tables, optionally re-ranked with the exact distances
+
+get_index() builds the index of a store once and saves it in the store directory as index_<field>.npz.
+"""
+
+FLAT_MAX_OBJECTS = 50000
+
+
+def squared_distances(queries, vectors, vector_norms=None):
+    """
+    Returns: Queries x Vectors squared L2 distances
+    """
+    if vector_norms is None:
+        vector_norms = np.einsum('ij,ij->i', vectors, vectors)
+    distances = np.dot(queries, vectors.T)
+    distances *= -2.
+    distances += vector_norms[np.newaxis]
+    distances += np.einsum('ij,ij->i', queries, queries)[:, np.newaxis]
+    return np.maximum(distances, 0.)
+
+
+def _top_k(distances, k):
+    # sorted k smallest distances of every row
+    k = min(k, distances.shape[1])
+    rows = np.arange(distances.shape[0])[:, np.newaxis]
+    top = np.argpartition(distances, k - 1, axis=1)[:, :k]
+    top = top[rows, np.argsort(distances[rows, top], axis=1)]
+    return top, distances[rows, top]
+
+
+def kmeans(vectors, num_clusters, num_iterations=20, seed=0):
+    """
+    Lloyd's k-means, the centroids start at random vectors
+    Returns: num_clusters x dim centroids
+    """
+    rng = np.random.RandomState(seed)
+    centroids = vectors[rng.choice(vectors.shape[0], num_clusters, replace=False)].astype(np.float32)
+    for _ in range(num_iterations):
+        assignment = assign(vectors, centroids)
+        order = np.argsort(assignment, kind='stable')
+        counts = np.bincount(assignment, minlength=num_clusters)
+        # an empty cluster keeps its centroid
+        filled = counts > 0
+        starts = (np.cumsum(counts) - counts)[filled]
+        centroids[filled] = np.add.reduceat(vectors[order], starts, axis=0) / counts[filled, np.newaxis]
+    return centroids
+
+
+def assign(vectors, centroids, chunk_size=16384):
+    centroid_norms = np.einsum('ij,ij->i', centroids, centroids)
+    return np.concatenate([np.argmin(squared_distances(vectors[start:start + chunk_size], centroids, centroid_norms),
+                                     axis=1) for start in range(0, vectors.shape[0], chunk_size)])
+
+
+class FlatIndex(object):
+    """
+    Exact search, one BLAS matrix product per chunk of queries
+    """
+    kind = 'flat'
+
+    def __init__(self, vectors, ids):
+        self.vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        self.norms = np.einsum('ij,ij->i', self.vectors, self.vectors)
+        self.ids = np.asarray(ids)
+
+    def __len__(self):
+        return self.vectors.shape[0]
+
+    def search(self, queries, k=10, chunk_size=1024):
+        """
+        Returns: Queries x k ids of the nearest vectors and their squared distances, nearest first
+        """
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, self.vectors.shape[1])
+        rows, distances = [], []
+        for start in range(0, queries.shape[0], chunk_size):
+            top, top_distances = _top_k(squared_distances(queries[start:start + chunk_size], self.vectors,
+                                                          self.norms), k)
+            rows.append(top)
+            distances.append(top_distances)
+        return self.ids[np.concatenate(rows)], np.concatenate(distances)
+
+    def save(self, file_path):
+        # nothing to train, the vectors stay in the store
+        pass
+
+
+class IVFPQIndex(object):
+    """
+    Inverted file with product quantization. Every vector is assigned to the nearest of num_lists coarse centroids,
+    its residual is split in num_subspaces parts and each part is replaced by the index of the nearest of 256
+    centroids. A query scans the lists of its num_probes nearest coarse centroids.
+    """
+    kind = 'ivfpq'
+
+    def __init__(self, coarse_centroids, codebooks, codes, offsets, rows, ids, vectors=None):
+        self.coarse_centroids = coarse_centroids
+        self.codebooks = codebooks
+        self.codes = codes
+        self.offsets = offsets
+        self.rows = rows
+        self.ids = np.asarray(ids)
+        self.vectors = vectors
+
+    def __len__(self):
+        return self.codes.shape[0]
+
+    @classmethod
+    def train(cls, vectors, ids, num_lists=None, num_subspaces=8, train_size=100000, seed=0):
+        """
+        Args:
+            vectors: Objects x dim, dim a multiple of num_subspaces, kept (e.g. memory-mapped) for the re-ranking
+            num_lists: number of coarse centroids, 4 x sqrt(Objects) if None
+        """
+        num_objects, dim = vectors.shape
+        if dim % num_subspaces:
+            raise ValueError('%d dimensional vectors can not be split in %d subspaces' % (dim, num_subspaces))
+        num_lists = min(num_lists or int(4 * np.sqrt(num_objects)) or 1, num_objects)
+        rng = np.random.RandomState(seed)
+        sample = np.asarray(vectors[np.sort(rng.choice(num_objects, min(train_size, num_objects), replace=False))],
+                            dtype=np.float32)
+
+        coarse_centroids = kmeans(sample, num_lists, seed=seed)
+        sample_residuals = (sample - coarse_centroids[assign(sample, coarse_centroids)]).reshape(
+            sample.shape[0], num_subspaces, -1)
+        codebooks = np.stack([kmeans(sample_residuals[:, j], min(256, sample.shape[0]), seed=seed)
+                              for j in range(num_subspaces)])
+
+        # encode every vector, grouped by inverted list
+        lists, codes = [], []
+        for start in range(0, num_objects, 16384):
+            chunk = np.asarray(vectors[start:start + 16384], dtype=np.float32)
+            chunk_lists = assign(chunk, coarse_centroids)
+            residuals = (chunk - coarse_centroids[chunk_lists]).reshape(chunk.shape[0], num_subspaces, -1)
+            codes.append(np.stack([assign(residuals[:, j], codebooks[j]) for j in range(num_subspaces)],
+                                  axis=1).astype(np.uint8))
+            lists.append(chunk_lists)
+        lists = np.concatenate(lists)
+        rows = np.argsort(lists, kind='stable')
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(lists, minlength=num_lists))])
+        return cls(coarse_centroids, codebooks, np.concatenate(codes)[rows], offsets, rows, ids, vectors)
+
+    def search(self, queries, k=10, num_probes=8, rerank=0):
+        """
+        Args:
+            num_probes: number of inverted lists scanned per query
+            rerank: number of candidates re-ranked with the exact distances to the stored vectors, 0 for none
+        Returns: Queries x k ids of the nearest vectors and their (approximate) squared distances, nearest first,
+                 id '' and distance inf where less than k vectors were scanned
+        """
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, self.coarse_centroids.shape[1])
+        num_subspaces = self.codebooks.shape[0]
+        probes = _top_k(squared_distances(queries, self.coarse_centroids), num_probes)[0]
+        codebook_norms = np.einsum('jcd,jcd->jc', self.codebooks, self.codebooks)
+        subspaces = np.arange(num_subspaces)
+
+        result_rows = np.full((queries.shape[0], k), -1, dtype=np.int64)
+        result_distances = np.full((queries.shape[0], k), np.inf, dtype=np.float32)
+        for q, query in enumerate(queries):
+            candidates, distances = [], []
+            for list_index in probes[q]:
+                begin, end = self.offsets[list_index], self.offsets[list_index + 1]
+                if begin == end:
+                    continue
+                residual = (query - self.coarse_centroids[list_index]).reshape(num_subspaces, -1)
+                # subspaces x 256 table of the squared distances to the codebook centroids
+                table = codebook_norms - 2. * np.einsum('jcd,jd->jc', self.codebooks, residual) + \
+                    np.einsum('jd,jd->j', residual, residual)[:, np.newaxis]
+                distances.append(table[subspaces, self.codes[begin:end]].sum(axis=1))
+                candidates.append(self.rows[begin:end])
+            if not candidates:
+                continue
+            candidates, distances = np.concatenate(candidates), np.concatenate(distances)
+
+            if rerank and self.vectors is not None:
+                shortlist = _top_k(distances[np.newaxis], max(rerank, k))[0][0]
+                candidates = candidates[shortlist]
+                # sorted rows read the memory-mapped vectors in order
+                order = np.argsort(candidates)
+                exact = squared_distances(query[np.newaxis],
+                                          np.asarray(self.vectors[candidates[order]], dtype=np.float32))[0]
+                distances = np.empty_like(exact)
+                distances[order] = exact
+            top, top_distances = _top_k(distances[np.newaxis], k)
+            result_rows[q, :top.shape[1]] = candidates[top[0]]
+            result_distances[q, :top.shape[1]] = top_distances[0]
+        ids = np.where(result_rows >= 0, self.ids[np.maximum(result_rows, 0)], '')
+        return ids, result_distances
+
+    def save(self, file_path):
+        np.savez(file_path, coarse_centroids=self.coarse_centroids, codebooks=self.codebooks, codes=self.codes,
+                 offsets=self.offsets, rows=self.rows)
+
+    @classmethod
+    def load(cls, file_path, ids, vectors=None):
+        arrays = np.load(file_path)
+        return cls(arrays['coarse_centroids'], arrays['codebooks'], arrays['codes'], arrays['offsets'],
+                   arrays['rows'], ids, vectors)
+
+
+def index_path(store_path, field='z_mean'):
+    return os.path.join(store_path, 'index_%s.npz' % field)
+
+
+def build_index(store, field='z_mean', kind='auto', **train_args):
+    """
+    Args:
+        store: latent_store.LatentStore
+        kind: 'flat', 'ivfpq' or 'auto': flat up to FLAT_MAX_OBJECTS objects
+        train_args: IVFPQIndex.train arguments
+    """
+    vectors = getattr(store, field)
+    if kind == 'auto':
+        kind = 'flat' if len(store) <= FLAT_MAX_OBJECTS else 'ivfpq'
+    if kind == 'flat':
+        return FlatIndex(vectors, store.ids)
+    elif kind == 'ivfpq':
+        return IVFPQIndex.train(vectors, store.ids, **train_args)
+    raise ValueError('Unknown index: %s' % kind)
+
+
+def get_index(store, field='z_mean', kind='auto', **train_args):
+    """
+    The index of a store, loaded from the store directory if it was saved after the last append to the store,
+    otherwise built and saved there
+    """
+    if kind == 'auto':
+        kind = 'flat' if len(store) <= FLAT_MAX_OBJECTS else 'ivfpq'
+    if kind == 'flat':
+        return build_index(store, field, kind)
+
+    file_path = index_path(store.path, field)
+    meta_path = os.path.join(store.path, latent_store.META_FILE)
+    if os.path.exists(file_path) and os.path.getmtime(file_path) >= os.path.getmtime(meta_path):
+        return IVFPQIndex.load(file_path, store.ids, getattr(store, field))
+    index = build_index(store, field, kind, **train_args)
+    index.save(file_path)
+    return index
@@ -0,0 +1,160 @@
+import numpy as np
+import os, time, hashlib
+from concurrent.futures import ProcessPoolExecutor
+from sklearn import decomposition, linear_model, manifold, neighbors, pipeline, preprocessing, svm
+
+from utils import latent_store
+
+"""
+Probes of the class information in the latent vectors of a latent store with a train and a test split, e.g. the
+ModelNet exports of generate_latent.py (the categories are the class labels):
+
+    logistic      logistic regression
+    linear_svm    linear SVM
+    knn           k nearest neighbors
+    rbf_svm       SVM with an RBF kernel
+
+every probe standardizes the features first. The features of every (store, key) are read once and cached as .npy
+files in cache_dir, named after the content hash of the store, so the probes of the sweep grid run in a pool of
+processes that memory-map them. The t-SNE / PCA embeddings of the train features are cached with the same key.
+"""
+
+PROBES = {
+    'logistic': lambda C=1.: linear_model.LogisticRegression(C=C, max_iter=1000),
+    'linear_svm': lambda C=1.: svm.LinearSVC(C=C),
+    'knn': lambda k=5: neighbors.KNeighborsClassifier(n_neighbors=k),
+    'rbf_svm': lambda C=1.: svm.SVC(kernel='rbf', C=C),
+}
+DEFAULT_GRID = [('logistic', {'C': 1.}), ('linear_svm', {'C': 1.}), ('knn', {'k': 1}), ('knn', {'k': 5}),
+                ('rbf_svm', {'C': 1.}), ('rbf_svm', {'C': 10.})]
+TABLE_COLUMNS = ['latents', 'key', 'probe', 'params', 'train_accuracy', 'test_accuracy', 'fit_seconds',
+                 'predict_seconds']
+
+
+def latent_features(store, key):
+    # z_cat is z_mean concatenated with z_logvar
+    if key == 'z_cat':
+        return np.concatenate([store.z_mean, store.z_logvar], 1)
+    return np.asarray(getattr(store, key))
+
+
+def cache_features(latent_dir, key, cache_dir):
+    """
+    Write the features and the labels of the train and test stores of latent_dir to cache_dir, unless they are there
+    Returns: the cache file prefix, <prefix>_<split>_features.npy / _labels.npy, and the load time, 0 if cached
+    """
+    sha1 = hashlib.sha1()
+    for split in ['train', 'test']:
+        sha1.update(latent_store.content_hash(os.path.join(latent_dir, split)).encode())
+    prefix = os.path.join(cache_dir, '%s_%s' % (sha1.hexdigest()[:16], key))
+
+    start = time.time()
+    if not os.path.exists(prefix + '_test_labels.npy'):
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        for split in ['train', 'test']:
+            store = latent_store.LatentStore(os.path.join(latent_dir, split))
+            np.save(prefix + '_%s_features.npy' % split, latent_features(store, key).astype(np.float32))
+            # the labels are written last, they mark a complete cache
+            np.save(prefix + '_%s_labels.npy' % split, store.categories.astype(int))
+        return prefix, time.time() - start
+    return prefix, 0.
+
+
+def _load(prefix, split):
+    return np.load(prefix + '_%s_features.npy' % split, mmap_mode='r'), np.load(prefix + '_%s_labels.npy' % split)
+
+
+def fit_probe(prefix, probe, params):
+    """
+    Fit a probe on the cached train features and evaluate it, runs in a worker process
+    Returns: train accuracy, test accuracy, fit and predict seconds
+    """
+    (train_features, train_labels), (test_features, test_labels) = _load(prefix, 'train'), _load(prefix, 'test')
+    classifier = pipeline.make_pipeline(preprocessing.StandardScaler(), PROBES[probe](**params))
+    start = time.time()
+    classifier.fit(train_features, train_labels)
+    fitted = time.time()
+    train_accuracy = np.mean(classifier.predict(train_features) == train_labels)
+    test_accuracy = np.mean(classifier.predict(test_features) == test_labels)
+    return train_accuracy, test_accuracy, fitted - start, time.time() - fitted
+
+
+def embedding(prefix, method='tsne', max_points=5000, seed=0):
+    """
+    2d t-SNE or PCA embedding of (at most max_points of) the cached train features, cached as
+    <prefix>_<method>.npz with the labels of the embedded points
+    Returns: N x 2 embedding, the labels and the seconds spent, 0 if cached
+    """
+    file_path = '%s_%s.npz' % (prefix, method)
+    if os.path.exists(file_path):
+        arrays = np.load(file_path)
+        return arrays['embedding'], arrays['labels'], 0.
+    features, labels = _load(prefix, 'train')
+    rows = np.arange(features.shape[0])
+    if features.shape[0] > max_points:
+        rows = np.sort(np.random.RandomState(seed).choice(features.shape[0], max_points, replace=False))
+    features = preprocessing.StandardScaler().fit_transform(np.asarray(features[rows]))
+
+    start = time.time()
+    if method == 'tsne':
+        points = manifold.TSNE(n_components=2, init='pca', random_state=seed).fit_transform(features)
+    elif method == 'pca':
+        points = decomposition.PCA(n_components=2, random_state=seed).fit_transform(features)
+    else:
+        raise ValueError('Unknown embedding: %s' % method)
+    seconds = time.time() - start
+    np.savez(file_path, embedding=points, labels=labels[rows])
+    return points, labels[rows], seconds
+
+
+def run_sweep(latent_dirs, keys, cache_dir, grid=DEFAULT_GRID, embeddings=('tsne', 'pca'), num_workers=4):
+    """
+    Every probe of grid on every key of every latent_dir, and the embeddings of the train features, in a pool of
+    num_workers processes
+    Args:
+        latent_dirs: directories with a train and a test latent store
+        keys: 'z_mean', 'z_logvar', 'z' or 'z_cat'
+        grid: (probe, parameters) pairs
+    Returns: one row per probe, embedding or feature cache (see TABLE_COLUMNS), and {(latent_dir, key): prefix} of
+             the cached features, for embedding()
+    """
+    rows, prefixes = [], {}
+    for latent_dir in latent_dirs:
+        for key in keys:
+            prefix, seconds = cache_features(latent_dir, key, cache_dir)
+            prefixes[latent_dir, key] = prefix
+            rows.append([latent_dir, key, 'load', '', '', '', seconds, ''])
+
+    with ProcessPoolExecutor(num_workers) as executor:
+        # the embeddings take longest, they are submitted first
+        embedding_futures, probe_futures = [], []
+        for (latent_dir, key), prefix in prefixes.items():
+            for method in embeddings:
+                embedding_futures.append(([latent_dir, key, method, ''], executor.submit(embedding, prefix, method)))
+        for (latent_dir, key), prefix in prefixes.items():
+            for probe, params in grid:
+                params_name = ' '.join('%s=%s' % item for item in sorted(params.items()))
+                probe_futures.append(([latent_dir, key, probe, params_name],
+                                      executor.submit(fit_probe, prefix, probe, params)))
+        for row, future in probe_futures:
+            rows.append(row + list(future.result()))
+        for row, future in embedding_futures:
+            rows.append(row + ['', '', future.result()[2], ''])
+    return rows, prefixes
+
+
+def write_table(rows, file_path):
+    """
+    Write the rows of run_sweep as csv and print them
+    """
+    with open(file_path, 'w') as f:
+        f.write(','.join(TABLE_COLUMNS) + '\n')
+        for row in rows:
+            f.write(','.join(str(value) if not isinstance(value, float) else '%.4f' % value for value in row) + '\n')
+    print('%-24s %-8s %-12s %-8s %8s %8s %10s %10s' % ('latents', 'key', 'probe', 'params', 'train', 'test',
+                                                      'fit (s)', 'pred (s)'))
+    for row in rows:
+        print('%-24s %-8s %-12s %-8s %8s %8s %10s %10s' % tuple(
+            [os.path.basename(row[0].rstrip('/'))[:24]] + row[1:4] +
+            ['%.4f' % value if isinstance(value, float) else value for value in row[4:]]))
@@ -0,0 +1,290 @@
+import numpy as np
+import os, json, shutil, hashlib
+
+"""
+Columnar store of the latent vectors of encoded objects, a directory with
+
+    meta.json                           z_dim, number of objects, hash of the encoder weights and the byte size of
+                                        each file
+    z_mean.f32, z_logvar.f32, z.f32     Objects x z_dim float32 rows, memory-mapped by LatentStore
+    ids.txt, categories.txt             one line per object
+    fingerprints.txt                    one line per object, the input_fingerprint of its input files
+
+Objects are appended in batches with append_latents. meta.json is replaced last, so the rows of an interrupted
+append are ignored by the readers and overwritten by the next append. With the weights hash and the fingerprints,
+prune() finds the objects to encode again after the weights or the inputs changed.
+"""
+
+FIELDS = ('z_mean', 'z_logvar', 'z')
+LINE_FILES = ('ids', 'categories', 'fingerprints')
+META_FILE = 'meta.json'
+
+
+def _read_meta(path):
+    with open(os.path.join(path, META_FILE)) as f:
+        return json.load(f)
+
+
+def _write_meta(path, meta):
+    temp_file = os.path.join(path, META_FILE + '.tmp')
+    with open(temp_file, 'w') as f:
+        json.dump(meta, f, indent=1)
+    os.replace(temp_file, os.path.join(path, META_FILE))
+
+
+def _read_lines(file_path, num_bytes):
+    with open(file_path, 'rb') as f:
+        data = f.read(num_bytes).decode()
+    return data.split('\n')[:-1]
+
+
+def _append(file_path, valid_bytes, data):
+    with open(file_path, 'ab') as f:
+        f.truncate(valid_bytes)
+        f.write(data)
+    return valid_bytes + len(data)
+
+
+def exists(path):
+    return os.path.exists(os.path.join(path, META_FILE))
+
+
+def file_hash(file_path):
+    """
+    SHA-1 of the content of a file, e.g. the weights of the encoder
+    """
+    sha1 = hashlib.sha1()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+def content_hash(path):
+    """
+    SHA-1 of the objects of the store in path (latent vectors, ids and categories), e.g. the key of the results
+    cached from a store, it changes with every append
+    """
+    meta = _read_meta(path)
+    sha1 = hashlib.sha1()
+    for name, file_name in [(field, field + '.f32') for field in FIELDS] + [('ids', 'ids.txt'),
+                                                                           ('categories', 'categories.txt')]:
+        remaining = meta['bytes'][name]
+        with open(os.path.join(path, file_name), 'rb') as f:
+            while remaining > 0:
+                block = f.read(min(remaining, 1 << 20))
+                if not block:
+                    break
+                sha1.update(block)
+                remaining -= len(block)
+    return sha1.hexdigest()
+
+
+def input_fingerprint(path):
+    """
+    Hash of the size and modification time of a file, or of every file under a directory (e.g. the views of an object)
+    """
+    if os.path.isdir(path):
+        files = sorted(os.path.join(root, name) for root, _, names in os.walk(path) for name in names)
+    else:
+        files = [path]
+    md5 = hashlib.md5()
+    for file_path in files:
+        stat = os.stat(file_path)
+        md5.update(('%s %d %d\n' % (os.path.relpath(file_path, path), stat.st_size, stat.st_mtime_ns)).encode())
+    return md5.hexdigest()
+
+
+def store_ids(path):
+    """
+    Returns: the set of the object ids in the store in path, empty if there is no store, e.g. the known_ids of the
+             appends to an existing store
+    """
+    if not exists(path):
+        return set()
+    return set(_read_lines(os.path.join(path, 'ids.txt'), _read_meta(path)['bytes']['ids']))
+
+
+def append_latents(path, ids, z_mean, z_logvar, z, categories=None, fingerprints=None, weights_hash=None,
+                   known_ids=None):
+    """
+    Append a batch of objects to the store in path, the store is created by the first append
+    Args:
+        ids: object ids, not in the store yet
+        z_mean, z_logvar, z: Batch x z_dim outputs of an encoder
+        categories: category of every object, or one category for all of them
+        fingerprints: input_fingerprint of every object, or None
+        weights_hash: file_hash of the encoder weights, the same for every append to a store
+        known_ids: set of the ids in the store (see store_ids) kept by the caller across appends, the ids of the
+                   batch are added to it. ids.txt is read to check the ids of every append if None
+    """
+    ids = [str(object_id) for object_id in ids]
+    if categories is None or isinstance(categories, str):
+        categories = [categories or ''] * len(ids)
+    if fingerprints is None:
+        fingerprints = [''] * len(ids)
+    z_dim = np.shape(z_mean)[1]
+
+    if exists(path):
+        meta = _read_meta(path)
+        if meta['z_dim'] != z_dim:
+            raise ValueError('The store %s holds %d dimensional latents, got %d' % (path, meta['z_dim'], z_dim))
+        if meta.get('weights_hash') != weights_hash:
+            raise ValueError('The store %s was encoded with other weights' % path)
+        if 'fingerprints' not in meta['bytes']:
+            # a store written before the fingerprints, its objects have none
+            meta['bytes']['fingerprints'] = _append(os.path.join(path, 'fingerprints.txt'), 0,
+                                                    b'\n' * meta['num_objects'])
+        if known_ids is None:
+            duplicates = set(_read_lines(os.path.join(path, 'ids.txt'), meta['bytes']['ids'])).intersection(ids)
+        else:
+            duplicates = known_ids.intersection(ids)
+        if duplicates:
+            raise ValueError('Objects already in the store %s: %s' % (path, sorted(duplicates)[:10]))
+    else:
+        if not os.path.exists(path):
+            os.makedirs(path)
+        meta = {'z_dim': z_dim, 'num_objects': 0, 'weights_hash': weights_hash,
+                'bytes': dict((name, 0) for name in FIELDS + LINE_FILES)}
+    if len(set(ids)) != len(ids):
+        raise ValueError('Duplicate object ids in the batch')
+
+    for field, values in zip(FIELDS, (z_mean, z_logvar, z)):
+        values = np.ascontiguousarray(values, dtype=np.float32).reshape(len(ids), z_dim)
+        meta['bytes'][field] = _append(os.path.join(path, field + '.f32'), meta['bytes'][field], values.tobytes())
+    for name, lines in zip(LINE_FILES, (ids, categories, fingerprints)):
+        data = ''.join(str(line) + '\n' for line in lines).encode()
+        meta['bytes'][name] = _append(os.path.join(path, name + '.txt'), meta['bytes'][name], data)
+    meta['num_objects'] += len(ids)
+    _write_meta(path, meta)
+    if known_ids is not None:
+        known_ids.update(ids)
+
+
+def latent_dict_to_store(latent_dict, path, categories=None):
+    """
+    Convert a dictionary pickled by the former generate_latent.py ({id + '_z_mean': vector, ...}) into a store
+    """
+    ids = sorted(key[:-len('_z_mean')] for key in latent_dict if key.endswith('_z_mean'))
+    append_latents(path, ids, *[np.stack([latent_dict[object_id + '_' + field] for object_id in ids])
+                                for field in FIELDS], categories=categories)
+
+
+def _copy_rows(store, rows, path, chunk_size, known_ids):
+    for start in range(0, len(rows), chunk_size):
+        chunk = rows[start:start + chunk_size]
+        append_latents(path, [store.ids[row] for row in chunk], store.z_mean[chunk], store.z_logvar[chunk],
+                       store.z[chunk], categories=list(store.categories[chunk]),
+                       fingerprints=[store.fingerprints[row] for row in chunk], weights_hash=store.weights_hash,
+                       known_ids=known_ids)
+
+
+def _replace(temp_path, path):
+    # the old store is moved aside before the new one takes its place and deleted last, so a crash leaves either
+    # store in path or the old one in path + '.old'
+    old_path = path.rstrip('/') + '.old'
+    if os.path.exists(old_path):
+        shutil.rmtree(old_path)
+    if os.path.exists(path):
+        os.rename(path, old_path)
+    if os.path.exists(temp_path):
+        os.rename(temp_path, path)
+    if os.path.exists(old_path):
+        shutil.rmtree(old_path)
+
+
+def merge_stores(sources, path, chunk_size=65536):
+    """
+    Concatenate the stores in sources, in order, into a new store in path, e.g. the shards of a sharded export.
+    path itself may be one of the sources.
+    """
+    temp_path = path.rstrip('/') + '.tmp'
+    if os.path.exists(temp_path):
+        shutil.rmtree(temp_path)
+    known_ids = set()
+    for source in sources:
+        store = LatentStore(source)
+        _copy_rows(store, np.arange(len(store)), temp_path, chunk_size, known_ids)
+    _replace(temp_path, path)
+
+
+def prune(path, ids, fingerprints, weights_hash, chunk_size=65536):
+    """
+    Drop from the store in path the objects that are not in ids or whose input fingerprint changed, or every object
+    if the store was encoded with other weights
+    Args:
+        ids, fingerprints: the current objects and their input_fingerprint
+        weights_hash: file_hash of the current encoder weights
+    Returns: the ids that are not up to date in the store, to be encoded and appended
+    """
+    if not exists(path):
+        return list(ids)
+    store = LatentStore(path)
+    if store.weights_hash != weights_hash:
+        rows = []
+    else:
+        current = dict(zip(ids, fingerprints))
+        rows = [row for row, object_id in enumerate(store.ids) if current.get(object_id) == store.fingerprints[row]]
+
+    if len(rows) < len(store):
+        temp_path = path.rstrip('/') + '.tmp'
+        if os.path.exists(temp_path):
+            shutil.rmtree(temp_path)
+        _copy_rows(store, np.array(rows, dtype=np.int64), temp_path, chunk_size, set())
+        _replace(temp_path, path)
+    kept = set(store.ids[row] for row in rows)
+    return [object_id for object_id in ids if object_id not in kept]
+
+
+class LatentStore(object):
+    """
+    Read only view of a latent store: z_mean, z_logvar and z are memory-mapped Objects x z_dim arrays,
+    get() finds the latent vector of an object id in O(1)
+    """
+
+    def __init__(self, path):
+        self.path = path
+        meta = _read_meta(path)
+        self.z_dim = meta['z_dim']
+        self.num_objects = meta['num_objects']
+        self.weights_hash = meta.get('weights_hash')
+        self.meta = meta
+
+        self.ids = _read_lines(os.path.join(path, 'ids.txt'), meta['bytes']['ids'])
+        self.categories = np.array(_read_lines(os.path.join(path, 'categories.txt'), meta['bytes']['categories']))
+        if 'fingerprints' in meta['bytes']:
+            self.fingerprints = _read_lines(os.path.join(path, 'fingerprints.txt'), meta['bytes']['fingerprints'])
+        else:
+            self.fingerprints = [''] * self.num_objects
+        self.index = dict((object_id, row) for row, object_id in enumerate(self.ids))
+        for field in FIELDS:
+            if self.num_objects == 0:
+                values = np.zeros((0, self.z_dim), dtype=np.float32)
+            else:
+                values = np.memmap(os.path.join(path, field + '.f32'), dtype=np.float32, mode='r',
+                                   shape=(self.num_objects, self.z_dim))
+            setattr(self, field, values)
+
+    def __len__(self):
+        return self.num_objects
+
+    def __contains__(self, object_id):
+        return object_id in self.index
+
+    def get(self, object_id, field='z_mean'):
+        return np.array(getattr(self, field)[self.index[object_id]])
+
+    def get_batch(self, object_ids, field='z_mean'):
+        return getattr(self, field)[[self.index[object_id] for object_id in object_ids]]
+
+
+def lookup(stores, field='z_mean'):
+    """
+    Object id -> latent vector function over several stores, searched in order (e.g. for latent_algebra)
+    """
+    def get(object_id):
+        for store in stores:
+            if object_id in store:
+                return store.get(object_id, field)
+        raise KeyError('No %s latent vector for %s' % (field, object_id))
+    return get
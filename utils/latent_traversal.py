@@ -0,0 +1,66 @@
+import numpy as np
+import os
+
+from utils import save_volume
+
+"""
+Latent traversals: every dimension of one or more seed latent vectors is swept over a range of values,
+the whole grid is built at once and decoded in large batches while a VolumeWriter saves the previous batch.
+"""
+
+
+def traversal_grid(seeds, steps=11, value_range=(-5.0, 5.0), dims=None):
+    """
+    Args:
+        seeds: Seeds x z_dim latent vectors
+        steps: number of values of each dimension, evenly spaced in value_range
+        dims: the swept dimensions, all of them if None
+    Returns: Seeds x Dims x Steps x z_dim, grid[s, d, i] is seeds[s] with dims[d] set to the i-th value
+    """
+    seeds = np.asarray(seeds, dtype=np.float32)
+    num_seeds, z_dim = seeds.shape
+    dims = np.arange(z_dim) if dims is None else np.asarray(dims)
+    values = np.linspace(value_range[0], value_range[1], steps, dtype=np.float32)
+
+    grid = np.repeat(np.repeat(seeds[:, np.newaxis, np.newaxis, :], len(dims), axis=1), steps, axis=2)
+    grid[:, np.arange(len(dims)), :, dims] = values
+    return grid
+
+
+def decode_in_batches(decoder, latents, batch_size=256):
+    """
+    Yields (start, decoder outputs of latents[start:start + batch_size])
+    """
+    for start in range(0, latents.shape[0], batch_size):
+        yield start, decoder.predict(latents[start:start + batch_size], batch_size=batch_size)
+
+
+def traverse(decoder, seeds, save_dir, seed_names=None, steps=11, value_range=(-5.0, 5.0), dims=None,
+             batch_size=256, save_bin=True, save_img=True):
+    """
+    Decode the traversal_grid of the seeds and save the volumes as
+    save_dir/<seed name>/<dim>_th_dim/<step>_gen.binvox / .png
+    Args:
+        decoder: latent -> bit-packed occupancy, e.g. model_registry.get_thresholded_model(decoder)
+        seed_names: sub folder of each seed, the volumes of a single seed are saved in save_dir if None
+    """
+    grid = traversal_grid(seeds, steps, value_range, dims)
+    num_seeds, num_dims = grid.shape[:2]
+    dims = np.arange(grid.shape[-1]) if dims is None else np.asarray(dims)
+    if seed_names is None:
+        seed_names = [''] if num_seeds == 1 else [str(s) for s in range(num_seeds)]
+
+    output_dirs = [[os.path.join(save_dir, seed_names[s], '%d_th_dim' % dims[d]) for d in range(num_dims)]
+                   for s in range(num_seeds)]
+    for output_dir in sum(output_dirs, []):
+        if not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+
+    with save_volume.VolumeWriter() as writer:
+        for start, packed in decode_in_batches(decoder, grid.reshape(-1, grid.shape[-1]), batch_size):
+            seed_index, dim_index, step_index = np.unravel_index(np.arange(start, start + packed.shape[0]),
+                                                                 grid.shape[:3])
+            # the batch goes to the writer still bit-packed
+            writer.save_batch(packed, [str(s) for s in step_index],
+                              [output_dirs[si][di] for si, di in zip(seed_index, dim_index)], '_gen',
+                              save_bin=save_bin, save_img=save_img)
@@ -1,5 +1,74 @@
 import numpy as np
 import tensorflow as tf
+from utils import globals as g
+
+# number of set bits of every 8 / 16 bit integer, to count the voxels of bit-packed volumes
+POPCOUNT_8 = np.array([bin(i).count('1') for i in range(1 << 8)], dtype=np.uint8)
+POPCOUNT_16 = POPCOUNT_8[np.arange(1 << 16) & 0xff] + POPCOUNT_8[np.arange(1 << 16) >> 8]
+
+
+def pack_voxels(voxels, threshold=1):
+    """
+    Store every voxel as one bit, 8 times smaller than a bool array
+    Args:
+        voxels: Batch x 1 x 32 x 32 x 32, occupied where >= threshold
+    Returns: Batch x 4096 uint8 array
+    """
+    num_objects = voxels.shape[0]
+    return np.packbits(voxels.reshape(num_objects, -1) >= threshold, axis=1)
+
+
+def unpack_voxels(packed, shape=g.VOXEL_INPUT_SHAPE):
+    """
+    Inverse of pack_voxels, returns Batch x shape uint8 array of 0 / 1
+    """
+    num_voxels = int(np.prod(shape))
+    return np.unpackbits(packed, axis=1)[:, :num_voxels].reshape((packed.shape[0],) + tuple(shape))
+
+
+def popcount(packed):
+    """
+    Returns: the number of set bits in every row of a Batch x Bytes uint8 array
+    """
+    if packed.shape[1] % 2 == 0:
+        packed = np.ascontiguousarray(packed).view(np.uint16)
+        return POPCOUNT_16[packed].sum(axis=1, dtype=np.int64)
+    return POPCOUNT_8[packed].sum(axis=1, dtype=np.int64)
+
+
+def packed_confusion_counts(packed_predictions, packed_gt, num_voxels=int(np.prod(g.VOXEL_INPUT_SHAPE))):
+    """
+    Count true positive, false positive, false negative and true negative voxels of every object
+    from bit-packed predictions and ground truth (see pack_voxels), with a bitwise and plus popcounts
+    Returns: tp, fp, fn, tn, int arrays of shape [batch_size]
+    """
+    tp = popcount(packed_predictions & packed_gt)
+    fp = popcount(packed_predictions) - tp
+    fn = popcount(packed_gt) - tp
+    tn = num_voxels - tp - fp - fn
+    return tp, fp, fn, tn
+
+
+def confusion_counts(predictions, gt, threshold=1):
+    """
+    Count true positive, false positive, false negative and true negative voxels of every object
+    Args:
+        predictions: the ouput of voxel decoder, Batch x 1 x 32 x 32 x 32, occupied where >= threshold
+        gt: the ground truth of objects, same shape
+    Returns: tp, fp, fn, tn, int arrays of shape [batch_size]
+    """
+    num_voxels = int(np.prod(predictions.shape[1:]))
+    return packed_confusion_counts(pack_voxels(predictions, threshold), pack_voxels(gt), num_voxels)
+
+
+def confusion_ratios(tp, fp, fn, tn):
+    """
+    Returns: precision, IoU, recall, accuracy of (arrays of) confusion counts, 0 where undefined
+    """
+    tp, fp, fn, tn = [np.asarray(count, dtype=np.float64) for count in (tp, fp, fn, tn)]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratios = [tp / (tp + fp), tp / (tp + fp + fn), tp / (tp + fn), (tp + tn) / (tp + fp + fn + tn)]
+    return tuple(np.nan_to_num(ratio) for ratio in ratios)
 
 
 def evaluate_voxel_prediction(predictions, gt, threshold=1):
@@ -10,84 +79,153 @@ def evaluate_voxel_prediction(predictions, gt, threshold=1):
         gt: the ground truth of object
     Returns:
     """
-    predtions_occupy = predictions >= threshold
-    gt = gt >= 1
-    inverse_gt = gt < 1
-    inverse_predtions_occupy = predictions <1
+    tp, fp, fn, tn = [np.sum(count) for count in confusion_counts(predictions, gt, threshold)]
+    return confusion_ratios(tp, fp, fn, tn)
 
-    intersection = np.sum(np.logical_and(predtions_occupy, gt)) # true positive
-    inverse_intersection = np.sum(np.logical_and(inverse_predtions_occupy, inverse_gt)) # true negative
-    union = np.sum(np.logical_or(predtions_occupy, gt)) #
-    num_fp = np.sum(np.logical_and(predtions_occupy, inverse_gt))  # false positive
-    num_fn = np.sum(np.logical_and(np.logical_not(predtions_occupy), gt))  # false negative
 
-    precision = intersection / (intersection + num_fp)
-    IoU = intersection / union
-    recall = intersection / (intersection + num_fn)
-    accuracy = (intersection + inverse_intersection) / (intersection+ inverse_intersection + num_fp + num_fn)
+class VoxelEvaluator(object):
+    """
+    Evaluate the reconstructions batch by batch, as they are predicted.
+    The confusion matrix of every object is written to `results_file` (csv) right away, only the totals
+    per category are kept in memory, so the test set can have any size.
+    """
+    COLUMNS = ['object_id', 'category', 'IoU', 'precision', 'recall', 'accuracy', 'tp', 'fp', 'fn', 'tn']
+
+    def __init__(self, results_file=None, threshold=1):
+        self.threshold = threshold
+        self.num_objects = 0
+        self.category_counts = {}  # category -> [tp, fp, fn, tn, number of objects, sum of object IoU]
+        self.results_file = None
+        if results_file is not None:
+            self.results_file = open(results_file, 'w')
+            self.results_file.write(','.join(self.COLUMNS) + '\n')
+
+    def update(self, predictions, gt, object_ids, categories=None, packed=False):
+        """
+        Args:
+            predictions: one batch of decoder outputs, Batch x 1 x 32 x 32 x 32
+            gt: the ground truth of the batch
+            object_ids: the id (hash) of every object in the batch
+            categories: the category of every object, or one category for the whole batch
+            packed: predictions and gt are already bit-packed by pack_voxels (Batch x 4096)
+        """
+        num_objects = predictions.shape[0]
+        if categories is None or isinstance(categories, str):
+            categories = [categories or ''] * num_objects
+
+        if packed:
+            tp, fp, fn, tn = packed_confusion_counts(predictions, gt)
+        else:
+            tp, fp, fn, tn = confusion_counts(predictions, gt, self.threshold)
+        precision, IoU, recall, accuracy = confusion_ratios(tp, fp, fn, tn)
+
+        category_names, category_index = np.unique(np.asarray(categories), return_inverse=True)
+        for k, category in enumerate(category_names):
+            in_category = category_index == k
+            counts = [np.sum(count[in_category]) for count in (tp, fp, fn, tn)]
+            counts += [np.count_nonzero(in_category), np.sum(IoU[in_category])]
+            totals = self.category_counts.setdefault(str(category), np.zeros(6))
+            totals += counts
+        self.num_objects += num_objects
+
+        if self.results_file is not None:
+            lines = ['%s,%s,%.6f,%.6f,%.6f,%.6f,%d,%d,%d,%d\n' % row for row in
+                     zip(object_ids, categories, IoU, precision, recall, accuracy, tp, fp, fn, tn)]
+            self.results_file.writelines(lines)
+
+    def _totals(self, category=None):
+        if category is not None:
+            return self.category_counts[category]
+        return np.sum([np.zeros(6)] + list(self.category_counts.values()), axis=0)
+
+    def pooled(self, category=None):
+        """
+        Returns: precision, IoU, recall, accuracy over all objects (of a category), pooled over voxels
+        """
+        return confusion_ratios(*self._totals(category)[:4])
+
+    def mean_IoU(self, category=None):
+        """
+        Returns: the IoU averaged over objects (of a category)
+        """
+        totals = self._totals(category)
+        return totals[5] / max(totals[4], 1)
+
+    def categories(self):
+        return sorted(self.category_counts.keys())
+
+    def close(self):
+        if self.results_file is not None:
+            self.results_file.close()
+            self.results_file = None
+
+
+def _safe_divide(numerator, denominator):
+    # the counts are integers, an empty denominator gives 0 instead of nan
+    return numerator / tf.maximum(denominator, 1.0)
+
+
+def voxel_confusion_matrix(y_true, y_pred):
+    """
+    Count true positive, false positive, false negative and true negative voxels of every sample
+    Args:
+        y_true: the ground truth, Batch x 1 x 32 x 32 x 32
+        y_pred: the logits of voxel decoder, same shape, occupied where > 0
+    Returns: tp, fp, fn, tn, each of shape [batch_size]
+    """
+    y_pred = tf.cast(y_pred > 0, dtype=tf.float32)
+    y_true = tf.cast(y_true > 0, dtype=tf.float32)
+    axis = list(range(1, len(y_pred.get_shape())))
+
+    # fp, fn and tn follow from the intersection and the predicted / true occupancy
+    tp = tf.reduce_sum(y_pred * y_true, axis=axis)
+    num_pred = tf.reduce_sum(y_pred, axis=axis)
+    num_true = tf.reduce_sum(y_true, axis=axis)
+    num_voxels = tf.cast(tf.reduce_prod(tf.shape(y_pred)[1:]), dtype=tf.float32)
 
-    return precision, IoU, recall, accuracy
+    fp = num_pred - tp
+    fn = num_true - tp
+    tn = num_voxels - tp - fp - fn
+    return tp, fp, fn, tn
 
 
-def get_precision(y_true, y_pred):
+def voxel_metrics(y_true, y_pred):
     """
-    Calculate metrics in the training process
+    Calculate metrics in the training process, every metric shares the same confusion matrix
+    Returns: dictionary with IoU, precision, recall and accuracy pooled over the batch,
+             and the per-sample values under 'sample_IoU', 'sample_precision', ...
     """
-    ones = tf.ones_like(y_true)
-    zero = tf.zeros_like(y_true)
-
-    y_pred = tf.where(y_pred > 0, ones, zero)
-    inverse_y_ture = tf.where(y_true > 0, zero, ones)
+    tp, fp, fn, tn = voxel_confusion_matrix(y_true, y_pred)
 
-    y_pred = tf.cast(y_pred, dtype=tf.bool)
-    y_true = tf.cast(y_true, dtype=tf.bool)
-    inverse_y_ture = tf.cast(inverse_y_ture, dtype=tf.bool)
+    def ratios(tp, fp, fn, tn):
+        return {'IoU': _safe_divide(tp, tp + fp + fn),
+                'precision': _safe_divide(tp, tp + fp),
+                'recall': _safe_divide(tp, tp + fn),
+                'accuracy': _safe_divide(tp + tn, tp + fp + fn + tn)}
 
-    intersection = tf.reduce_sum(tf.cast(tf.math.logical_and(y_pred, y_true), dtype=tf.float32))
-    num_fp = tf.reduce_sum(tf.cast(tf.math.logical_and(y_pred, inverse_y_ture), dtype=tf.float32))
-    precision = intersection / (intersection + num_fp)
+    batch = ratios(*[tf.reduce_sum(count) for count in (tp, fp, fn, tn)])
+    sample = ratios(tp, fp, fn, tn)
+    result = dict(batch)
+    result.update({'sample_' + key: value for key, value in sample.items()})
+    return result
 
-    return precision
 
-def get_accuracy(y_true, y_pred):
+def get_precision(y_true, y_pred):
     """
     Calculate metrics in the training process
     """
-    ones = tf.ones_like(y_true)
-    zero = tf.zeros_like(y_true)
-
-    y_pred = tf.where(y_pred > 0, ones, zero)
-    inverse_y_pred = tf.where(y_true > 0, zero, ones)
-    inverse_y_ture = tf.where(y_true > 0, zero, ones)
+    return voxel_metrics(y_true, y_pred)['precision']
 
-    y_pred = tf.cast(y_pred, dtype=tf.bool)
-    y_true = tf.cast(y_true, dtype=tf.bool)
-    inverse_y_ture = tf.cast(inverse_y_ture, dtype=tf.bool)
-    inverse_y_pred = tf.cast(inverse_y_pred, dtype=tf.bool)
 
-    intersection = tf.reduce_sum(tf.cast(tf.math.logical_and(y_pred, y_true), dtype=tf.float32)) # true positive
-    inverse_intersection = tf.reduce_sum(tf.cast(tf.math.logical_and(inverse_y_pred, inverse_y_ture), dtype=tf.float32)) # true negative
-    num_fp = tf.reduce_sum(tf.cast(tf.math.logical_and(y_pred, inverse_y_ture), dtype=tf.float32))
-    num_fn = tf.reduce_sum(tf.cast(tf.math.logical_and(y_pred, y_true), dtype=tf.float32))
-    accuracy = (intersection + inverse_intersection) / (intersection+ inverse_intersection + num_fp + num_fn)
+def get_accuracy(y_true, y_pred):
+    """
+    Calculate metrics in the training process
+    """
+    return voxel_metrics(y_true, y_pred)['accuracy']
 
-    return accuracy
 
 def get_IoU(y_true, y_pred):
     """
     Calculate metrics in the training process
     """
-    ones = tf.ones_like(y_true)
-    zero = tf.zeros_like(y_true)
-
-    y_pred = tf.where(y_pred > 0, ones, zero)
-
-    y_pred = tf.cast(y_pred, dtype=tf.bool)
-    y_true = tf.cast(y_true, dtype=tf.bool)
-
-    union = tf.reduce_sum(tf.cast(tf.math.logical_or(y_pred, y_true), dtype=tf.float32))
-    intersection = tf.reduce_sum(tf.cast(tf.math.logical_and(y_pred, y_true), dtype=tf.float32))
-
-    IoU = intersection / union
-
-    return IoU
+    return voxel_metrics(y_true, y_pred)['IoU']
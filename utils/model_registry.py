@@ -0,0 +1,114 @@
+import os
+from tensorflow.keras.layers import Input, Lambda
+from tensorflow.keras.models import Model
+
+from utils import model
+from utils import globals as g
+
+"""
+Builds and loads each network once per process. The models are cached by (network, z_dim, weights file,
+modification time of the weights file), so scripts that ask for the same network again, in a loop or in
+another analysis, get the loaded model back instead of rebuilding the graph, and retrained weights are
+picked up.
+"""
+
+VOXEL_ENCODER_WEIGHTS = 'weightsEnd_voxEncoder.h5'
+IMAGE_ENCODER_WEIGHTS = 'weightsEnd_imgEncoder.h5'
+DECODER_WEIGHTS = 'weightsEnd_voxDecoder.h5'
+
+_models = {}
+
+
+def _get_or_build(key, build):
+    if key not in _models:
+        _models[key] = build()
+    return _models[key]
+
+
+def _weights_key(weights_path):
+    weights_path = os.path.abspath(weights_path)
+    return weights_path, os.path.getmtime(weights_path)
+
+
+def _load(network, weights_path):
+    network.load_weights(weights_path, by_name=True)
+    return network
+
+
+def get_voxel_encoder(z_dim, weights_path):
+    return _get_or_build(('voxel_encoder', z_dim) + _weights_key(weights_path),
+                         lambda: _load(model.get_voxel_encoder(z_dim), weights_path))
+
+
+def get_image_encoder(z_dim, weights_path, view_image_shape=g.VIEWS_IMAGE_SHAPE_SHAPENET):
+    return _get_or_build(('image_encoder', z_dim, tuple(view_image_shape)) + _weights_key(weights_path),
+                         lambda: _load(model.get_img_encoder(z_dim, view_image_shape)['image_encoder'],
+                                       weights_path))
+
+
+def get_voxel_decoder(z_dim, weights_path):
+    return _get_or_build(('voxel_decoder', z_dim) + _weights_key(weights_path),
+                         lambda: _load(model.get_voxel_decoder(z_dim), weights_path))
+
+
+def get_thresholded_model(logits_model, threshold=0.0, pack_bits=True):
+    """
+    Cached model.get_thresholded_model of a model returned by this module
+    """
+    return _get_or_build(('thresholded', id(logits_model), threshold, pack_bits),
+                         lambda: model.get_thresholded_model(logits_model, threshold, pack_bits))
+
+
+def get_encoder(input_form, z_dim, weights_dir, view_image_shape=g.VIEWS_IMAGE_SHAPE_SHAPENET):
+    if input_form == 'voxel':
+        return get_voxel_encoder(z_dim, os.path.join(weights_dir, VOXEL_ENCODER_WEIGHTS))
+    elif input_form == 'image':
+        return get_image_encoder(z_dim, os.path.join(weights_dir, IMAGE_ENCODER_WEIGHTS), view_image_shape)
+    raise ValueError('Unknown input form: %s' % input_form)
+
+
+def get_decoder(z_dim, weights_dir):
+    return get_voxel_decoder(z_dim, os.path.join(weights_dir, DECODER_WEIGHTS))
+
+
+def get_reconstruction_model(input_form, z_dim, weights_dir, view_image_shape=g.VIEWS_IMAGE_SHAPE_SHAPENET,
+                             threshold=None, pack_bits=True):
+    """
+    Model from 'voxel' or 'image' inputs (encoder z_mean + decoder), from 'both' ([images, voxels], the z_mean of
+    the encoders weighted by IMG_WEIGHT and VOL_WEIGHT, like test_MMI.py) or from 'latent' inputs (decoder) to the
+    voxel logits, or to the occupancy of model.get_thresholded_model if a threshold is given.
+    The weights are the weightsEnd_*.h5 files saved by the training scripts in weights_dir.
+    """
+    decoder = get_decoder(z_dim, weights_dir)
+    if input_form == 'latent':
+        logits_model = decoder
+    elif input_form == 'both':
+        image_encoder = get_encoder('image', z_dim, weights_dir, view_image_shape)
+        voxel_encoder = get_encoder('voxel', z_dim, weights_dir)
+
+        def build():
+            image_input, voxel_input = Input(shape=view_image_shape), Input(shape=g.VOXEL_INPUT_SHAPE)
+            z_mean = Lambda(lambda z: g.IMG_WEIGHT * z[0] + g.VOL_WEIGHT * z[1], name='Weighted_Add_z_mean')(
+                [image_encoder(image_input)[0], voxel_encoder(voxel_input)[0]])
+            return Model([image_input, voxel_input], decoder(z_mean), name='Test_Both_VAE')
+
+        logits_model = _get_or_build(('reconstruction', id(image_encoder), id(voxel_encoder), id(decoder)), build)
+    else:
+        encoder = get_encoder(input_form, z_dim, weights_dir, view_image_shape)
+
+        def build():
+            inputs = Input(shape=g.VOXEL_INPUT_SHAPE if input_form == 'voxel' else view_image_shape)
+            return Model(inputs, decoder(encoder(inputs)[0]), name='Test_%s_VAE' % input_form.capitalize())
+
+        logits_model = _get_or_build(('reconstruction', id(encoder), id(decoder)), build)
+
+    if threshold is None:
+        return logits_model
+    return get_thresholded_model(logits_model, threshold, pack_bits)
+
+
+def clear():
+    """
+    Forget the cached models, e.g. after K.clear_session()
+    """
+    _models.clear()
@@ -0,0 +1,64 @@
+import tensorflow as tf
+from tensorflow.keras import backend as K
+from tensorflow.keras.optimizers import SGD
+
+
+class AccumulatedSGD(SGD):
+    """
+    SGD (with momentum / Nesterov) that sums the gradients of `accum_steps` micro-batches
+    and applies one update with their mean, so the effective batch is batch_size * accum_steps.
+    `iterations` counts micro-batches, the learning rate is still read from `lr` on every update,
+    so LearningRateScheduler and the epoch based callbacks behave as with plain SGD.
+    """
+
+    def __init__(self, accum_steps=1, **kwargs):
+        super(AccumulatedSGD, self).__init__(**kwargs)
+        if accum_steps < 1:
+            raise ValueError('accum_steps must be >= 1, got %d' % accum_steps)
+        self.accum_steps = int(accum_steps)
+
+    def get_updates(self, loss, params):
+        if self.accum_steps == 1:
+            return super(AccumulatedSGD, self).get_updates(loss, params)
+
+        grads = self.get_gradients(loss, params)
+
+        # 1.0 on the micro-batch that completes an accumulation cycle, 0.0 otherwise
+        apply_update = K.cast(K.equal((self.iterations + 1) % self.accum_steps, 0), K.floatx())
+
+        lr = self.lr
+        if self.initial_decay > 0:
+            num_updates = K.cast(self.iterations // self.accum_steps, K.dtype(self.decay))
+            lr = lr * (1. / (1. + self.decay * num_updates))
+
+        shapes = [K.int_shape(p) for p in params]
+        moments = [K.zeros(shape) for shape in shapes]
+        accumulators = [K.zeros(shape) for shape in shapes]
+        self.weights = [self.iterations] + moments + accumulators
+        self.updates = []
+
+        for p, g, m, a in zip(params, grads, moments, accumulators):
+            a_t = a + g
+            g_t = a_t / float(self.accum_steps)
+            v = self.momentum * m - lr * g_t  # velocity
+            if self.nesterov:
+                new_p = p + self.momentum * v - lr * g_t
+            else:
+                new_p = p + v
+            # Apply constraints.
+            if getattr(p, 'constraint', None) is not None:
+                new_p = p.constraint(new_p)
+
+            self.updates.append(K.update(m, apply_update * v + (1. - apply_update) * m))
+            self.updates.append(K.update(p, apply_update * new_p + (1. - apply_update) * p))
+            self.updates.append(K.update(a, (1. - apply_update) * a_t))
+
+        # the counter must only move after every update above has read it
+        with tf.control_dependencies(self.updates):
+            self.updates.append(K.update_add(self.iterations, 1))
+        return self.updates
+
+    def get_config(self):
+        config = {'accum_steps': self.accum_steps}
+        base_config = super(AccumulatedSGD, self).get_config()
+        return dict(list(base_config.items()) + list(config.items()))
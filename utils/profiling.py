@@ -0,0 +1,259 @@
+import numpy as np
+import tensorflow as tf
+import os, time, collections, contextlib, resource
+
+from tensorflow.keras import backend as K
+from tensorflow.keras.callbacks import Callback
+from tensorflow.python.client import timeline
+
+"""
+Time breakdown of the training steps of fit_generator, written next to training_log:
+
+    step_profile.csv        per step: the time waiting for the generator, the time the generator took to load the
+                            batch (per loading stage), the host to device time and the compute time
+    submodel_latency.csv    forward latency of the submodels, sampled every sample_every steps
+    traces/step_<n>.json    chrome traces (chrome://tracing) of the steps of trace_steps, their run metadata goes to
+                            TensorBoard too
+
+and the throughput and memory columns of training_log.
+"""
+
+
+def _arrays(batch):
+    if isinstance(batch, np.ndarray):
+        return [batch]
+    if isinstance(batch, (list, tuple)):
+        return [array for element in batch for array in _arrays(element)]
+    return []
+
+
+class StepProfiler(Callback):
+    """
+    The generator of fit_generator has to be wrapped by profile_generator(), its loading stages can be timed with
+    loading(stage). The host to device time is the time to feed zeros of the shapes of the last batch to the device,
+    measured every sample_every steps, the compute time is the rest of the step. The session callable is rebuilt for
+    the traced steps and the step after them, which makes them slower.
+
+    Args:
+        log_dir: the training directory
+        submodels: dict name -> (model, number of inputs of the model in a step), e.g. batch size x views for the
+                   image embedding model, their forward latency is measured on zeros
+        load_stages: names of the loading() stages
+        sample_every: steps between two latency samples, 0 to never sample
+        trace_steps: (first, last) steps to trace, counted from 0 over all epochs, or None
+    """
+
+    def __init__(self, log_dir, submodels=None, load_stages=(), sample_every=100, trace_steps=None):
+        super(StepProfiler, self).__init__()
+        self.log_dir = log_dir
+        self.submodels = submodels or {}
+        self.load_stages = list(load_stages)
+        self.sample_every = sample_every
+        self.trace_steps = trace_steps
+
+        self.step = 0
+        self.host_to_device_seconds = None
+        self._loads = collections.deque()
+        self._stage_seconds = {}
+        self._input_shapes = None
+        self._zeros = {}
+        self._warm = set()
+
+    # runs in the enqueuer thread of fit_generator
+    def profile_generator(self, generator):
+        while True:
+            self._stage_seconds = dict.fromkeys(self.load_stages, 0.)
+            start = time.time()
+            try:
+                batch = next(generator)
+            except StopIteration:
+                return
+            arrays = _arrays(batch)
+            self._input_shapes = [array.shape for array in arrays]
+            self._loads.append((time.time() - start, self._stage_seconds, sum(array.nbytes for array in arrays)))
+            yield batch
+
+    @contextlib.contextmanager
+    def loading(self, stage):
+        start = time.time()
+        yield
+        self._stage_seconds[stage] = self._stage_seconds.get(stage, 0.) + time.time() - start
+
+    def on_train_begin(self, logs=None):
+        self._step_file = open(os.path.join(self.log_dir, 'step_profile.csv'), 'w')
+        self._step_file.write(','.join(['epoch', 'step', 'wait_seconds', 'load_seconds'] +
+                                       ['%s_seconds' % stage for stage in self.load_stages] +
+                                       ['batch_bytes', 'host_to_device_seconds', 'compute_seconds', 'step_seconds',
+                                        'traced']) + '\n')
+        self._latency_file = open(os.path.join(self.log_dir, 'submodel_latency.csv'), 'w')
+        self._latency_file.write('epoch,step,submodel,inputs,seconds\n')
+
+        # the placeholders of the host to device measurement are fed like the model inputs
+        self._feeds = [K.placeholder(shape=K.int_shape(x), dtype=x.dtype) for x in self.model.inputs]
+        self._transfer = tf.add_n([tf.reduce_sum(tf.cast(x, tf.float32)) for x in self._feeds])
+        self._trace_writer = None
+        if self.trace_steps:
+            if not os.path.exists(os.path.join(self.log_dir, 'traces')):
+                os.makedirs(os.path.join(self.log_dir, 'traces'))
+            self._trace_writer = tf.summary.FileWriter(self.log_dir)
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.epoch = epoch
+        self._batch_end = time.time()
+
+    def on_batch_begin(self, batch, logs=None):
+        self._batch_begin = time.time()
+        self._traced = bool(self.trace_steps) and self.trace_steps[0] <= self.step <= self.trace_steps[1]
+        if self._traced:
+            # the session callable of the train function is rebuilt with the trace options for this step
+            train_function = self.model.train_function
+            self._run_options = train_function.run_options, train_function.run_metadata
+            train_function.run_options = tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE)
+            train_function.run_metadata = tf.RunMetadata()
+            train_function._callable_fn = None
+
+    def on_batch_end(self, batch, logs=None):
+        end = time.time()
+        if self._traced:
+            self._write_trace()
+        sampled = self.sample_every and self.step % self.sample_every == 0
+        if sampled:
+            self._measure_transfer()
+            self._measure_submodels()
+
+        load_seconds, stage_seconds, batch_bytes = self._loads.popleft() if self._loads else ('', {}, '')
+        step_seconds = end - self._batch_begin
+        compute_seconds = step_seconds - (self.host_to_device_seconds or 0.)
+        self._step_file.write(','.join(
+            [str(self.epoch), str(self.step), '%.6f' % (self._batch_begin - self._batch_end),
+             load_seconds if load_seconds == '' else '%.6f' % load_seconds] +
+            ['%.6f' % stage_seconds[stage] if stage in stage_seconds else '' for stage in self.load_stages] +
+            [str(batch_bytes), '' if self.host_to_device_seconds is None else '%.6f' % self.host_to_device_seconds,
+             '%.6f' % compute_seconds, '%.6f' % step_seconds, str(int(self._traced))]) + '\n')
+        self.step += 1
+        # the samples do not count as waiting for the next batch
+        self._batch_end = time.time()
+
+    def on_epoch_end(self, epoch, logs=None):
+        self._step_file.flush()
+        self._latency_file.flush()
+
+    def on_train_end(self, logs=None):
+        self._step_file.close()
+        self._latency_file.close()
+        if self._trace_writer is not None:
+            self._trace_writer.close()
+
+    def _zeros_like(self, shape, dtype=np.float32):
+        if (shape, dtype) not in self._zeros:
+            self._zeros[shape, dtype] = np.zeros(shape, dtype=dtype)
+        return self._zeros[shape, dtype]
+
+    def _measure_transfer(self):
+        if self._input_shapes is None or len(self._input_shapes) != len(self._feeds):
+            return
+        feed_dict = dict((x, self._zeros_like(shape, x.dtype.as_numpy_dtype))
+                         for x, shape in zip(self._feeds, self._input_shapes))
+        session = K.get_session()
+        session.run(self._transfer, feed_dict)
+        start = time.time()
+        session.run(self._transfer, feed_dict)
+        self.host_to_device_seconds = time.time() - start
+
+    def _measure_submodels(self):
+        for name, (submodel, num_inputs) in self.submodels.items():
+            inputs = [self._zeros_like((num_inputs,) + tuple(K.int_shape(x)[1:])) for x in submodel.inputs]
+            inputs = inputs[0] if len(inputs) == 1 else inputs
+            if name not in self._warm:
+                # the first call builds the predict function
+                submodel.predict_on_batch(inputs)
+                self._warm.add(name)
+            start = time.time()
+            submodel.predict_on_batch(inputs)
+            self._latency_file.write('%d,%d,%s,%d,%.6f\n' % (self.epoch, self.step, name, num_inputs,
+                                                             time.time() - start))
+
+    def _write_trace(self):
+        train_function = self.model.train_function
+        run_metadata = train_function.run_metadata
+        train_function.run_options, train_function.run_metadata = self._run_options
+        train_function._callable_fn = None
+
+        trace = timeline.Timeline(run_metadata.step_stats)
+        with open(os.path.join(self.log_dir, 'traces', 'step_%d.json' % self.step), 'w') as f:
+            f.write(trace.generate_chrome_trace_format(show_memory=True))
+        self._trace_writer.add_run_metadata(run_metadata, 'step_%d' % self.step, self.step)
+        self._trace_writer.flush()
+
+
+def _device_memory_op():
+    # peak bytes allocated on the GPU, tf.contrib is only there in TF 1.x
+    if not tf.test.is_gpu_available():
+        return None
+    try:
+        from tensorflow.contrib.memory_stats import MaxBytesInUse
+    except ImportError:
+        return None
+    with tf.device('/gpu:0'):
+        return MaxBytesInUse()
+
+
+class ThroughputLogger(Callback):
+    """
+    Adds to the logs of every epoch, so it has to come before CSVLogger and TensorBoard in the callbacks:
+
+        samples_per_second, steps_per_second    of the training steps, without the validation
+        queue_depth                             mean number of batches waiting in the queue of fit_generator, when
+                                                the generator is wrapped by count_generator()
+        peak_rss_mb                             peak resident memory of the process
+        device_peak_mb                          peak memory allocated on the GPU, when there is one
+
+    Args:
+        batch_size: samples of a step, when the batch logs do not have a size
+    """
+
+    def __init__(self, batch_size=None):
+        super(ThroughputLogger, self).__init__()
+        self.batch_size = batch_size
+        self.batches_loaded = None
+        self.batches_started = 0
+
+    # runs in the enqueuer thread of fit_generator
+    def count_generator(self, generator):
+        self.batches_loaded = 0
+        for batch in generator:
+            self.batches_loaded += 1
+            yield batch
+
+    def on_train_begin(self, logs=None):
+        self._device_memory = _device_memory_op()
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self._epoch_begin = self._last_batch_end = time.time()
+        self._steps = 0
+        self._samples = 0
+        self._queue_depths = []
+
+    def on_batch_begin(self, batch, logs=None):
+        self.batches_started += 1
+        if self.batches_loaded is not None:
+            # the batch of this step already left the queue
+            self._queue_depths.append(max(self.batches_loaded - self.batches_started, 0))
+
+    def on_batch_end(self, batch, logs=None):
+        self._last_batch_end = time.time()
+        self._steps += 1
+        self._samples += (logs or {}).get('size', self.batch_size) or 0
+
+    def on_epoch_end(self, epoch, logs=None):
+        if logs is None:
+            return
+        seconds = max(self._last_batch_end - self._epoch_begin, 1e-9)
+        logs['samples_per_second'] = self._samples / seconds
+        logs['steps_per_second'] = self._steps / seconds
+        if self._queue_depths:
+            logs['queue_depth'] = float(np.mean(self._queue_depths))
+        # kilobytes on Linux
+        logs['peak_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+        if self._device_memory is not None:
+            logs['device_peak_mb'] = K.get_session().run(self._device_memory) / 1024. ** 2
@@ -1,11 +1,26 @@
 import numpy as np
-import matplotlib.pyplot as plt
-from utils import data_IO, metrics
-import os
+from utils import data_IO, metrics, voxel_render, voxel_mesh, batching
+import os, time, collections, multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+
+def save_mesh_file(volume, file_path, mesh_format='obj', level=None):
+    """
+    Save the surface mesh of a volume, in the coordinates of its .binvox file
+    Args:
+        volume: 32 x 32 x 32 occupancy, or probabilities if level is given
+        level: None for the exposed faces of the occupied voxels, else the marching cubes iso-level
+    """
+    volume = np.swapaxes(volume, 1, 2)
+    if level is None:
+        vertices, faces = voxel_mesh.cube_mesh(volume)
+    else:
+        vertices, faces = voxel_mesh.marching_cubes_mesh(volume, level)
+    voxel_mesh.write_mesh(file_path, vertices, faces, mesh_format)
 
 
 # using in test_MMI.py
-def save_binvox_output(output_array, hash_id, output_dir, outname, save_bin=False, save_img=True):
+def save_binvox_output(output_array, hash_id, output_dir, outname, save_bin=False, save_img=True, save_mesh=None):
     # save objedt as .binvox
     if save_bin:
         print('Generating', hash_id+outname+'.binvox')
@@ -13,19 +28,19 @@ def save_binvox_output(output_array, hash_id, output_dir, outname, save_bin=Fals
 
     # save the model image
     if save_img:
-        facecolor = (176 / 255, 196 / 255, 222 / 255)  # lightsteelblue
-        fig = plt.figure()
-        ax = fig.gca(projection='3d')
         voxel_array = np.swapaxes(output_array, 1, 2)
-        ax.voxels(voxel_array.astype(np.bool), facecolors=facecolor)
         print('Generating', hash_id+outname+'.png')
-        plt.axis('off')
-        plt.savefig(output_dir + '/' + hash_id + outname + '.png')
-        plt.close()
+        voxel_render.save_voxel_png(voxel_array, output_dir + '/' + hash_id + outname + '.png')
+
+    # save the surface mesh, save_mesh is the format: 'obj' or 'ply'
+    if save_mesh:
+        print('Generating', hash_id+outname+'.'+save_mesh)
+        save_mesh_file(output_array, output_dir + '/' + hash_id + outname + '.' + save_mesh, save_mesh)
 
 
 # using in test scripy for modelnet dataset
-def save_binvox_output_for_modelnet(output_array, hash_id, output_dir, outname, save_bin=False, save_img=True):
+def save_binvox_output_for_modelnet(output_array, hash_id, output_dir, outname, save_bin=False, save_img=True,
+                                    save_mesh=None):
     # save objedt as .binvox
     if save_bin:
         s1 = output_dir + '/' + hash_id + outname + '.binvox'
@@ -35,62 +50,256 @@ def save_binvox_output_for_modelnet(output_array, hash_id, output_dir, outname,
 
     # save the model image
     if save_img:
-        facecolor = (176 / 255, 196 / 255, 222 / 255) # lightsteelblue
-        fig = plt.figure()
-        ax = fig.gca(projection='3d')
         # voxel_array = np.swapaxes(output_array, 1, 2)
-        ax.voxels(output_array.astype(np.bool), facecolors=facecolor)
-        plt.savefig(output_dir + '/' + hash_id + outname + '.png')
-        plt.close()
+        voxel_render.save_voxel_png(output_array, output_dir + '/' + hash_id + outname + '.png')
+
+    if save_mesh:
+        save_mesh_file(output_array, output_dir + '/' + hash_id + outname + '.' + save_mesh, save_mesh)
 
 
 def binvox2image(voxel_file, hash_id, output_dir, outname=''):
     voxel_array = data_IO.read_voxel_data(voxel_file)
-    fig = plt.figure()
-    ax = fig.gca(projection='3d')
-    ax.voxels(voxel_array.astype(np.bool), edgecolors='k')
-    plt.savefig(output_dir + '/' + hash_id + outname + '.png')
-    plt.close()
+    voxel_render.save_voxel_png(voxel_array, output_dir + '/' + hash_id + outname + '.png', edges=True)
 
 
 def binvox2image_2(voxel_file, hash_id, output_dir, outname=''):
     voxel_array = data_IO.read_voxel_data(voxel_file)
-    fig = plt.figure()
-    ax = fig.gca(projection='3d')
     voxel_array = np.swapaxes(voxel_array, 1, 2)
 
-    ax.voxels(voxel_array.astype(np.bool), edgecolors='k')
-    plt.savefig(output_dir + '/' + hash_id + outname + '.png')
-    plt.close()
+    voxel_render.save_voxel_png(voxel_array, output_dir + '/' + hash_id + outname + '.png', edges=True)
+
+
+def _save_chunk(save_function, packed, items):
+    # runs in a worker: unpack a chunk of bit-packed volumes and save each of them
+    voxels = metrics.unpack_voxels(packed)
+    for volume, item in zip(voxels, items):
+        save_function(volume[0], *item)
+
+
+def _save_mesh_chunk(volumes, file_paths, mesh_format, level):
+    # runs in a worker: mesh a chunk of probability volumes with marching cubes
+    for volume, file_path in zip(volumes, file_paths):
+        save_mesh_file(volume, file_path, mesh_format, level)
+
+
+def _save_file_chunk(save_function, items):
+    # runs in a worker: each save_function reads its .binvox file
+    for item in items:
+        save_function(*item)
+
+
+class VolumeWriter(object):
+    """
+    Saves volumes with save_binvox_output (or save_function) in a pool of worker processes, so the volumes are
+    written and rendered in parallel while the main thread predicts the next batch. The volumes are sent to the
+    workers bit-packed, chunk_size at a time. At most max_pending chunks (2 x num_workers by default) are in flight,
+    save() blocks beyond, and wait() returns once every volume saved so far is written. save_files() renders .binvox
+    files in the same workers.
+    """
+
+    def __init__(self, num_workers=4, use_processes=True, chunk_size=16, max_pending=None,
+                 save_function=save_binvox_output):
+        self.chunk_size = chunk_size
+        self.max_pending = max_pending or 2 * num_workers
+        self.save_function = save_function
+        if use_processes:
+            # the workers are spawned, forking the TensorFlow session and the prefetch threads can deadlock them
+            self._executor = ProcessPoolExecutor(num_workers, mp_context=multiprocessing.get_context('spawn'))
+        else:
+            self._executor = ThreadPoolExecutor(num_workers)
+        self._pending = collections.deque()
+        self._volumes, self._items = [], []
+
+    def save(self, output_array, hash_id, output_dir, outname, save_bin=False, save_img=True, save_mesh=None):
+        self._volumes.append(metrics.pack_voxels(np.asarray(output_array)[np.newaxis, np.newaxis])[0])
+        self._items.append((hash_id, output_dir, outname, save_bin, save_img, save_mesh))
+        if len(self._items) >= self.chunk_size:
+            self._submit()
+
+    def save_batch(self, packed, hash_ids, output_dir, outname, save_bin=False, save_img=True, save_mesh=None):
+        """
+        Args:
+            packed: Batch x 4096 bit-packed volumes, e.g. the output of model_registry.get_thresholded_model
+            output_dir: one folder for the whole batch or one per volume
+        """
+        if isinstance(output_dir, str):
+            output_dir = [output_dir] * len(hash_ids)
+        self._submit()
+        for start in range(0, len(hash_ids), self.chunk_size):
+            excerpt = slice(start, start + self.chunk_size)
+            self._volumes = list(packed[excerpt])
+            self._items = [(hash_id, directory, outname, save_bin, save_img, save_mesh)
+                           for hash_id, directory in zip(hash_ids[excerpt], output_dir[excerpt])]
+            self._submit()
+
+    def save_meshes(self, volumes, hash_ids, output_dir, outname, mesh_format='obj', level=None):
+        """
+        Save the surface mesh of every volume of a batch as output_dir/<hash_id><outname>.<mesh_format>, the
+        occupancy of a thresholded model is better saved with save_batch(..., save_mesh=mesh_format)
+        Args:
+            volumes: Batch x 1 x 32 x 32 x 32 occupancy, or probabilities (e.g. the sigmoid of the decoder logits)
+                     meshed with marching cubes at level
+            mesh_format: 'obj' or 'ply'
+        """
+        volumes = np.asarray(volumes)
+        volumes = volumes.reshape((volumes.shape[0],) + volumes.shape[-3:])
+        if level is None:
+            # the occupancy is sent bit-packed, like save_batch
+            self.save_batch(metrics.pack_voxels((volumes > 0)[:, np.newaxis]), hash_ids, output_dir, outname,
+                            save_bin=False, save_img=False, save_mesh=mesh_format)
+            return
+        for start in range(0, len(hash_ids), self.chunk_size):
+            excerpt = slice(start, start + self.chunk_size)
+            self._submit_task(_save_mesh_chunk, volumes[excerpt].astype(np.float32),
+                              [os.path.join(output_dir, hash_id + outname + '.' + mesh_format)
+                               for hash_id in hash_ids[excerpt]], mesh_format, level)
+
+    def save_files(self, voxel_files, hash_ids, output_dir, outname='', save_function=binvox2image):
+        """
+        Render .binvox files as output_dir/<hash_id><outname>.png, the files are read by the workers
+        Args:
+            save_function: binvox2image, or binvox2image_2 for the files of the ShapeNet dataset
+        """
+        for start in range(0, len(voxel_files), self.chunk_size):
+            excerpt = slice(start, start + self.chunk_size)
+            self._submit_task(_save_file_chunk, save_function,
+                              [(voxel_file, hash_id, output_dir, outname)
+                               for voxel_file, hash_id in zip(voxel_files[excerpt], hash_ids[excerpt])])
 
+    def _submit(self):
+        if not self._items:
+            return
+        volumes, items = np.stack(self._volumes), self._items
+        self._volumes, self._items = [], []
+        self._submit_task(_save_chunk, self.save_function, volumes, items)
 
-def save_metrics(predictions, gt, voxelPath, imagePath, inputform, output_dir):
+    def _submit_task(self, function, *args):
+        self._pending.append(self._executor.submit(function, *args))
+        # backpressure, also raises the error of a failed chunk
+        while len(self._pending) > self.max_pending:
+            self._pending.popleft().result()
+
+    def wait(self):
+        """
+        Wait until every volume saved so far is written
+        """
+        self._submit()
+        while self._pending:
+            self._pending.popleft().result()
+
+    def close(self):
+        try:
+            self.wait()
+        finally:
+            self._executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        if exc_type is None:
+            self.close()
+        else:
+            # the caller failed, drop the volumes that are not written yet
+            for future in self._pending:
+                future.cancel()
+            self._executor.shutdown()
+
+
+def save_meshes(volumes, hash_ids, output_dir, outname, mesh_format='obj', level=None, num_workers=4):
     """
-    Save the metrics into .txt form
+    Save the surface mesh of every volume of a batch as output_dir/<hash_id><outname>.<mesh_format>, in a
+    VolumeWriter, see VolumeWriter.save_meshes
+    """
+    with VolumeWriter(num_workers) as writer:
+        writer.save_meshes(volumes, hash_ids, output_dir, outname, mesh_format, level)
+
+
+def save_metrics(predictions, gt, voxelPath, imagePath, inputform, output_dir, object_ids=None, categories=None,
+                 batch_size=256, packed=False):
+    """
+    Save the metrics into .txt form, and the metrics of every object into metrics_per_object.csv
     Args:
         output_array: the output of voxel decoder
         gt: voxel ground truth
         output_dir: save path
+        object_ids: the id of every object, their index if None
+        categories: the category of every object, or one category for all of them
+        packed: predictions and gt are bit-packed by metrics.pack_voxels
     Returns:
     """
+    num_objects = predictions.shape[0]
+    if object_ids is None:
+        object_ids = [str(i) for i in range(num_objects)]
+
+    evaluator = metrics.VoxelEvaluator(os.path.join(output_dir, 'metrics_per_object.csv'))
+    for start in range(0, num_objects, batch_size):
+        excerpt = slice(start, start + batch_size)
+        batch_categories = categories if categories is None or isinstance(categories, str) else categories[excerpt]
+        evaluator.update(predictions[excerpt], gt[excerpt], object_ids[excerpt], batch_categories, packed=packed)
+    evaluator.close()
+    write_metrics_summary(evaluator, voxelPath, imagePath, inputform, output_dir)
+
+
+def evaluate_in_batches(thresholded_model, load, object_ids, output_dir, batch_size=32, num_workers=4,
+                        use_processes=False, categories=None, writer=None, num_saved=None, **save_args):
+    """
+    Reconstruct and evaluate the objects batch by batch. The batches are loaded by a pool of workers while the model
+    predicts, the metrics of every batch are accumulated by a metrics.VoxelEvaluator (metrics_per_object.csv in
+    output_dir) and its reconstructions are handed to writer, so only a few batches are in memory whatever the
+    number of objects.
+    Args:
+        thresholded_model: inputs -> bit-packed occupancy, e.g. model_registry.get_thresholded_model
+        load: function(object_ids[start:end]) -> (model inputs, bit-packed ground truth), see
+              batching.prefetch_batches
+        categories: the category of every object, or one category for all of them
+        writer: VolumeWriter saving the reconstructions as output_dir/<id>_gen.*, nothing is saved if None
+        num_saved: only the reconstructions of the first num_saved objects are saved, all of them if None
+        save_args: VolumeWriter.save_batch arguments, e.g. save_bin=True
+    Returns: the closed metrics.VoxelEvaluator, see write_metrics_summary
+    """
+    evaluator = metrics.VoxelEvaluator(os.path.join(output_dir, 'metrics_per_object.csv'))
+    num_batches = (len(object_ids) + batch_size - 1) // batch_size
+    begin = time.time()
+    for i, (start, (inputs, gt)) in enumerate(batching.prefetch_batches(load, object_ids, batch_size, num_workers,
+                                                                        use_processes)):
+        reconstructions = thresholded_model.predict(inputs, batch_size=batch_size)
+        end = start + reconstructions.shape[0]
+        batch_categories = categories if categories is None or isinstance(categories, str) else categories[start:end]
+        evaluator.update(reconstructions, gt, object_ids[start:end], batch_categories, packed=True)
+        if writer is not None:
+            num_batch_saved = max(min(num_saved - start, end - start), 0) if num_saved is not None else end - start
+            writer.save_batch(reconstructions[:num_batch_saved], object_ids[start:start + num_batch_saved],
+                              output_dir, '_gen', **save_args)
+        print("Testing batch: %d/%d, %.1f objects/s" % (i + 1, num_batches, end / (time.time() - begin)))
+    evaluator.close()
+    return evaluator
+
+
+def write_metrics_summary(evaluator, voxelPath, imagePath, inputform, output_dir):
+    """
+    Write the pooled metrics of a metrics.VoxelEvaluator into metrics.txt, followed by one line per category
+    """
     metrics_file = os.path.join(output_dir, 'metrics.txt')
     metrics_file = open(metrics_file, 'w')
 
-    precision, IoU, recall, accuracy = metrics.evaluate_voxel_prediction(predictions, gt, threshold=1)
-    metrics_file.write(voxelPath + '\n')
-    metrics_file.write(imagePath + '\n')
+    precision, IoU, recall, accuracy = evaluator.pooled()
+    metrics_file.write(str(voxelPath) + '\n')
+    metrics_file.write(str(imagePath) + '\n')
     metrics_file.write(inputform + '\n')
-    metrics_file.write("Object number:" + str(predictions.shape[0]) + '\n')
+    metrics_file.write("Object number:" + str(evaluator.num_objects) + '\n')
     metrics_file.write("Precision:" + str(precision) + '\n')
     metrics_file.write("IoU:" + str(IoU) + '\n')
     metrics_file.write("Recall:" + str(recall) + '\n')
     metrics_file.write("Accuracy:" + str(accuracy) + '\n')
-    metrics_file.close()
+    metrics_file.write("Mean object IoU:" + str(evaluator.mean_IoU()) + '\n')
 
-    # for i in range(predictions.shape[0]):
-    #     precision, IoU, recall = metrics.evaluate_voxel_prediction(predictions[i], gt[i], threshold=1)
-    #     metrics_file.write(str(hash_id[i]) + ',')
-    #     metrics_file.write(str(precision) + ',')
-    #     metrics_file.write(str(IoU) + ',')
-    #     metrics_file.write(str(recall) + '\n')
-    # metrics_file.close()
+    categories = [category for category in evaluator.categories() if category]
+    if categories:
+        metrics_file.write('\ncategory,objects,precision,IoU,recall,accuracy,mean_object_IoU\n')
+        for category in categories:
+            precision, IoU, recall, accuracy = evaluator.pooled(category)
+            metrics_file.write('%s,%d,%.6f,%.6f,%.6f,%.6f,%.6f\n' % (
+                category, evaluator.category_counts[category][4], precision, IoU, recall, accuracy,
+                evaluator.mean_IoU(category)))
+    metrics_file.close()
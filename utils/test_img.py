@@ -1,6 +1,6 @@
 
 import matplotlib.pyplot as plt
-from utils import data_IO
+from utils import data_IO, voxel_render
 import glob
 from PIL import Image
 import numpy as np
@@ -13,11 +13,7 @@ def create_img_from_modelnet(modelnet_path, save_path):
     for i,file in enumerate(binvox_files):
         array=data_IO.read_voxel_data(file)
         array=np.int32(array)
-        fig = plt.figure()
-        ax = fig.gca(projection='3d')
-        ax.voxels(array.astype(np.bool), edgecolors='k')
-        plt.savefig(save_path + '/' + names[i][0] + '.png')
-        plt.close()
+        voxel_render.save_voxel_png(array, save_path + '/' + names[i][0] + '.png', edges=True)
 
 
 if __name__ == '__main__':
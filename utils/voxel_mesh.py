@@ -0,0 +1,111 @@
+import numpy as np
+
+"""
+Surface meshes of occupancy grids for the tools that do not read .binvox, written as .obj or binary .ply.
+
+    cube_mesh              the faces of the occupied voxels that touch an empty voxel (or the border of the grid),
+                           one quad per face, the corners shared by several faces are one vertex
+    marching_cubes_mesh    the iso-surface of the decoder probabilities at a level, smooth triangles
+
+A voxel [i, j, k] is the unit cube from (i, j, k) to (i + 1, j + 1, k + 1), both meshes use these coordinates and
+their faces are counter-clockwise seen from outside the object.
+"""
+
+# the corners of the face of a voxel on the positive side of axis 0, counter-clockwise seen from outside, the other
+# axes are rolled
+_FACE_CORNERS = np.array([[1, 0, 0], [1, 1, 0], [1, 1, 1], [1, 0, 1]])
+
+
+def exposed_faces(voxels):
+    """
+    Returns: a list of (axis, side, N x 3 indices of the occupied voxels whose neighbor on that side is empty)
+    """
+    occupied = np.pad(np.asarray(voxels) > 0, 1, mode='constant')
+    faces = []
+    for axis in range(3):
+        inner = [slice(1, -1)] * 3
+        for side in (1, -1):
+            neighbor = list(inner)
+            neighbor[axis] = slice(2, None) if side > 0 else slice(None, -2)
+            faces.append((axis, side, np.argwhere(occupied[tuple(inner)] & ~occupied[tuple(neighbor)])))
+    return faces
+
+
+def cube_mesh(voxels):
+    """
+    Args:
+        voxels: X x Y x Z occupancy
+    Returns: V x 3 float32 vertices and F x 4 int32 quads
+    """
+    shape = np.array(np.shape(voxels)) + 1
+    corners = []
+    for axis, side, indices in exposed_faces(voxels):
+        face_corners = np.roll(_FACE_CORNERS, axis, axis=1)
+        if side < 0:
+            # the opposite face, reversed to stay counter-clockwise from outside
+            face_corners = face_corners[::-1].copy()
+            face_corners[:, axis] = 0
+        corners.append(indices[:, np.newaxis, :] + face_corners[np.newaxis])
+    corners = np.concatenate(corners)
+
+    # one vertex per lattice point, numbered in the order of the lattice
+    keys = np.ravel_multi_index(corners.reshape(-1, 3).T, shape)
+    keys, faces = np.unique(keys, return_inverse=True)
+    vertices = np.stack(np.unravel_index(keys, shape), axis=1).astype(np.float32)
+    return vertices, faces.reshape(-1, 4).astype(np.int32)
+
+
+def triangulate(faces):
+    """
+    Returns: the 2 x F triangles of F quads
+    """
+    return np.concatenate([faces[:, [0, 1, 2]], faces[:, [0, 2, 3]]]).astype(np.int32)
+
+
+def marching_cubes_mesh(probabilities, level=0.5):
+    """
+    Args:
+        probabilities: X x Y x Z occupancy probabilities, e.g. the sigmoid of the decoder logits
+    Returns: V x 3 float32 vertices and F x 3 int32 triangles of the surface at level
+    """
+    # only needed for this mode
+    from skimage import measure
+    # zero padded so the surface is closed at the border of the grid
+    padded = np.pad(np.asarray(probabilities, dtype=np.float32), 1, mode='constant')
+    if padded.max() <= level:
+        return np.zeros((0, 3), dtype=np.float32), np.zeros((0, 3), dtype=np.int32)
+    vertices, faces = measure.marching_cubes(padded, level)[:2]
+    # the value of a voxel is at its center, the triangles are reversed to face outside
+    return (vertices - 0.5).astype(np.float32), faces[:, ::-1].astype(np.int32)
+
+
+def write_obj(file_path, vertices, faces):
+    num_corners = faces.shape[1]
+    with open(file_path, 'w') as f:
+        f.write(('v %g %g %g\n' * vertices.shape[0]) % tuple(vertices.ravel()))
+        # obj indices start at 1
+        f.write((('f' + ' %d' * num_corners + '\n') * faces.shape[0]) % tuple((faces + 1).ravel()))
+
+
+def write_ply(file_path, vertices, faces):
+    num_corners = faces.shape[1]
+    header = ('ply\nformat binary_little_endian 1.0\nelement vertex %d\n'
+              'property float x\nproperty float y\nproperty float z\n'
+              'element face %d\nproperty list uchar int vertex_indices\nend_header\n') % (vertices.shape[0],
+                                                                                       faces.shape[0])
+    face_records = np.empty(faces.shape[0], dtype=[('count', 'u1'), ('indices', '<i4', (num_corners,))])
+    face_records['count'] = num_corners
+    face_records['indices'] = faces
+    with open(file_path, 'wb') as f:
+        f.write(header.encode())
+        f.write(np.ascontiguousarray(vertices, dtype='<f4').tobytes())
+        f.write(face_records.tobytes())
+
+
+MESH_WRITERS = {'obj': write_obj, 'ply': write_ply}
+
+
+def write_mesh(file_path, vertices, faces, mesh_format='obj'):
+    if mesh_format not in MESH_WRITERS:
+        raise ValueError('Unknown mesh format: %s' % mesh_format)
+    MESH_WRITERS[mesh_format](file_path, vertices, faces)
@@ -0,0 +1,202 @@
+import numpy as np
+import functools
+from PIL import Image
+
+"""
+Orthographic preview renderer of occupancy grids, a NumPy replacement of matplotlib's ax.voxels.
+
+Under an orthographic projection every voxel covers the same silhouette: the three faces of the unit cube turned
+to the camera. That sprite is rasterized once per 1/8 pixel position, with one label per face and optional edges,
+and stamped at the projected position of every voxel that has an empty neighbor on a visible side, from the farthest
+voxel to the nearest one so the nearer voxels paint over the farther ones. The labels are colored with one shade per
+face at the end. The volume is indexed [x, y, z] with z up and the default view is the one of matplotlib's 3d axes
+(elevation 30, azimuth -60).
+"""
+
+LIGHTSTEELBLUE = (176, 196, 222)
+BACKGROUND = (255, 255, 255)
+# sub-pixel positions of a voxel per pixel and axis, each with its own sprite
+PHASES = 8
+
+
+def _view_axes(elevation, azimuth):
+    # unit vectors of the screen right, screen up and towards the camera, in volume coordinates
+    elevation, azimuth = np.radians(elevation), np.radians(azimuth)
+    towards_camera = np.array([np.cos(elevation) * np.cos(azimuth), np.cos(elevation) * np.sin(azimuth),
+                               np.sin(elevation)])
+    right = np.array([-np.sin(azimuth), np.cos(azimuth), 0.])
+    up = np.cross(towards_camera, right)
+    return right, up, towards_camera
+
+
+@functools.lru_cache(maxsize=32)
+def _sprites(grid_shape, image_size, elevation, azimuth, color, edges, aspect):
+    """
+    Returns: the (row, column) offsets of the pixels covered by the sprite and their labels for each sub-pixel phase
+             of the voxel position, the color of each label, the matrix from volume coordinates to (row, column) and
+             depth, the pixel origin of the volume and the (axis, direction) of the sides turned to the camera
+    """
+    right, up, towards_camera = _view_axes(elevation, azimuth)
+    # a light above the camera
+    light = towards_camera + 0.8 * up + 0.3 * right
+    light /= np.linalg.norm(light)
+    # the volume axes are stretched to the aspect of the box before the projection
+    aspect = np.array(aspect, dtype=np.float64) / np.max(aspect)
+    right, up, towards_camera = right * aspect, up * aspect, towards_camera * aspect
+    height, width = image_size
+
+    # the whole grid fits the image with a margin, like fixed 3d axes limits
+    corners = np.array([[x, y, z] for x in (0, grid_shape[0]) for y in (0, grid_shape[1]) for z in (0, grid_shape[2])],
+                       dtype=np.float64)
+    columns, rows = corners.dot(right), -corners.dot(up)
+    scale = 0.9 * min(width / (columns.max() - columns.min()), height / (rows.max() - rows.min()))
+    projection = np.stack([-up * scale, right * scale, towards_camera])
+    origin = np.array([(height - scale * (rows.max() + rows.min())) / 2.,
+                       (width - scale * (columns.max() + columns.min())) / 2.])
+    # every voxel is projected on a multiple of 1 / PHASES pixel, so the sprites of neighbor voxels fit exactly
+    projection[:2] = np.round(projection[:2] * PHASES) / PHASES
+    origin = np.round(origin * PHASES) / PHASES
+
+    # pixels around the unit cube, for every phase
+    cube = np.array([[x, y, z] for x in (0, 1) for y in (0, 1) for z in (0, 1)], dtype=np.float64)
+    cube_pixels = cube.dot(projection[:2].T)
+    top_left = np.floor(cube_pixels.min(axis=0)).astype(int) - 1
+    sprite_shape = np.ceil(cube_pixels.max(axis=0)).astype(int) + 2 - top_left
+    offsets = np.stack(np.meshgrid(np.arange(sprite_shape[0]), np.arange(sprite_shape[1]), indexing='ij'),
+                       axis=-1).reshape(-1, 2) + top_left
+
+    # the face of the unit cube turned to the camera along every axis, shaded by its stretched normal
+    faces = []
+    for axis in range(3):
+        normal = np.zeros(3)
+        normal[axis] = np.sign(towards_camera[axis]) or 1.
+        face_origin = np.zeros(3)
+        face_origin[axis] = 1. if normal[axis] > 0 else 0.
+        span = np.eye(3)[[a for a in range(3) if a != axis]]
+        basis = span.dot(projection[:2].T).T
+        if abs(np.linalg.det(basis)) < 1e-9:
+            continue
+        shade = 0.45 + 0.55 * max(normal.dot(light / aspect) / np.linalg.norm(normal / aspect), 0.)
+        faces.append((face_origin.dot(projection[:2].T), np.linalg.inv(basis), np.array(color) * shade))
+    face_colors = np.array([face[2] for face in faces])
+
+    # the covered pixels of every phase with their label: 1 + the face, or len(faces) + 1 for an edge
+    palette = np.concatenate([face_colors, [[0., 0., 0.]]]).astype(np.uint8)
+    sprite_pixels, sprite_labels = [], []
+    for phase in range(PHASES * PHASES):
+        # pixel centers relative to a voxel projected at this fraction of a pixel
+        centers = offsets + 0.5 - np.array(divmod(phase, PHASES)) / float(PHASES)
+        # solve center = face origin + s * span[0] + t * span[1]
+        s, t = np.array([inverse.dot((centers - face_origin).T)
+                         for face_origin, inverse, _ in faces]).transpose(1, 0, 2)
+        outside = np.maximum(np.maximum(-s, s - 1), np.maximum(-t, t - 1))
+        # a pixel center on the edge of two faces goes to one of them
+        nearest = np.argmin(outside, axis=0)
+        pixels = np.arange(offsets.shape[0])
+        labels = nearest + 1
+        if edges:
+            border = np.minimum(np.minimum(s, 1 - s), np.minimum(t, 1 - t))[nearest, pixels]
+            labels[border < 0.75 / scale] = len(faces) + 1
+        covered = outside[nearest, pixels] <= 1e-6
+        sprite_pixels.append(offsets[covered])
+        sprite_labels.append(labels[covered])
+
+    # padded to the largest sprite, the padding repeats the last pixel of the sprite
+    size = max(pixels.shape[0] for pixels in sprite_pixels)
+    pad = lambda values: np.concatenate([values, values[-1:].repeat(size - values.shape[0], axis=0)])
+    sprite_pixels = np.stack([pad(pixels) for pixels in sprite_pixels])
+    sprite_labels = np.stack([pad(labels) for labels in sprite_labels]).astype(np.uint8)
+
+    visible_sides = [(axis, 1 if towards_camera[axis] > 0 else -1) for axis in range(3)
+                     if abs(towards_camera[axis]) > 1e-9]
+    return sprite_pixels, sprite_labels, palette, projection, origin, visible_sides
+
+
+def surface_voxels(voxels, visible_sides):
+    """
+    Returns: N x 3 indices of the occupied voxels with an empty neighbor on a side turned to the camera
+    """
+    occupied = np.asarray(voxels) > 0
+    exposed = np.zeros_like(occupied)
+    for axis, side in visible_sides:
+        neighbor = np.zeros_like(occupied)
+        # the neighbor on the camera side of every voxel, outside the grid is empty
+        source = [slice(None)] * 3
+        target = [slice(None)] * 3
+        source[axis] = slice(1, None) if side > 0 else slice(None, -1)
+        target[axis] = slice(None, -1) if side > 0 else slice(1, None)
+        neighbor[tuple(target)] = occupied[tuple(source)]
+        exposed |= ~neighbor
+    return np.argwhere(occupied & exposed)
+
+
+def render_voxels(voxels, image_size=(256, 256), elevation=30., azimuth=-60., color=LIGHTSTEELBLUE, edges=False,
+                  background=BACKGROUND, aspect=(4, 4, 3)):
+    """
+    Args:
+        voxels: X x Y x Z occupancy, z is up
+        image_size: (height, width) in pixels
+        edges: draw the edges of the faces in black, like ax.voxels(..., edgecolors='k')
+        aspect: relative size of the axes, the default box aspect of matplotlib's 3d axes
+    Returns: height x width x 3 uint8 image
+    """
+    voxels = np.asarray(voxels)
+    image_size = tuple(image_size)
+    sprite_pixels, sprite_labels, palette, projection, origin, visible_sides = _sprites(
+        voxels.shape, image_size, float(elevation), float(azimuth), tuple(color), bool(edges), tuple(aspect))
+    height, width = image_size
+    # one label per pixel, 0 for the background, on a canvas with a border wide enough for any sprite
+    border = np.abs(sprite_pixels).max() + 1
+    canvas_width = width + 2 * border
+    canvas = np.zeros((height + 2 * border) * canvas_width, dtype=np.uint8)
+
+    indices = surface_voxels(voxels, visible_sides)
+    if indices.shape[0]:
+        # farthest voxel first, later writes win
+        indices = indices[np.argsort(indices.dot(projection[2]), kind='stable')]
+        position = indices.dot(projection[:2].T) + origin
+        anchors = np.floor(position).astype(int)
+        phases = np.rint((position - anchors) * PHASES).astype(int)
+        # a fraction rounded up to a whole pixel moves the anchor
+        anchors += phases // PHASES
+        phases = (phases[:, 0] % PHASES) * PHASES + phases[:, 1] % PHASES
+
+        anchors = np.clip(anchors + border, border, [height + border, width + border])
+        offsets = sprite_pixels[..., 0] * canvas_width + sprite_pixels[..., 1]
+        pixels = (anchors[:, 0] * canvas_width + anchors[:, 1])[:, np.newaxis] + offsets[phases]
+        canvas[pixels.reshape(-1)] = sprite_labels[phases].reshape(-1)
+
+    colors = np.concatenate([[background], palette]).astype(np.uint8)
+    canvas = canvas.reshape(height + 2 * border, canvas_width)[border:border + height, border:border + width]
+    return colors[canvas]
+
+
+def render_grid(volumes, num_columns=None, tile_size=(128, 128), padding=2, **render_args):
+    """
+    Render several volumes as the tiles of one image, row by row
+    Args:
+        volumes: N x X x Y x Z occupancy (or a list of volumes)
+        num_columns: tiles per row, about sqrt(N) if None
+    Returns: rows x columns image of the tiles
+    """
+    num_volumes = len(volumes)
+    num_columns = num_columns or int(np.ceil(np.sqrt(num_volumes)))
+    num_rows = int(np.ceil(num_volumes / float(num_columns)))
+    background = render_args.get('background', BACKGROUND)
+    tile_height, tile_width = tile_size
+    grid = np.empty((num_rows * (tile_height + padding) + padding, num_columns * (tile_width + padding) + padding, 3),
+                    dtype=np.uint8)
+    grid[:] = background
+    for i, volume in enumerate(volumes):
+        row, column = divmod(i, num_columns)
+        top, left = padding + row * (tile_height + padding), padding + column * (tile_width + padding)
+        grid[top:top + tile_height, left:left + tile_width] = render_voxels(volume, tile_size, **render_args)
+    return grid
+
+
+def save_png(image, file_path):
+    Image.fromarray(image).save(file_path)
+
+
+def save_voxel_png(voxels, file_path, **render_args):
+    save_png(render_voxels(voxels, **render_args), file_path)